@@ -21,6 +21,31 @@ ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='localhost,127.0.0.1').split(','
 
 # OpenWeatherMap API Key
 OPENWEATHERMAP_API_KEY = config('OPENWEATHERMAP_API_KEY')
+# Upstream quota, enforced across all processes (free tier: 60 calls/min)
+OPENWEATHERMAP_CALLS_PER_MINUTE = config('OPENWEATHERMAP_CALLS_PER_MINUTE', default=60, cast=int)
+OPENWEATHERMAP_CALLS_PER_DAY = config('OPENWEATHERMAP_CALLS_PER_DAY', default=30000, cast=int)
+# Circuit breaker: open after this many consecutive failures, probe again after RESET seconds
+OPENWEATHERMAP_BREAKER_THRESHOLD = config('OPENWEATHERMAP_BREAKER_THRESHOLD', default=5, cast=int)
+OPENWEATHERMAP_BREAKER_RESET = config('OPENWEATHERMAP_BREAKER_RESET', default=60, cast=int)
+# Share of the quota the weather_scheduler daemon may use; the rest is left for request paths
+WEATHER_SCHEDULER_CALLS_PER_MINUTE = config(
+    'WEATHER_SCHEDULER_CALLS_PER_MINUTE', default=int(OPENWEATHERMAP_CALLS_PER_MINUTE * 0.8), cast=int
+)
+# Use One Call 3.0 (current + hourly + daily + UV in one request) when the key allows it
+OPENWEATHERMAP_ONECALL = config('OPENWEATHERMAP_ONECALL', default=True, cast=bool)
+# Shared HTTP client: keep-alive pool size, retries on 429/5xx, timeouts in seconds
+OPENWEATHERMAP_POOL_SIZE = config('OPENWEATHERMAP_POOL_SIZE', default=10, cast=int)
+OPENWEATHERMAP_MAX_RETRIES = config('OPENWEATHERMAP_MAX_RETRIES', default=3, cast=int)
+OPENWEATHERMAP_BACKOFF_FACTOR = config('OPENWEATHERMAP_BACKOFF_FACTOR', default=0.5, cast=float)
+OPENWEATHERMAP_CONNECT_TIMEOUT = config('OPENWEATHERMAP_CONNECT_TIMEOUT', default=3.05, cast=float)
+OPENWEATHERMAP_READ_TIMEOUT = config('OPENWEATHERMAP_READ_TIMEOUT', default=10, cast=float)
+# Provider: 'live', 'record' (live + save responses), 'replay' (recorded only) or 'fake' (recorded or synthetic)
+OPENWEATHERMAP_PROVIDER = config('OPENWEATHERMAP_PROVIDER', default='live')
+OPENWEATHERMAP_HOST = config('OPENWEATHERMAP_HOST', default='https://api.openweathermap.org')
+OPENWEATHERMAP_FIXTURES_DIR = config('OPENWEATHERMAP_FIXTURES_DIR', default=str(BASE_DIR / 'owm_fixtures'))
+# Fake provider: mean added latency in seconds and share of calls that fail with a 503
+OPENWEATHERMAP_FAKE_LATENCY = config('OPENWEATHERMAP_FAKE_LATENCY', default=0.0, cast=float)
+OPENWEATHERMAP_FAKE_ERROR_RATE = config('OPENWEATHERMAP_FAKE_ERROR_RATE', default=0.0, cast=float)
 
 # Application definition
 INSTALLED_APPS = [
@@ -93,6 +118,56 @@ else:
         }
     }
 
+# Stale-while-revalidate: serve stale weather immediately and refresh it on a
+# background thread, until data is older than the hard-stale limit
+WEATHER_STALE_WHILE_REVALIDATE = config('WEATHER_STALE_WHILE_REVALIDATE', default=True, cast=bool)
+WEATHER_HARD_STALE_MINUTES = config('WEATHER_HARD_STALE_MINUTES', default=120, cast=int)
+WEATHER_REFRESH_WORKERS = config('WEATHER_REFRESH_WORKERS', default=4, cast=int)
+
+# Geocoding of city names not in the DB: seconds to remember places found and
+# names that matched nothing
+GEOCODE_TTL = config('GEOCODE_TTL', default=30 * 24 * 3600, cast=int)
+GEOCODE_NEGATIVE_TTL = config('GEOCODE_NEGATIVE_TTL', default=6 * 3600, cast=int)
+
+# Live updates (/api/stream/): 'local' fans out within one process; 'postgres'
+# uses LISTEN/NOTIFY so every worker and the scheduler reach every subscriber
+WEATHER_BROADCAST_BACKEND = config('WEATHER_BROADCAST_BACKEND', default='local')
+# Seconds between keep-alive comments on idle streams
+WEATHER_STREAM_HEARTBEAT = config('WEATHER_STREAM_HEARTBEAT', default=15, cast=int)
+
+# Cache
+# Also holds the per-city refresh locks and the response cache versions. Use a
+# shared backend (database cache, Redis or Memcached) when running several
+# processes: it is required for refreshes to be coalesced across them and for
+# ingest in another process (fetch_weather, weather_scheduler, import_history)
+# to invalidate cached responses before their TTL runs out,
+# e.g. CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='lankaweather'),
+    },
+    # Serialized API responses. LocMemCache evicts least recently used entries
+    # once MAX_ENTRIES is reached; invalidation goes through versions in 'default'.
+    'responses': {
+        'BACKEND': config('RESPONSE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('RESPONSE_CACHE_LOCATION', default='lankaweather-responses'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RESPONSE_CACHE_MAX_ENTRIES', default=2000, cast=int),
+        },
+    },
+}
+
+# Response cache for read-only weather APIs. Entries never outlive the data's
+# freshness and are skipped when less than MIN_TTL seconds of it remain.
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_MIN_TTL = config('RESPONSE_CACHE_MIN_TTL', default=5, cast=int)
+RESPONSE_CACHE_MAX_TTL = config('RESPONSE_CACHE_MAX_TTL', default=600, cast=int)
+
+# Directory of the memory-mapped columnar copy of the daily history, used for
+# daily chart series; empty disables it. Fill it with rebuild_history_store.
+HISTORY_STORE_DIR = config('HISTORY_STORE_DIR', default='')
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -100,6 +175,10 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_RATES': {
+        # Lookups of city names we don't have yet, per user or IP
+        'new_city': config('NEW_CITY_RATE', default='10/hour'),
+    },
 }
 
 
@@ -15,9 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('weather.urls')),
 ]
+
+# runserver serves static files itself in DEBUG; this does the same under uvicorn
+urlpatterns += staticfiles_urlpatterns()
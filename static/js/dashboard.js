@@ -25,65 +25,13 @@ const alertsContainer = document.getElementById("alerts-container");
 const activitiesContainer = document.getElementById("activities-container");
 
 // ─── API Functions ─────────────────────────────────────────────────
-async function fetchCurrentWeather(city) {
+async function fetchDashboard(city) {
   try {
-    const res = await fetch(
-      `/api/weather/current/?city=${encodeURIComponent(city)}`,
-    );
-    if (!res.ok) throw new Error("Weather data unavailable");
+    const res = await fetch(`/api/dashboard/?city=${encodeURIComponent(city)}`);
+    if (!res.ok) throw new Error("Dashboard data unavailable");
     return await res.json();
   } catch (e) {
-    console.error("Error fetching current weather:", e);
-    return null;
-  }
-}
-
-async function fetchHourlyForecast(city) {
-  try {
-    const res = await fetch(
-      `/api/weather/hourly/?city=${encodeURIComponent(city)}`,
-    );
-    if (!res.ok) throw new Error("Forecast unavailable");
-    return await res.json();
-  } catch (e) {
-    console.error("Error fetching hourly forecast:", e);
-    return null;
-  }
-}
-
-async function fetchDailyForecast(city) {
-  try {
-    const res = await fetch(
-      `/api/weather/daily/?city=${encodeURIComponent(city)}`,
-    );
-    if (!res.ok) throw new Error("Forecast unavailable");
-    return await res.json();
-  } catch (e) {
-    console.error("Error fetching daily forecast:", e);
-    return null;
-  }
-}
-
-async function fetchAlerts() {
-  try {
-    const res = await fetch("/api/alerts/?limit=3&active=true");
-    if (!res.ok) throw new Error("Alerts unavailable");
-    return await res.json();
-  } catch (e) {
-    console.error("Error fetching alerts:", e);
-    return null;
-  }
-}
-
-async function fetchActivities(city) {
-  try {
-    const res = await fetch(
-      `/api/activities/?city=${encodeURIComponent(city)}`,
-    );
-    if (!res.ok) throw new Error("Activities unavailable");
-    return await res.json();
-  } catch (e) {
-    console.error("Error fetching activities:", e);
+    console.error("Error fetching dashboard:", e);
     return null;
   }
 }
@@ -259,25 +207,52 @@ function renderActivities(data) {
 
 // ─── Load All Data ─────────────────────────────────────────────────
 async function loadDashboard(city) {
-  // Fetch all data in parallel
-  const [current, hourly, daily, alerts, activities] = await Promise.all([
-    fetchCurrentWeather(city),
-    fetchHourlyForecast(city),
-    fetchDailyForecast(city),
-    fetchAlerts(),
-    fetchActivities(city),
-  ]);
+  // Every panel in one round trip
+  const data = (await fetchDashboard(city)) || {};
+
+  renderCurrentWeather(data.current);
+  renderHourlyForecast(data.hourly);
+  renderDailyForecast(data.daily);
+  renderAlerts(data.alerts);
+  renderActivities(data.activities);
+}
+
+// ─── Live Updates ──────────────────────────────────────────────────
+// New readings, forecasts and alerts are pushed over server-sent events;
+// each one just re-fetches the dashboard (cheap thanks to ETags). Servers
+// without ASGI refuse the stream (503), so the dashboard polls instead.
+const POLL_INTERVAL = 60000;
+let liveStream = null;
+let pollTimer = null;
 
-  renderCurrentWeather(current);
-  renderHourlyForecast(hourly);
-  renderDailyForecast(daily);
-  renderAlerts(alerts);
-  renderActivities(activities);
+function pollLive(city) {
+  pollTimer = setInterval(() => loadDashboard(city), POLL_INTERVAL);
+}
+
+function subscribeLive(city) {
+  if (liveStream) liveStream.close();
+  liveStream = null;
+  clearInterval(pollTimer);
+  if (!window.EventSource) return pollLive(city);
+
+  const stream = new EventSource(`/api/stream/?cities=${encodeURIComponent(city)}`);
+  ["weather", "forecast", "alert"].forEach((type) =>
+    stream.addEventListener(type, () => loadDashboard(city)),
+  );
+  // The browser reconnects after dropped streams but gives up on error responses
+  stream.onerror = () => {
+    if (stream === liveStream && stream.readyState === EventSource.CLOSED) {
+      liveStream = null;
+      pollLive(city);
+    }
+  };
+  liveStream = stream;
 }
 
 // ─── Event Listeners ───────────────────────────────────────────────
 document.addEventListener("cityChanged", (e) => {
   loadDashboard(e.detail.city);
+  subscribeLive(e.detail.city);
 });
 
 document.addEventListener("unitChanged", () => {
@@ -288,3 +263,4 @@ document.addEventListener("unitChanged", () => {
 
 // ─── Initialize ────────────────────────────────────────────────────
 loadDashboard(window.LW.currentCity);
+subscribeLive(window.LW.currentCity);
@@ -61,17 +61,24 @@ document.querySelectorAll(".layer-btn").forEach((btn) => {
 document.getElementById("locate-btn").addEventListener("click", () => {
   if (!navigator.geolocation) return;
   navigator.geolocation.getCurrentPosition(
-    (pos) => {
-      map.flyTo([pos.coords.latitude, pos.coords.longitude], 11);
+    async (pos) => {
+      const nearest = await fetchNearestCity(
+        pos.coords.latitude,
+        pos.coords.longitude,
+      );
+      if (nearest) selectCity(nearest);
+      else map.flyTo([pos.coords.latitude, pos.coords.longitude], 11);
     },
     (err) => console.warn("Geolocation failed:", err),
   );
 });
 
 // ─── API Functions ─────────────────────────────────────────────────
+// Only the cities inside the visible map area
 async function fetchExplorerCities() {
   try {
-    const res = await fetch("/api/explorer/cities/");
+    const bbox = map.getBounds().toBBoxString();
+    const res = await fetch(`/api/explorer/cities/?bbox=${bbox}`);
     return await res.json();
   } catch (e) {
     console.error("Error fetching explorer cities:", e);
@@ -79,6 +86,25 @@ async function fetchExplorerCities() {
   }
 }
 
+async function fetchNearestCity(lat, lon) {
+  try {
+    const res = await fetch(`/api/weather/nearest/?lat=${lat}&lon=${lon}&k=1`);
+    if (!res.ok) return null;
+    const [nearest] = await res.json();
+    if (!nearest) return null;
+    return {
+      id: nearest.id,
+      name: nearest.city,
+      latitude: nearest.lat,
+      longitude: nearest.lon,
+      current_weather: nearest.weather,
+    };
+  } catch (e) {
+    console.error("Error fetching nearest city:", e);
+    return null;
+  }
+}
+
 async function fetchActivities() {
   try {
     const res = await fetch("/api/activities/");
@@ -218,6 +244,20 @@ function renderActivities(data) {
 }
 
 // ─── Bootstrap ─────────────────────────────────────────────────────
+let refreshTimer = null;
+
+// Reload the markers for the new view once panning/zooming settles
+function refreshMarkersOnMove() {
+  map.on("moveend", () => {
+    clearTimeout(refreshTimer);
+    refreshTimer = setTimeout(async () => {
+      const cities = await fetchExplorerCities();
+      addCityMarkers(cities);
+      renderCitiesList(cities);
+    }, 250);
+  });
+}
+
 async function loadExplorer() {
   initMap();
 
@@ -233,6 +273,7 @@ async function loadExplorer() {
   }
 
   renderActivities(activities);
+  refreshMarkersOnMove();
 }
 
 loadExplorer();
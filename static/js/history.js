@@ -45,30 +45,27 @@ async function fetchClimateNormals() {
 // ─── Render Functions ──────────────────────────────────────────────
 function renderStats(data) {
   if (!data) return;
-  document.getElementById("stat-temp").textContent = `${data.avg_temp}°C`;
+  const show = (value, format) => (value === null ? "--" : format(value));
+  document.getElementById("stat-temp").textContent = show(data.avg_temp, (v) => `${v}°C`);
   document.getElementById("stat-rainfall").textContent =
-    `${data.total_rainfall.toLocaleString()}mm`;
+    show(data.total_rainfall, (v) => `${v.toLocaleString()}mm`);
   document.getElementById("stat-humidity").textContent =
-    `${data.avg_humidity}%`;
-  document.getElementById("stat-events").textContent = String(
-    data.extreme_events,
-  ).padStart(2, "0");
+    show(data.avg_humidity, (v) => `${v}%`);
+  document.getElementById("stat-events").textContent = show(
+    data.extreme_events, (v) => String(v).padStart(2, "0"),
+  );
 
-  const tempTrend = document.getElementById("stat-temp-trend");
-  tempTrend.textContent = `${data.temp_trend > 0 ? "+" : ""}${data.temp_trend}%`;
-  tempTrend.className = `font-bold ${data.temp_trend > 0 ? "text-green-500" : "text-red-500"}`;
-
-  const rainfallTrend = document.getElementById("stat-rainfall-trend");
-  rainfallTrend.textContent = `${data.rainfall_trend > 0 ? "+" : ""}${data.rainfall_trend}%`;
-  rainfallTrend.className = `font-bold ${data.rainfall_trend > 0 ? "text-green-500" : "text-red-500"}`;
-
-  const humidityTrend = document.getElementById("stat-humidity-trend");
-  humidityTrend.textContent = `${data.humidity_trend > 0 ? "+" : ""}${data.humidity_trend}%`;
-  humidityTrend.className = `font-bold ${data.humidity_trend > 0 ? "text-green-500" : "text-red-500"}`;
-
-  const eventsTrend = document.getElementById("stat-events-trend");
-  eventsTrend.textContent = `${data.events_trend > 0 ? "+" : ""}${data.events_trend}`;
-  eventsTrend.className = `font-bold ${data.events_trend > 0 ? "text-red-500" : "text-green-500"}`;
+  // Trends are null without at least two years of data
+  const renderTrend = (id, value, unit, risingIsGood) => {
+    const el = document.getElementById(id);
+    el.textContent = show(value, (v) => `${v > 0 ? "+" : ""}${v}${unit}`);
+    const good = value > 0 === risingIsGood;
+    el.className = `font-bold ${value === null ? "text-gray-400" : good ? "text-green-500" : "text-red-500"}`;
+  };
+  renderTrend("stat-temp-trend", data.temp_trend, "%", true);
+  renderTrend("stat-rainfall-trend", data.rainfall_trend, "%", true);
+  renderTrend("stat-humidity-trend", data.humidity_trend, "%", true);
+  renderTrend("stat-events-trend", data.events_trend, "", false);
 }
 
 function renderChart(data) {
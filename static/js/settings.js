@@ -19,7 +19,7 @@
 
   async function fetchCities() {
     try {
-      const res = await fetch("/api/explorer/cities/");
+      const res = await fetch("/api/cities/search/");
       return await res.json();
     } catch (e) {
       return [];
@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     City, CurrentWeather, HourlyForecast, DailyForecast,
     WeatherAlert, AlertPreference, HistoricalRecord,
-    ClimateNormal, ActivityOutlook
+    ClimateNormal, ActivityOutlook, UpstreamQuota
 )
 
 
@@ -57,3 +57,9 @@ class ClimateNormalAdmin(admin.ModelAdmin):
 class ActivityOutlookAdmin(admin.ModelAdmin):
     list_display = ['activity_name', 'location', 'suitability', 'updated_at']
     list_filter = ['suitability']
+
+
+@admin.register(UpstreamQuota)
+class UpstreamQuotaAdmin(admin.ModelAdmin):
+    list_display = ['period', 'window_start', 'calls']
+    list_filter = ['period']
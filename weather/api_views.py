@@ -1,23 +1,107 @@
 """
 REST API views for the LankaWeather backend.
 """
+import asyncio
+import json
+from datetime import date, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Avg, Sum, Count, Q
+from django.db.models import Sum, Count, Max, Q
 from .models import (
-    City, CurrentWeather, HourlyForecast, DailyForecast,
-    WeatherAlert, AlertPreference, HistoricalRecord,
+    City, HourlyForecast, DailyForecast,
+    WeatherAlert, AlertPreference, HistoryRollup,
     ClimateNormal, ActivityOutlook, Profile
 )
 from .serializers import (
     CurrentWeatherSerializer, HourlyForecastSerializer, DailyForecastSerializer,
-    WeatherAlertSerializer, AlertPreferenceSerializer, HistoricalRecordSerializer,
+    WeatherAlertSerializer, AlertPreferenceSerializer,
     ClimateNormalSerializer, ActivityOutlookSerializer, ExplorerCitySerializer, ProfileSerializer,
-    HistoryStatsSerializer
 )
-from . import services
+from . import broadcast, city_registry, geocoding, history_store, response_cache, rollups, services, trends
+from .conditional import Validators
+from .throttles import NewCityRateThrottle
+
+
+def freshness_left(fetched_at, ttl):
+    """Seconds until data fetched at `fetched_at` goes stale (0 if it already has)"""
+    if fetched_at is None:
+        return 0
+    return max(0, int((fetched_at + ttl - timezone.now()).total_seconds()))
+
+
+def forecast_clock():
+    """
+    Forecasts also depend on the clock: past hours drop out of the hourly
+    list and 'Today' moves at local midnight. Returns (when the clock last
+    changed them, seconds until it next does).
+    """
+    now = timezone.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    midnight = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    changes = [hour + timedelta(hours=1), midnight + timedelta(days=1)]
+    return max(hour, midnight), int((min(changes) - now).total_seconds()) + 1
+
+
+# Most days of daily forecast a request may ask for
+MAX_FORECAST_DAYS = 16
+
+
+def forecast_days(params, default=7):
+    """The `days` query parameter clamped to 1..MAX_FORECAST_DAYS; ValueError if it isn't a number"""
+    return min(max(int(params.get('days', default)), 1), MAX_FORECAST_DAYS)
+
+
+def cached_response(data, hit):
+    response = Response(data)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+# How long clients may reuse responses whose data has no TTL of its own:
+# alerts and map markers change at any time, reference data rarely
+LIVE_MAX_AGE = 60
+REFERENCE_MAX_AGE = 300
+
+
+def table_state(queryset):
+    """
+    Cheap version of a set of rows: how many there are and when one last
+    changed. Read from the database, so it sees writes made by any process.
+    """
+    state = queryset.aggregate(n=Count('id'), changed=Max('updated_at'))
+    return state['n'], state['changed']
+
+
+def city_for_new_name(request, city_name):
+    """
+    Find or add the city for a name the registry doesn't know, through the
+    cached geocoder. Lookups that would reach the geocoder are rate limited
+    per client. Returns (city, None) or (None, (error message, status)).
+    """
+    if geocoding.cached(city_name) is None and not NewCityRateThrottle().allow_request(request, None):
+        return None, ('Too many unknown city names, try again later', 429)
+    place = geocoding.geocode(city_name)
+    if not place:
+        return None, (f'City "{city_name}" not found', 404)
+
+    # The geocoder's spelling may be one we already have
+    try:
+        return city_registry.get_city(place['name'], City.objects.select_related('latest_weather')), None
+    except City.DoesNotExist:
+        pass
+    city, _ = City.objects.get_or_create(
+        name=place['name'], defaults={'lat': place['lat'], 'lon': place['lon'], 'province': place['province']}
+    )
+    return city, None
 
 
 class CurrentWeatherView(APIView):
@@ -25,23 +109,144 @@ class CurrentWeatherView(APIView):
     def get(self, request):
         city_name = request.query_params.get('city', 'Colombo')
         try:
-            city = City.objects.get(name__iexact=city_name)
+            city = city_registry.get_city(city_name, City.objects.select_related('latest_weather'))
         except City.DoesNotExist:
-            # Try to create city from API
-            weather_data = services.fetch_current_weather(city_name)
-            if not weather_data:
-                return Response({'error': f'City "{city_name}" not found'}, status=404)
-            lat = weather_data.pop('lat', 0)
-            lon = weather_data.pop('lon', 0)
-            city = City.objects.create(name=city_name.title(), lat=lat, lon=lon, province='Sri Lanka')
-            CurrentWeather.objects.create(city=city, **weather_data)
-            current = city.current_weather.first()
-            return Response(CurrentWeatherSerializer(current).data)
+            city, error = city_for_new_name(request, city_name)
+            if error:
+                return Response({'error': error[0]}, status=error[1])
 
+        services.record_demand(city)
         current = services.get_or_update_current_weather(city)
         if not current:
             return Response({'error': 'Weather data unavailable'}, status=503)
-        return Response(CurrentWeatherSerializer(current).data)
+
+        max_age = freshness_left(current.fetched_at, services.CURRENT_WEATHER_TTL)
+        validators = Validators('current', current.pk, last_modified=current.fetched_at, max_age=max_age)
+
+        def build():
+            data, hit = response_cache.get_or_build(
+                'current', [response_cache.city_scope(city, 'current')], {'city': city.pk},
+                lambda: (dict(CurrentWeatherSerializer(current).data), max_age)
+            )
+            return cached_response(data, hit)
+
+        return validators.respond(request, build)
+
+
+class BulkCurrentWeatherView(APIView):
+    """
+    GET /api/weather/current/bulk/?cities=Colombo,Kandy,Galle
+    POST /api/weather/current/bulk/ {"cities": ["Colombo", "Kandy"]}
+    Latest current weather for many cities, with per-city freshness.
+    """
+    MAX_CITIES = 100
+
+    def get(self, request):
+        return self.respond(request.query_params.get('cities', '').split(','))
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object like {"cities": ["Colombo"]}'}, status=400)
+        names = request.data.get('cities', [])
+        if isinstance(names, str):
+            names = names.split(',')
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            return Response({'error': 'cities must be a list of names'}, status=400)
+        return self.respond(names)
+
+    def respond(self, names):
+        # One entry per city however it is spelled; the first spelling is kept
+        unique = {}
+        for name in names:
+            unique.setdefault(city_registry.normalize(name), name.strip())
+        unique.pop('', None)
+        names = list(unique.values())
+        if not names:
+            return Response({'error': 'No cities given'}, status=400)
+        if len(names) > self.MAX_CITIES:
+            return Response({'error': f'At most {self.MAX_CITIES} cities per request'}, status=400)
+
+        ids = {name.lower(): city_registry.registry.resolve(name) for name in names}
+        by_id = City.objects.select_related('latest_weather').in_bulk([pk for pk in ids.values() if pk])
+        by_name = {name: by_id[pk] for name, pk in ids.items() if pk in by_id}
+        cities = list(by_id.values())
+        for city in cities:
+            services.record_demand(city)
+        latest = services.get_or_update_current_weather_bulk(cities)
+
+        readings = sorted((pk, r.pk) for pk, r in latest.items())
+        fetched = [r.fetched_at for r in latest.values()]
+        validators = Validators(
+            'bulk', names, readings,
+            last_modified=max(fetched) if fetched else None,
+            max_age=min(freshness_left(f, services.CURRENT_WEATHER_TTL) for f in fetched) if fetched else 0,
+        )
+        return validators.respond(self.request, lambda: self.build(names, by_name, latest))
+
+    def build(self, names, by_name, latest):
+        results = []
+        for name in names:
+            city = by_name.get(name.lower())
+            if city is None:
+                continue
+            current = latest.get(city.pk)
+            results.append({
+                'city': city.name,
+                'fresh': bool(current) and not services.is_stale(current.fetched_at, services.CURRENT_WEATHER_TTL),
+                'fetched_at': current.fetched_at if current else None,
+                'weather': CurrentWeatherSerializer(current).data if current else None,
+            })
+        not_found = [name for name in names if name.lower() not in by_name]
+        return Response({'results': results, 'not_found': not_found})
+
+
+class NearestWeatherView(APIView):
+    """GET /api/weather/nearest/?lat=6.93&lon=79.85&k=3 - Current weather at the k nearest cities"""
+    MAX_K = 20
+
+    def get(self, request):
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+            k = int(request.query_params.get('k', 1))
+        except (KeyError, ValueError):
+            return Response({'error': 'lat and lon are required and must be numbers'}, status=400)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({'error': 'lat or lon out of range'}, status=400)
+        if not 1 <= k <= self.MAX_K:
+            return Response({'error': f'k must be between 1 and {self.MAX_K}'}, status=400)
+
+        nearest = city_registry.registry.nearest(lat, lon, k)
+        by_id = City.objects.select_related('latest_weather').in_bulk([entry['id'] for entry, _ in nearest])
+        nearest = [(by_id[entry['id']], distance) for entry, distance in nearest if entry['id'] in by_id]
+        cities = [city for city, _ in nearest]
+        for city in cities:
+            services.record_demand(city)
+        latest = services.get_or_update_current_weather_bulk(cities)
+
+        fetched = [r.fetched_at for r in latest.values()]
+        validators = Validators(
+            'nearest', round(lat, 4), round(lon, 4), k, sorted((pk, r.pk) for pk, r in latest.items()),
+            last_modified=max(fetched) if fetched else None,
+            max_age=min(freshness_left(f, services.CURRENT_WEATHER_TTL) for f in fetched) if fetched else 0,
+        )
+        return validators.respond(request, lambda: self.build(nearest, latest))
+
+    def build(self, nearest, latest):
+        results = []
+        for city, distance in nearest:
+            current = latest.get(city.pk)
+            results.append({
+                'id': city.pk,
+                'city': city.name,
+                'province': city.province,
+                'lat': city.lat,
+                'lon': city.lon,
+                'distance_km': round(distance, 1),
+                'fresh': bool(current) and not services.is_stale(current.fetched_at, services.CURRENT_WEATHER_TTL),
+                'weather': CurrentWeatherSerializer(current).data if current else None,
+            })
+        return Response(results)
 
 
 class HourlyForecastView(APIView):
@@ -49,28 +254,71 @@ class HourlyForecastView(APIView):
     def get(self, request):
         city_name = request.query_params.get('city', 'Colombo')
         try:
-            city = City.objects.get(name__iexact=city_name)
+            city = city_registry.get_city(city_name)
         except City.DoesNotExist:
             return Response({'error': f'City "{city_name}" not found'}, status=404)
 
-        hourly, _ = services.get_or_update_forecasts(city)
-        serializer = HourlyForecastSerializer(hourly, many=True)
-        return Response(serializer.data)
+        services.record_demand(city)
+
+        def build():
+            hourly, _ = services.get_or_update_forecasts(city)
+            data = list(HourlyForecastSerializer(hourly, many=True).data)
+            return data, freshness_left(city.forecast_fetched_at, services.FORECAST_TTL)
+
+        return forecast_response(request, 'hourly', city, {'city': city.pk}, build)
 
 
 class DailyForecastView(APIView):
     """GET /api/weather/daily/?city=Colombo&days=7"""
     def get(self, request):
         city_name = request.query_params.get('city', 'Colombo')
-        days = int(request.query_params.get('days', 7))
         try:
-            city = City.objects.get(name__iexact=city_name)
+            days = forecast_days(request.query_params)
+        except ValueError:
+            return Response({'error': 'days must be a number'}, status=400)
+        try:
+            city = city_registry.get_city(city_name)
         except City.DoesNotExist:
             return Response({'error': f'City "{city_name}" not found'}, status=404)
 
-        _, daily = services.get_or_update_forecasts(city)
-        serializer = DailyForecastSerializer(daily[:days], many=True)
-        return Response(serializer.data)
+        services.record_demand(city)
+
+        def build():
+            _, daily = services.get_or_update_forecasts(city)
+            data = list(DailyForecastSerializer(daily[:days], many=True).data)
+            return data, freshness_left(city.forecast_fetched_at, services.FORECAST_TTL)
+
+        return forecast_response(request, 'daily', city, {'city': city.pk, 'days': days}, build)
+
+
+def forecast_response(request, view, city, params, build):
+    """
+    Cached, conditional forecast response. Fresh forecasts are validated
+    against city.forecast_fetched_at and the forecast_clock() before anything
+    is read; stale ones are refreshed (or served stale) first and validated
+    against what was served.
+    """
+    since, until = forecast_clock()
+
+    def validators():
+        fetched_at = city.forecast_fetched_at
+        return Validators(
+            view, sorted(params.items()), fetched_at, since,
+            last_modified=max(fetched_at, since) if fetched_at else None,
+            max_age=min(freshness_left(fetched_at, services.FORECAST_TTL), until),
+        )
+
+    if not services.is_stale(city.forecast_fetched_at, services.FORECAST_TTL):
+        not_modified = validators().not_modified(request)
+        if not_modified:
+            return not_modified
+
+    def timed_build():
+        data, ttl = build()
+        return data, min(ttl, until)
+
+    data, hit = response_cache.get_or_build(view, [response_cache.city_scope(city, 'forecast')], params, timed_build)
+    return validators().respond(request, lambda: cached_response(data, hit))
 
 
 class AlertListView(APIView):
@@ -86,21 +334,33 @@ class AlertListView(APIView):
         if severity:
             queryset = queryset.filter(severity=severity.upper())
 
-        serializer = WeatherAlertSerializer(queryset[:limit], many=True)
-        return Response(serializer.data)
+        count, changed = table_state(queryset)
+        validators = Validators(
+            'alerts', active_only, severity, limit, count, changed,
+            last_modified=changed, max_age=LIVE_MAX_AGE,
+        )
+        return validators.respond(
+            request, lambda: Response(WeatherAlertSerializer(queryset[:limit], many=True).data)
+        )
 
 
 class AlertStatsView(APIView):
     """GET /api/alerts/stats/"""
     def get(self, request):
         active_alerts = WeatherAlert.objects.filter(is_active=True)
-        stats = {
-            'red': active_alerts.filter(severity='RED').count(),
-            'orange': active_alerts.filter(severity='ORANGE').count(),
-            'yellow': active_alerts.filter(severity='YELLOW').count(),
-            'total': active_alerts.count(),
-        }
-        return Response(stats)
+        count, changed = table_state(WeatherAlert.objects.all())
+        validators = Validators('alert-stats', count, changed, last_modified=changed, max_age=LIVE_MAX_AGE)
+
+        def build():
+            stats = active_alerts.aggregate(
+                red=Count('id', filter=Q(severity='RED')),
+                orange=Count('id', filter=Q(severity='ORANGE')),
+                yellow=Count('id', filter=Q(severity='YELLOW')),
+                total=Count('id'),
+            )
+            return Response(stats)
+
+        return validators.respond(request, build)
 
 
 class AlertPreferenceView(APIView):
@@ -118,84 +378,77 @@ class AlertPreferenceView(APIView):
         return Response(serializer.errors, status=400)
 
 
+def history_years(request):
+    """The (start, end) years of a history request, or None if they are invalid"""
+    try:
+        start_year = int(request.query_params.get('start', 2018))
+        end_year = int(request.query_params.get('end', 2023))
+    except ValueError:
+        return None
+    if not date.min.year <= start_year <= end_year < date.max.year:
+        return None
+    return start_year, end_year
+
+
 class HistoryStatsView(APIView):
     """GET /api/history/stats/?city=Colombo&start=2018&end=2023"""
     def get(self, request):
         city_name = request.query_params.get('city', 'Colombo')
-        start_year = int(request.query_params.get('start', 2018))
-        end_year = int(request.query_params.get('end', 2023))
+        years = history_years(request)
+        if years is None:
+            return Response({'error': 'start and end must be years with start <= end'}, status=400)
+        start_year, end_year = years
 
         try:
-            city = City.objects.get(name__iexact=city_name)
+            city = city_registry.get_city(city_name)
         except City.DoesNotExist:
             return Response({'error': 'City not found'}, status=404)
 
-        records = HistoricalRecord.objects.filter(
-            city=city,
-            date__year__gte=start_year,
-            date__year__lte=end_year
-        )
-
-        stats = records.aggregate(
-            avg_temp=Avg('avg_temp'),
-            total_rainfall=Sum('rainfall'),
-            avg_humidity=Avg('humidity'),
-            extreme_events=Count('id', filter=Q(is_extreme_event=True))
+        data, hit = response_cache.get_or_build(
+            'history-stats', [rollups.history_scope(city.pk)],
+            {'city': city.pk, 'start': start_year, 'end': end_year},
+            lambda: (trends.summary(city.pk, start_year, end_year), settings.RESPONSE_CACHE_MAX_TTL)
         )
-
-        # Provide defaults if no data
-        data = {
-            'avg_temp': round(stats['avg_temp'] or 27.5, 1),
-            'total_rainfall': round(stats['total_rainfall'] or 1240, 1),
-            'avg_humidity': round(stats['avg_humidity'] or 78, 1),
-            'extreme_events': stats['extreme_events'] or 4,
-            'temp_trend': 1.2,
-            'rainfall_trend': -5.4,
-            'humidity_trend': 0.8,
-            'events_trend': 2,
-        }
-
-        return Response(data)
+        return cached_response(data, hit)
 
 
 class HistoryChartView(APIView):
-    """GET /api/history/chart/?city=Colombo&metric=rainfall&start=2018&end=2023"""
+    """
+    GET /api/history/chart/?city=Colombo&metric=rainfall&start=2018&end=2023
+    Monthly points from the rollups; yearly ones for ranges over MAX_MONTHLY_POINTS months.
+    With resolution=day, one point per recorded day from the columnar history store.
+    """
+    MAX_MONTHLY_POINTS = 240
+
     def get(self, request):
         city_name = request.query_params.get('city', 'Colombo')
-        start_year = int(request.query_params.get('start', 2018))
-        end_year = int(request.query_params.get('end', 2023))
+        years = history_years(request)
+        if years is None:
+            return Response({'error': 'start and end must be years with start <= end'}, status=400)
+        start_year, end_year = years
 
         try:
-            city = City.objects.get(name__iexact=city_name)
+            city = city_registry.get_city(city_name)
         except City.DoesNotExist:
             return Response({'error': 'City not found'}, status=404)
 
-        records = HistoricalRecord.objects.filter(
-            city=city,
-            date__year__gte=start_year,
-            date__year__lte=end_year
-        ).order_by('date')
-
-        # Group by month for chart
-        from django.db.models.functions import TruncMonth
-        monthly = records.annotate(
-            month=TruncMonth('date')
-        ).values('month').annotate(
-            avg_temp=Avg('avg_temp'),
-            total_rainfall=Sum('rainfall'),
-            avg_humidity=Avg('humidity')
-        ).order_by('month')
+        if request.query_params.get('resolution') == 'day':
+            return Response(history_store.daily_series(city.pk, *rollups.year_range(start_year, end_year)))
+
+        monthly = (end_year - start_year + 1) * 12 <= self.MAX_MONTHLY_POINTS
+        period = HistoryRollup.MONTH if monthly else HistoryRollup.YEAR
+        points = rollups.periods(city.pk, period, *rollups.year_range(start_year, end_year)).order_by('start')
 
         labels = []
         temp_data = []
         rainfall_data = []
         humidity_data = []
 
-        for entry in monthly:
-            labels.append(entry['month'].strftime('%b %Y'))
-            temp_data.append(round(entry['avg_temp'] or 0, 1))
-            rainfall_data.append(round(entry['total_rainfall'] or 0, 1))
-            humidity_data.append(round(entry['avg_humidity'] or 0, 1))
+        for point in points:
+            labels.append(point.start.strftime('%b %Y' if monthly else '%Y'))
+            temp_data.append(round(point.avg_temp or 0, 1))
+            rainfall_data.append(round(point.rainfall_sum, 1))
+            humidity_data.append(round(point.avg_humidity or 0, 1))
 
         # If no data, provide sample data
         if not labels:
@@ -217,6 +470,19 @@ class HistoryChartView(APIView):
 class ClimateNormalView(APIView):
     """GET /api/history/climate-normals/"""
     def get(self, request):
+        state = table_state(ClimateNormal.objects.all())
+        validators = Validators('climate-normals', state, max_age=REFERENCE_MAX_AGE)
+
+        def build():
+            data, hit = response_cache.get_or_build(
+                'climate-normals', ['climatenormal'], {'state': state},
+                lambda: (self.build(), settings.RESPONSE_CACHE_MAX_TTL)
+            )
+            return cached_response(data, hit)
+
+        return validators.respond(request, build)
+
+    def build(self):
         normals = ClimateNormal.objects.all()
         if not normals.exists():
             # Return default data
@@ -230,46 +496,173 @@ class ClimateNormalView(APIView):
                 {'station_name': 'Diyatalawa', 'max_temp': 24.5, 'min_temp': 15.2,
                  'annual_rainfall': 1620.0, 'rainy_days': 195, 'sunshine_hours': 1980},
             ]
-            return Response(default_data)
-        serializer = ClimateNormalSerializer(normals, many=True)
-        return Response(serializer.data)
+            return default_data
+        return list(ClimateNormalSerializer(normals, many=True).data)
 
 
 class ActivityView(APIView):
     """GET /api/activities/?city=Colombo"""
     def get(self, request):
         city_name = request.query_params.get('city')
-        queryset = ActivityOutlook.objects.all()
+        city = city_registry.registry.resolve(city_name) if city_name else None
+        city_id = city or ''
+        state = table_state(ActivityOutlook.objects.all())
+        validators = Validators('activities', city_id, state, max_age=REFERENCE_MAX_AGE)
+
+        def build():
+            data, hit = response_cache.get_or_build(
+                'activities', ['activityoutlook'], {'city': city_id, 'state': state},
+                lambda: (activities_for(city), settings.RESPONSE_CACHE_MAX_TTL)
+            )
+            return cached_response(data, hit)
+
+        return validators.respond(request, build)
+
+
+# Shown when no activity outlooks have been entered
+DEFAULT_ACTIVITIES = [
+    {'activity_name': 'Surfing', 'location': 'Hikkaduwa', 'suitability': 'GREAT',
+     'suitability_color': 'green', 'description': 'Great wave conditions', 'icon': 'surfing'},
+    {'activity_name': 'Hiking', 'location': 'Ella Rock', 'suitability': 'FAIR',
+     'suitability_color': 'yellow', 'description': 'Moderate cloud cover', 'icon': 'hiking'},
+    {'activity_name': 'Sigiriya Tour', 'location': 'Sigiriya', 'suitability': 'POOR',
+     'suitability_color': 'red', 'description': 'Heavy rainfall expected', 'icon': 'tour'},
+]
+
+
+def activities_for(city=None):
+    """Serialized activity outlooks for a city (plus nationwide ones), or the defaults"""
+    queryset = ActivityOutlook.objects.all()
+    if city:
+        queryset = queryset.filter(Q(city=city) | Q(city__isnull=True))
+    data = list(ActivityOutlookSerializer(queryset, many=True).data)
+    return data or DEFAULT_ACTIVITIES
+
+
+class DashboardView(APIView):
+    """
+    GET /api/dashboard/?city=Colombo&fields=current,hourly,daily,alerts,activities
+    Every dashboard panel in one response, from a single city lookup.
+    `fields` limits the panels returned; `days` limits the daily forecast.
+    """
+    PANELS = ('current', 'hourly', 'daily', 'alerts', 'activities')
 
-        if city_name:
-            try:
-                city = City.objects.get(name__iexact=city_name)
-                queryset = queryset.filter(Q(city=city) | Q(city__isnull=True))
-            except City.DoesNotExist:
-                pass
-
-        if not queryset.exists():
-            # Default activities
-            default = [
-                {'activity_name': 'Surfing', 'location': 'Hikkaduwa', 'suitability': 'GREAT',
-                 'suitability_color': 'green', 'description': 'Great wave conditions', 'icon': 'surfing'},
-                {'activity_name': 'Hiking', 'location': 'Ella Rock', 'suitability': 'FAIR',
-                 'suitability_color': 'yellow', 'description': 'Moderate cloud cover', 'icon': 'hiking'},
-                {'activity_name': 'Sigiriya Tour', 'location': 'Sigiriya', 'suitability': 'POOR',
-                 'suitability_color': 'red', 'description': 'Heavy rainfall expected', 'icon': 'tour'},
-            ]
-            return Response(default)
+    def get(self, request):
+        city_name = request.query_params.get('city', 'Colombo')
+        fields = request.query_params.get('fields')
+        panels = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(self.PANELS)
+        unknown = [p for p in panels if p not in self.PANELS]
+        if unknown:
+            return Response({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+        try:
+            days = forecast_days(request.query_params)
+        except ValueError:
+            return Response({'error': 'days must be a number'}, status=400)
 
-        serializer = ActivityOutlookSerializer(queryset, many=True)
-        return Response(serializer.data)
+        try:
+            city = city_registry.get_city(city_name, City.objects.select_related('latest_weather'))
+        except City.DoesNotExist:
+            return Response({'error': f'City "{city_name}" not found'}, status=404)
+
+        services.record_demand(city)
+        alerts = WeatherAlert.objects.filter(is_active=True)
+        state = table_state(alerts) if 'alerts' in panels else None
+        activities = table_state(ActivityOutlook.objects.all()) if 'activities' in panels else None
+        forecasts = 'hourly' in panels or 'daily' in panels
+
+        since, until = forecast_clock() if forecasts else (None, None)
+
+        def validators():
+            # city.latest_weather and forecast_fetched_at move forward if a refresh ran inline
+            current = city.latest_weather if 'current' in panels else None
+            ages = [LIVE_MAX_AGE if state else REFERENCE_MAX_AGE]
+            if current:
+                ages.append(freshness_left(current.fetched_at, services.CURRENT_WEATHER_TTL))
+            if forecasts:
+                ages += [freshness_left(city.forecast_fetched_at, services.FORECAST_TTL), until]
+            return Validators(
+                'dashboard', city.pk, panels, days, current.pk if current else None,
+                city.forecast_fetched_at if forecasts else None, since, state,
+                activities,
+                max_age=min(ages),
+            )
+
+        fresh = (
+            ('current' not in panels or not services.is_stale(
+                city.latest_weather.fetched_at if city.latest_weather else None, services.CURRENT_WEATHER_TTL))
+            and (not forecasts or not services.is_stale(city.forecast_fetched_at, services.FORECAST_TTL))
+        )
+        if fresh:
+            not_modified = validators().not_modified(request)
+            if not_modified:
+                return not_modified
+
+        data = {'city': {'id': city.pk, 'name': city.name, 'province': city.province}}
+        if 'current' in panels:
+            current = services.get_or_update_current_weather(city)
+            data['current'] = CurrentWeatherSerializer(current).data if current else None
+        if forecasts:
+            hourly, daily = services.get_or_update_forecasts(city)
+            if 'hourly' in panels:
+                data['hourly'] = HourlyForecastSerializer(hourly, many=True).data
+            if 'daily' in panels:
+                data['daily'] = DailyForecastSerializer(daily[:days], many=True).data
+        if 'alerts' in panels:
+            data['alerts'] = WeatherAlertSerializer(alerts[:3], many=True).data
+        if 'activities' in panels:
+            data['activities'] = activities_for(city)
+
+        return validators().respond(request, lambda: Response(data))
 
 
 class ExplorerCitiesView(APIView):
-    """GET /api/explorer/cities/ - All cities with weather for map markers"""
+    """
+    GET /api/explorer/cities/ - All cities with weather for map markers
+    GET /api/explorer/cities/?bbox=west,south,east,north - Only those in view
+    """
     def get(self, request):
-        cities = City.objects.prefetch_related('current_weather').all()
-        serializer = ExplorerCitySerializer(cities, many=True)
-        return Response(serializer.data)
+        cities = City.objects.select_related('latest_weather')
+        bbox = request.query_params.get('bbox')
+        if bbox:
+            try:
+                west, south, east, north = (float(v) for v in bbox.split(','))
+            except ValueError:
+                return Response({'error': 'bbox must be west,south,east,north'}, status=400)
+            if west > east or south > north:
+                return Response({'error': 'bbox must be west,south,east,north'}, status=400)
+            cities = cities.filter(pk__in=city_registry.registry.within(south, west, north, east))
+
+        state = cities.aggregate(
+            n=Count('id'), readings=Sum('latest_weather_id'), changed=Max('latest_weather__fetched_at')
+        )
+        validators = Validators(
+            'explorer', bbox, state['n'], state['readings'], last_modified=state['changed'], max_age=LIVE_MAX_AGE
+        )
+        return validators.respond(request, lambda: Response(ExplorerCitySerializer(cities, many=True).data))
+
+
+class CitySearchView(APIView):
+    """
+    GET /api/cities/search/?q=nuw&limit=10 - Autocomplete over city names and aliases
+    Without q, every city in name order (for pickers).
+    """
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), self.MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=400)
+
+        registry = city_registry.registry
+        validators = Validators(
+            'city-search', registry.index().version, city_registry.normalize(query), limit,
+            max_age=REFERENCE_MAX_AGE,
+        )
+        if not query.strip():
+            return validators.respond(request, lambda: Response(registry.all()))
+        return validators.respond(request, lambda: Response(registry.search(query, limit)))
 
 
 class UserProfileView(APIView):
@@ -312,3 +705,170 @@ class SubscriptionToggleView(APIView):
             profile.is_premium = not profile.is_premium
         profile.save()
         return Response({'is_premium': profile.is_premium})
+
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def event_stream(city_ids, severities, heartbeat):
+    """
+    Server-sent events for one subscriber, with keep-alive comments while idle.
+    Subscribes on first iteration so the queue lives on the loop that drains it.
+    """
+    subscription = broadcast.get_broadcaster().subscribe(city_ids, severities)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield _sse(event)
+    finally:
+        broadcast.get_broadcaster().unsubscribe(subscription)
+
+
+async def live_stream(request):
+    """
+    GET /api/stream/?cities=Colombo,Kandy&severities=RED,ORANGE
+    Server-sent events: 'weather' and 'forecast' for the given cities (all if
+    omitted) and 'alert' for the given severities (all if omitted).
+    Only served under ASGI: a WSGI worker would buffer the endless stream and
+    stay tied up, so it answers 503 and clients fall back to polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live updates need an ASGI server'}, status=503)
+
+    names = [n.strip().lower() for n in request.GET.get('cities', '').split(',') if n.strip()]
+    severities = [s.strip() for s in request.GET.get('severities', '').split(',') if s.strip()]
+    city_ids = []
+    if names:
+        city_ids = [pk for pk in [await city_registry.registry.aresolve(name) for name in names] if pk]
+        if not city_ids:
+            return JsonResponse({'error': 'No matching cities'}, status=404)
+
+    response = StreamingHttpResponse(
+        event_stream(city_ids, severities, settings.WEATHER_STREAM_HEARTBEAT), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+
+# Async counterparts of the weather views. They never hold a worker thread
+# while waiting on OpenWeatherMap, so under ASGI one process can keep many
+# refreshes in flight. Same caching, validators and payloads as the sync views.
+
+def json_response(data, hit):
+    response = JsonResponse(data, safe=False)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+def city_not_found(city_name):
+    return JsonResponse({'error': f'City "{city_name}" not found'}, status=404)
+
+
+async def aget_city(city_name, related=()):
+    # select_related() with no fields would follow every foreign key
+    queryset = City.objects.select_related(*related) if related else None
+    try:
+        return await city_registry.aget_city(city_name, queryset)
+    except City.DoesNotExist:
+        return None
+
+
+async def current_weather_async(request):
+    """GET /api/async/weather/current/?city=Colombo"""
+    city_name = request.GET.get('city', 'Colombo')
+    city = await aget_city(city_name, ['latest_weather'])
+    if not city:
+        city, error = await sync_to_async(city_for_new_name)(request, city_name)
+        if error:
+            return JsonResponse({'error': error[0]}, status=error[1])
+
+    await services.arecord_demand(city)
+    current = await services.aget_or_update_current_weather(city)
+    if not current:
+        return JsonResponse({'error': 'Weather data unavailable'}, status=503)
+
+    max_age = freshness_left(current.fetched_at, services.CURRENT_WEATHER_TTL)
+    validators = Validators('current', current.pk, last_modified=current.fetched_at, max_age=max_age)
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+
+    async def build():
+        return dict(CurrentWeatherSerializer(current).data), max_age
+
+    data, hit = await response_cache.aget_or_build(
+        'current', [response_cache.city_scope(city, 'current')], {'city': city.pk}, build
+    )
+    return validators.apply(json_response(data, hit))
+
+
+async def aforecast_response(request, view, city, params, build):
+    """forecast_response() for the async views"""
+    since, until = forecast_clock()
+
+    def validators():
+        fetched_at = city.forecast_fetched_at
+        return Validators(
+            view, sorted(params.items()), fetched_at, since,
+            last_modified=max(fetched_at, since) if fetched_at else None,
+            max_age=min(freshness_left(fetched_at, services.FORECAST_TTL), until),
+        )
+
+    if not services.is_stale(city.forecast_fetched_at, services.FORECAST_TTL):
+        not_modified = validators().not_modified(request)
+        if not_modified:
+            return not_modified
+
+    async def timed_build():
+        data, ttl = await build()
+        return data, min(ttl, until)
+
+    data, hit = await response_cache.aget_or_build(
+        view, [response_cache.city_scope(city, 'forecast')], params, timed_build
+    )
+    return validators().respond(request, lambda: json_response(data, hit))
+
+
+async def hourly_forecast_async(request):
+    """GET /api/async/weather/hourly/?city=Colombo"""
+    city_name = request.GET.get('city', 'Colombo')
+    city = await aget_city(city_name)
+    if not city:
+        return city_not_found(city_name)
+
+    await services.arecord_demand(city)
+
+    async def build():
+        hourly, _ = await services.aget_or_update_forecasts(city)
+        data = list(HourlyForecastSerializer(hourly, many=True).data)
+        return data, freshness_left(city.forecast_fetched_at, services.FORECAST_TTL)
+
+    return await aforecast_response(request, 'hourly', city, {'city': city.pk}, build)
+
+
+async def daily_forecast_async(request):
+    """GET /api/async/weather/daily/?city=Colombo&days=7"""
+    city_name = request.GET.get('city', 'Colombo')
+    try:
+        days = forecast_days(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'days must be a number'}, status=400)
+    city = await aget_city(city_name)
+    if not city:
+        return city_not_found(city_name)
+
+    await services.arecord_demand(city)
+
+    async def build():
+        _, daily = await services.aget_or_update_forecasts(city)
+        data = list(DailyForecastSerializer(daily[:days], many=True).data)
+        return data, freshness_left(city.forecast_fetched_at, services.FORECAST_TTL)
+
+    return await aforecast_response(request, 'daily', city, {'city': city.pk, 'days': days}, build)
@@ -0,0 +1,178 @@
+"""
+Fan-out of live weather and alert changes to streaming subscribers.
+Ingestion and alert writes call publish(); each subscriber is an asyncio
+queue on the event loop serving its stream, filtered by city and alert
+severity. With WEATHER_BROADCAST_BACKEND='postgres' events go through
+LISTEN/NOTIFY instead, so every worker process (and the scheduler daemon)
+reaches every subscriber.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'lankaweather_events'
+
+# Events buffered per subscriber; a slow client loses the oldest ones
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    """One stream's filters and queue. Empty filters mean 'everything'."""
+
+    def __init__(self, city_ids=(), severities=(), loop=None):
+        self.city_ids = set(city_ids)
+        self.severities = {s.upper() for s in severities}
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def wants(self, event):
+        if event['type'] == 'alert':
+            return not self.severities or event.get('severity') in self.severities
+        return not self.city_ids or event.get('city_id') in self.city_ids
+
+    def deliver(self, event):
+        """Runs on the subscriber's loop"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class Broadcaster:
+    """In-process fan-out. Safe to publish from any thread."""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, city_ids=(), severities=()):
+        subscription = Subscription(city_ids, severities)
+        with self._lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions.discard(subscription)
+
+    def deliver(self, event):
+        """Hand an event to every interested local subscriber"""
+        with self._lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                self.unsubscribe(subscription)  # Its event loop has closed
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class PostgresBroadcaster(Broadcaster):
+    """
+    Publishes with NOTIFY; a listener thread per process relays notifications
+    to the local subscribers, so a process receives its own events the same way.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def subscribe(self, city_ids=(), severities=()):
+        self._ensure_listener()
+        return super().subscribe(city_ids, severities)
+
+    def publish(self, event):
+        payload = json.dumps(event, cls=DjangoJSONEncoder)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payload])
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='broadcast-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        wrapper = connections['default']
+        conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        self.deliver(json.loads(notify.payload))
+                    except ValueError:
+                        logger.warning("Dropping malformed broadcast payload")
+        except Exception:
+            logger.exception("Broadcast listener stopped; it restarts with the next subscriber")
+        finally:
+            conn.close()
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        with _broadcaster_lock:
+            if _broadcaster is None:
+                backend = settings.WEATHER_BROADCAST_BACKEND
+                _broadcaster = PostgresBroadcaster() if backend == 'postgres' else Broadcaster()
+    return _broadcaster
+
+
+def publish(event):
+    """Publish an event once the current transaction (if any) commits"""
+    def send():
+        try:
+            get_broadcaster().publish(event)
+        except Exception:
+            logger.exception("Failed to publish live update")
+    transaction.on_commit(send)
+
+
+def weather_event(reading):
+    return {
+        'type': 'weather',
+        'city_id': reading.city_id,
+        'city': reading.city.name,
+        'temperature': reading.temperature,
+        'condition': reading.condition,
+        'icon': reading.icon,
+        'fetched_at': reading.fetched_at,
+    }
+
+
+def forecast_event(city):
+    return {'type': 'forecast', 'city_id': city.pk, 'city': city.name, 'fetched_at': city.forecast_fetched_at}
+
+
+def alert_event(alert, deleted=False):
+    return {
+        'type': 'alert',
+        'id': alert.pk,
+        'severity': alert.severity,
+        'title': alert.title,
+        'district': alert.district,
+        'is_active': alert.is_active and not deleted,
+        'deleted': deleted,
+    }
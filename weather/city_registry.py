@@ -0,0 +1,240 @@
+"""
+Process-local index of cities for name resolution, autocomplete and
+coordinate queries. Every City is loaded once into memory: an exact-match map
+of normalized names and aliases, a prefix trie for search-as-you-type and a
+KD-tree of coordinates for nearest-city and bounding-box lookups. City saves and
+deletes in this process reload it at once. Every RECHECK_INTERVAL it also
+compares the number of cities and the highest id with the table, which picks
+up cities added or deleted by other processes; edits made elsewhere are only
+seen once the 'cities' version bump reaches a shared cache. A name the index
+doesn't know is looked up in the table before it counts as unknown.
+"""
+import re
+import threading
+import time
+import unicodedata
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max
+
+from . import response_cache
+from .spatial import KDTree
+
+SCOPE = 'cities'
+
+# Seconds between checks for changes made by other processes
+RECHECK_INTERVAL = 5
+
+# Matches kept per trie node; search limits are capped at this
+MAX_RESULTS = 50
+
+# Fields the index is built from; saves touching only other fields don't reload it
+INDEXED_FIELDS = {'name', 'aliases', 'province', 'lat', 'lon'}
+
+# Ranks of a match, best first: the city's name, one of its aliases, a later word of its name
+NAME, ALIAS, WORD = range(3)
+
+
+def normalize(name):
+    """Case-, accent- and punctuation-insensitive form: 'Nuwara-Éliya ' -> 'nuwara eliya'"""
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[\W_]+', ' ', stripped.casefold()).split())
+
+
+class PrefixTrie:
+    """
+    Every prefix of the inserted keys maps to the ids under it, ordered best
+    first and capped at MAX_RESULTS when finalized, so a search is one walk
+    down the trie and a slice.
+    """
+
+    def __init__(self):
+        self.root = ({}, {})  # (children by character, {id: sort key})
+
+    def insert(self, key, item_id, sort_key):
+        node = self.root
+        for char in key:
+            node = node[0].setdefault(char, ({}, {}))
+            matches = node[1]
+            if item_id not in matches or sort_key < matches[item_id]:
+                matches[item_id] = sort_key
+
+    def finalize(self):
+        """Replace each node's matches with its best MAX_RESULTS ids, in order"""
+        stack = [self.root]
+        while stack:
+            children, matches = stack.pop()
+            ranked = sorted(matches, key=matches.get)[:MAX_RESULTS]
+            matches.clear()
+            matches.update(dict.fromkeys(ranked))
+            stack.extend(children.values())
+
+    def search(self, prefix, limit):
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        return list(node[1])[:limit]
+
+
+class Index:
+    """An immutable snapshot of the cities; the registry swaps in a new one on reload"""
+
+    def __init__(self, cities, version):
+        self.version = version
+        self.entries = {}
+        self.by_key = {}
+        self.trie = PrefixTrie()
+        aliases = []
+
+        for city in cities:
+            self.entries[city.pk] = {
+                'id': city.pk, 'name': city.name, 'province': city.province, 'lat': city.lat, 'lon': city.lon,
+            }
+            name = normalize(city.name)
+            self._add(name, city, NAME)
+            words = name.split()
+            for i in range(1, len(words)):
+                self.trie.insert(' '.join(words[i:]), city.pk, (WORD, len(name), name))
+            aliases += [(normalize(alias), city) for alias in city.aliases or []]
+
+        # Aliases never shadow another city's real name
+        for alias, city in aliases:
+            if alias:
+                self._add(alias, city, ALIAS)
+        self.trie.finalize()
+        self.ordered = sorted(self.entries.values(), key=lambda e: normalize(e['name']))
+        self.tree = KDTree((e['lat'], e['lon'], pk) for pk, e in self.entries.items())
+
+    def _add(self, key, city, rank):
+        name = normalize(city.name)
+        for form in {key, key.replace(' ', '')}:
+            self.by_key.setdefault(form, city.pk)
+            self.trie.insert(form, city.pk, (rank, len(name), name))
+
+
+class CityRegistry:
+    def __init__(self):
+        self._index = None
+        self._stale = True
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """A city was saved or deleted in this process"""
+        self._stale = True
+        response_cache.bump(SCOPE)
+
+    def _due(self, force):
+        return self._stale or force or time.monotonic() - self._checked >= RECHECK_INTERVAL
+
+    def _version(self):
+        """What the loaded index must match: the 'cities' version and the table's size"""
+        from .models import City
+
+        state = City.objects.aggregate(n=Count('id'), last=Max('id'))
+        return response_cache.version(SCOPE), state['n'], state['last']
+
+    async def _aversion(self):
+        from .models import City
+
+        state = await City.objects.aaggregate(n=Count('id'), last=Max('id'))
+        return await response_cache.aversion(SCOPE), state['n'], state['last']
+
+    def _load(self, version):
+        from .models import City
+
+        with self._lock:
+            if self._outdated(version):
+                self._stale = False
+                self._index = Index(City.objects.only(*INDEXED_FIELDS), version)
+
+    def _outdated(self, version):
+        return self._index is None or self._stale or self._index.version != version
+
+    def index(self, force=False):
+        if self._due(force):
+            version = self._version()
+            if self._outdated(version):
+                self._load(version)
+            self._checked = time.monotonic()
+        return self._index
+
+    async def aindex(self, force=False):
+        """index() for async callers; only a reload leaves the event loop"""
+        if self._due(force):
+            version = await self._aversion()
+            if self._outdated(version):
+                await sync_to_async(self._load)(version)
+            self._checked = time.monotonic()
+        return self._index
+
+    def resolve(self, name):
+        """The id of the city called `name` (or one of its aliases), or None"""
+        from .models import City
+
+        pk = self.index().by_key.get(normalize(name))
+        if pk is None:
+            # It may have been added or renamed by another process
+            pk = City.objects.filter(name__iexact=name.strip()).values_list('pk', flat=True).first()
+            if pk is not None:
+                self._stale = True
+        return pk
+
+    async def aresolve(self, name):
+        from .models import City
+
+        pk = (await self.aindex()).by_key.get(normalize(name))
+        if pk is None:
+            pk = await City.objects.filter(name__iexact=name.strip()).values_list('pk', flat=True).afirst()
+            if pk is not None:
+                self._stale = True
+        return pk
+
+    def search(self, query, limit=10):
+        """Cities whose name, alias or any word of the name starts with `query`, best first"""
+        index = self.index()
+        key = normalize(query)
+        if not key:
+            return index.ordered[:limit]
+        ids = index.trie.search(key, min(limit, MAX_RESULTS))
+        return [index.entries[pk] for pk in ids]
+
+    def all(self):
+        return self.index().ordered
+
+    def nearest(self, lat, lon, k=1):
+        """The k cities nearest a point as [(entry, distance in km)], closest first"""
+        index = self.index()
+        return [(index.entries[pk], distance) for distance, pk in index.tree.nearest(lat, lon, k)]
+
+    def within(self, south, west, north, east):
+        """Ids of the cities inside a bounding box"""
+        return self.index().tree.within(south, west, north, east)
+
+
+registry = CityRegistry()
+
+
+def get_city(name, queryset=None):
+    """
+    The City called `name`, resolved through the registry so the only query
+    is a primary-key fetch. Raises City.DoesNotExist like QuerySet.get().
+    """
+    from .models import City
+
+    pk = registry.resolve(name)
+    if pk is None:
+        raise City.DoesNotExist(f'No city called {name!r}')
+    return (queryset if queryset is not None else City.objects).get(pk=pk)
+
+
+async def aget_city(name, queryset=None):
+    from .models import City
+
+    pk = await registry.aresolve(name)
+    if pk is None:
+        raise City.DoesNotExist(f'No city called {name!r}')
+    return await (queryset if queryset is not None else City.objects).aget(pk=pk)
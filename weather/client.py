@@ -0,0 +1,435 @@
+"""
+Shared HTTP client for OpenWeatherMap.
+One pooled, keep-alive session per process, with retries on 429/5xx,
+a circuit breaker, and the shared quota charged for every attempt.
+OPENWEATHERMAP_PROVIDER picks the backend: the live API, a recorder that
+saves raw responses to disk, or an offline replay/fake provider.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+from pathlib import Path
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from . import fake_owm, quota
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """OpenWeatherMap was not called because it is failing or out of quota"""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class QuotaExceededError(UpstreamUnavailable):
+    pass
+
+
+def is_upstream_failure(exc):
+    """True for errors that say OWM itself is unhealthy (not e.g. an unknown city)"""
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+class QuotaRetry(Retry):
+    """
+    Retry policy that charges the quota for every retry it makes; the first
+    attempt is charged by get_json. With no quota left it gives up as if its
+    retries had run out.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if not quota.try_acquire():
+            reason = error or ResponseError(ResponseError.SPECIFIC_ERROR.format(status_code=response.status))
+            raise MaxRetryError(_pool, url, reason)
+        return retry
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After `failure_threshold` consecutive failures it opens
+    and rejects calls for `reset_timeout` seconds, then half-opens to let a
+    single probe through: success closes it again, failure re-opens it.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=60, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allows_request(self):
+        """Whether a call would be let through right now (does not reserve a probe)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return self.clock() - self.opened_at >= self.reset_timeout
+            return not self.probing
+
+    def before_call(self):
+        """Raise CircuitOpenError unless this call may proceed"""
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.probing):
+                raise CircuitOpenError('OpenWeatherMap circuit is open')
+            if self.state == self.HALF_OPEN:
+                self.probing = True
+
+    def cancel(self):
+        """The permitted call was not made after all"""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("OpenWeatherMap circuit opened after repeated failures")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class OWMClient:
+    """Live provider: thin wrapper around a pooled requests.Session"""
+
+    # Whether calls count against the shared upstream quota
+    uses_quota = True
+
+    def __init__(self, pool_size=10, max_retries=3, backoff_factor=0.5,
+                 connect_timeout=3.05, read_timeout=10, breaker=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        retry = (QuotaRetry if self.uses_quota else Retry)(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_factor,
+            backoff_max=30,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'GET'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_settings(cls, **kwargs):
+        return cls(
+            pool_size=settings.OPENWEATHERMAP_POOL_SIZE,
+            max_retries=settings.OPENWEATHERMAP_MAX_RETRIES,
+            backoff_factor=settings.OPENWEATHERMAP_BACKOFF_FACTOR,
+            connect_timeout=settings.OPENWEATHERMAP_CONNECT_TIMEOUT,
+            read_timeout=settings.OPENWEATHERMAP_READ_TIMEOUT,
+            breaker=CircuitBreaker(
+                failure_threshold=settings.OPENWEATHERMAP_BREAKER_THRESHOLD,
+                reset_timeout=settings.OPENWEATHERMAP_BREAKER_RESET,
+            ),
+            **kwargs,
+        )
+
+    def get_json(self, url, params=None):
+        """
+        GET a JSON document. Raises requests.RequestException on
+        network errors, error statuses or an undecodable body, and
+        UpstreamUnavailable without calling out while the circuit is
+        open or the quota is used up.
+        """
+        self.breaker.before_call()
+        if self.uses_quota and not quota.try_acquire():
+            self.breaker.cancel()
+            raise QuotaExceededError('OpenWeatherMap quota exhausted')
+
+        try:
+            data = self.fetch(url, params or {})
+        except requests.RequestException as e:
+            if is_upstream_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return data
+
+    def fetch(self, url, params):
+        """Make the actual request; providers override this"""
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def available(self):
+        """Whether an upstream call could be made now (circuit and quota)"""
+        return self.breaker.allows_request() and (not self.uses_quota or quota.has_quota())
+
+
+def endpoint_name(url):
+    """'https://.../data/2.5/forecast' -> 'forecast'"""
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def fixture_path(directory, url, params):
+    """Where the recording of a request is stored. The API key is left out."""
+    query = '&'.join(f'{k}={params[k]}' for k in sorted(params) if k != 'appid')
+    digest = hashlib.sha1(query.encode()).hexdigest()[:16]
+    return Path(directory) / endpoint_name(url) / f'{digest}.json'
+
+
+class RecordingClient(OWMClient):
+    """Live provider that also saves every raw response under `fixtures_dir`"""
+
+    def __init__(self, fixtures_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures_dir = fixtures_dir
+
+    @classmethod
+    def from_settings(cls):
+        return super().from_settings(fixtures_dir=settings.OPENWEATHERMAP_FIXTURES_DIR)
+
+    def fetch(self, url, params):
+        data = super().fetch(url, params)
+        self.record(url, params, data)
+        return data
+
+    def record(self, url, params, data):
+        path = fixture_path(self.fixtures_dir, url, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        recorded = {'params': {k: v for k, v in params.items() if k != 'appid'}, 'response': data}
+        path.write_text(json.dumps(recorded, indent=1))
+
+
+class FakeClient(OWMClient):
+    """
+    Offline provider. Serves recorded responses from `fixtures_dir`; unrecorded
+    requests get a synthetic payload, or a 404 when `synthetic` is off (strict
+    replay). `latency` seconds are added per call and `error_rate` of calls fail
+    with a 503. Calls don't count against the upstream quota.
+    """
+    uses_quota = False
+
+    def __init__(self, fixtures_dir, synthetic=True, latency=0.0, error_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures_dir = fixtures_dir
+        self.synthetic = synthetic
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random()
+
+    @classmethod
+    def from_settings(cls, synthetic=True):
+        return super().from_settings(
+            fixtures_dir=settings.OPENWEATHERMAP_FIXTURES_DIR,
+            synthetic=synthetic,
+            latency=settings.OPENWEATHERMAP_FAKE_LATENCY,
+            error_rate=settings.OPENWEATHERMAP_FAKE_ERROR_RATE,
+        )
+
+    def fetch(self, url, params):
+        time.sleep(self.delay())
+        return self.respond(url, params)
+
+    def delay(self):
+        """Simulated latency for the next call, in seconds"""
+        return self.random.uniform(0.5, 1.5) * self.latency if self.latency else 0
+
+    def respond(self, url, params):
+        """The recorded or synthetic payload for a request, or the simulated error"""
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise _http_error(url, 503)
+
+        path = fixture_path(self.fixtures_dir, url, params)
+        if path.exists():
+            return json.loads(path.read_text())['response']
+        try:
+            data = fake_owm.payload_for(endpoint_name(url), params) if self.synthetic else None
+        except (KeyError, ValueError):
+            # A missing or non-numeric q/lat/lon/id, which OWM answers with a 400
+            raise _http_error(url, 400)
+        if data is None:
+            raise _http_error(url, 404)
+        return data
+
+
+def _http_error(url, status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    return requests.HTTPError(f'{status_code} from fake OpenWeatherMap for {url}', response=response)
+
+
+PROVIDERS = {
+    'live': OWMClient.from_settings,
+    'record': RecordingClient.from_settings,
+    'replay': lambda: FakeClient.from_settings(synthetic=False),
+    'fake': FakeClient.from_settings,
+}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PROVIDERS[settings.OPENWEATHERMAP_PROVIDER]()
+    return _client
+
+
+def reset_client():
+    """Drop the shared client (e.g. after settings change in tests)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
+
+
+class AsyncOWMClient:
+    """
+    httpx-based counterpart of the shared client for async views. It goes
+    through the same circuit breaker and quota as `sync_client`; with the
+    record/replay/fake providers it defers to that provider's responses.
+    Failures are raised as requests exceptions so callers handle both alike.
+    """
+
+    def __init__(self, sync_client, pool_size=10, max_retries=3, backoff_factor=0.5,
+                 connect_timeout=3.05, read_timeout=10, transport=None):
+        self.sync = sync_client
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            get_client(),
+            pool_size=settings.OPENWEATHERMAP_POOL_SIZE,
+            max_retries=settings.OPENWEATHERMAP_MAX_RETRIES,
+            backoff_factor=settings.OPENWEATHERMAP_BACKOFF_FACTOR,
+            connect_timeout=settings.OPENWEATHERMAP_CONNECT_TIMEOUT,
+            read_timeout=settings.OPENWEATHERMAP_READ_TIMEOUT,
+        )
+
+    async def get_json(self, url, params=None):
+        """Async OWMClient.get_json"""
+        params = params or {}
+        breaker = self.sync.breaker
+        breaker.before_call()
+        if self.sync.uses_quota and not await sync_to_async(quota.try_acquire)():
+            breaker.cancel()
+            raise QuotaExceededError('OpenWeatherMap quota exhausted')
+
+        try:
+            data = await self.fetch(url, params)
+        except requests.RequestException as e:
+            if is_upstream_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return data
+
+    async def fetch(self, url, params):
+        if isinstance(self.sync, FakeClient):
+            await asyncio.sleep(self.sync.delay())
+            return self.sync.respond(url, params)
+
+        data = await self._get(url, params)
+        if isinstance(self.sync, RecordingClient):
+            self.sync.record(url, params, data)
+        return data
+
+    async def _get(self, url, params):
+        """GET with retries on 429/5xx and connection errors, like the sync Retry policy"""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.http.get(url, params=params)
+            except httpx.TimeoutException as e:
+                error = requests.Timeout(str(e))
+            except httpx.TransportError as e:
+                error = requests.ConnectionError(str(e))
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                error = _http_error(url, response.status_code)
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt == self.max_retries:
+                raise error
+            # Each retry is charged like the first attempt
+            if self.sync.uses_quota and not await sync_to_async(quota.try_acquire)():
+                raise error
+            delay = self.backoff_factor * 2 ** attempt + random.uniform(0, self.backoff_factor)
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after)
+            await asyncio.sleep(min(delay, 30))
+
+        if response.status_code >= 400:
+            raise _http_error(url, response.status_code)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise requests.JSONDecodeError(str(e), response.text, 0)
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+# httpx connection pools belong to one event loop, so keep a client per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the async client for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.sync is not get_client():
+        client = _async_clients[loop] = AsyncOWMClient.from_settings()
+    return client
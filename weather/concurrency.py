@@ -0,0 +1,139 @@
+"""
+Concurrency helpers for the weather ingestion pipeline.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    `rate` tokens are added per second, up to `capacity` tokens in the bucket.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now. Returns True on success."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available, then take them."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CacheLock:
+    """
+    Non-blocking lock held as a key in Django's cache.
+    cache.add() is atomic, so this excludes other threads and, with a shared
+    cache backend (database, Redis, Memcached), other worker processes too.
+    The timeout bounds how long a crashed holder can block others.
+    """
+
+    def __init__(self, key, timeout=30):
+        self.key = f'lock:{key}'
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        return cache.add(self.key, self.token, self.timeout)
+
+    def release(self):
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+    def wait(self, timeout, interval=0.05):
+        """Wait for whoever holds the lock to release it. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while cache.get(self.key) is not None:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    async def aacquire(self):
+        return await cache.aadd(self.key, self.token, self.timeout)
+
+    async def arelease(self):
+        if await cache.aget(self.key) == self.token:
+            await cache.adelete(self.key)
+
+    async def await_release(self, timeout, interval=0.05):
+        """Async wait(): yields to the event loop between polls"""
+        deadline = time.monotonic() + timeout
+        while await cache.aget(self.key) is not None:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+        return True
+
+
+class KeyedExecutor:
+    """
+    Background thread pool that runs at most one pending task per key.
+    Submitting a key that is already queued or running is a no-op.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix='weather-refresh'):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) unless `key` is already pending. Returns True if queued."""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix
+                )
+        self._executor.submit(self._run, key, fn, args)
+        return True
+
+    def _run(self, key, fn, args):
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"Background task {key} failed")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+            # Pool threads outlive requests, so don't keep their DB connection open
+            connection.close()
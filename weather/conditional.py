@@ -0,0 +1,41 @@
+"""
+Conditional GET helpers for the JSON API.
+Views build validators from cheap version data (reading ids, fetched_at
+timestamps, cache versions) before serializing anything, answer matching
+If-None-Match / If-Modified-Since requests with a bare 304, and tag full
+responses with ETag, Last-Modified and a Cache-Control max-age.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+class Validators:
+    """
+    ETag from `parts` (anything with a stable str()), optional Last-Modified
+    datetime, and how many seconds clients may reuse the response.
+    """
+
+    def __init__(self, *parts, last_modified=None, max_age=0):
+        digest = hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()[:32]
+        self.etag = quote_etag(digest)
+        self.last_modified = last_modified
+        self.max_age = max(0, int(max_age))
+
+    def not_modified(self, request):
+        """A 304 response if the client's copy is current, else None"""
+        timestamp = int(self.last_modified.timestamp()) if self.last_modified else None
+        response = get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+        return self.apply(response) if response is not None else None
+
+    def apply(self, response):
+        response['ETag'] = self.etag
+        if self.last_modified:
+            response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
+
+    def respond(self, request, build):
+        """304 if not modified, else the response from build() with validators applied"""
+        return self.not_modified(request) or self.apply(build())
@@ -0,0 +1,183 @@
+"""
+Synthetic OpenWeatherMap payloads for offline benchmarking and tests.
+Values are plausible for Sri Lanka and deterministic per location and hour,
+so repeated runs against the fake provider line up.
+"""
+import hashlib
+import random
+import time
+
+# Rough bounding box of Sri Lanka, used to place cities known only by name or id
+LAT_RANGE = (5.9, 9.8)
+LON_RANGE = (79.7, 81.9)
+
+PROVINCES = [
+    'Central Province', 'Eastern Province', 'North Central Province', 'Northern Province',
+    'North Western Province', 'Sabaragamuwa Province', 'Southern Province', 'Uva Province',
+    'Western Province',
+]
+
+CONDITIONS = [
+    ('Clear', 'clear sky', '01'),
+    ('Clouds', 'few clouds', '02'),
+    ('Clouds', 'scattered clouds', '03'),
+    ('Clouds', 'broken clouds', '04'),
+    ('Rain', 'light rain', '10'),
+    ('Rain', 'moderate rain', '10'),
+    ('Thunderstorm', 'thunderstorm with rain', '11'),
+]
+
+
+def _rng(*parts):
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def _place(key):
+    """Stable pseudo-coordinates (and OWM-style id) for a name or id"""
+    rng = _rng('place', key)
+    lat = round(rng.uniform(*LAT_RANGE), 4)
+    lon = round(rng.uniform(*LON_RANGE), 4)
+    return lat, lon, rng.randint(1_000_000, 9_999_999)
+
+
+def _weather(rng, dt):
+    main, description, icon = rng.choice(CONDITIONS)
+    hour = time.gmtime(dt).tm_hour + 5.5  # Sri Lanka is UTC+5:30
+    suffix = 'd' if 6 <= hour % 24 < 18 else 'n'
+    return [{'id': 800, 'main': main, 'description': description, 'icon': icon + suffix}]
+
+
+def _sample(lat, lon, dt):
+    """Shared values for one location and hour"""
+    rng = _rng(round(lat, 2), round(lon, 2), dt // 3600)
+    # Cooler in the central highlands
+    highland = max(0.0, 1 - ((lat - 7.0) ** 2 + (lon - 80.7) ** 2) ** 0.5 / 0.5)
+    temp = round(29 + rng.uniform(-2.5, 3) - highland * 12, 2)
+    return {
+        'rng': rng,
+        'temp': temp,
+        'feels_like': round(temp + rng.uniform(0, 5), 2),
+        'humidity': rng.randint(60, 95),
+        'pressure': rng.randint(1004, 1014),
+        'wind_speed': round(rng.uniform(0.5, 9), 2),
+        'wind_deg': rng.randint(0, 359),
+        'clouds': rng.randint(0, 100),
+        'visibility': rng.choice([6000, 8000, 10000]),
+        'pop': round(rng.random(), 2),
+        'weather': _weather(rng, dt),
+    }
+
+
+def current(lat, lon, owm_id, name='', dt=None):
+    """Payload shaped like /data/2.5/weather"""
+    dt = int(dt or time.time())
+    s = _sample(lat, lon, dt)
+    return {
+        'id': owm_id,
+        'name': name,
+        'dt': dt,
+        'coord': {'lat': lat, 'lon': lon},
+        'weather': s['weather'],
+        'main': {
+            'temp': s['temp'], 'feels_like': s['feels_like'],
+            'humidity': s['humidity'], 'pressure': s['pressure'],
+        },
+        'visibility': s['visibility'],
+        'wind': {'speed': s['wind_speed'], 'deg': s['wind_deg']},
+        'clouds': {'all': s['clouds']},
+    }
+
+
+def forecast(lat, lon, dt=None):
+    """Payload shaped like /data/2.5/forecast (40 three-hour steps)"""
+    start = int(dt or time.time()) // 10800 * 10800 + 10800
+    items = []
+    for step in range(40):
+        t = start + step * 10800
+        s = _sample(lat, lon, t)
+        items.append({
+            'dt': t,
+            'main': {'temp': s['temp'], 'feels_like': s['feels_like'],
+                     'humidity': s['humidity'], 'pressure': s['pressure']},
+            'weather': s['weather'],
+            'wind': {'speed': s['wind_speed'], 'deg': s['wind_deg']},
+            'clouds': {'all': s['clouds']},
+            'pop': s['pop'],
+        })
+    return {'cod': '200', 'cnt': len(items), 'list': items}
+
+
+def onecall(lat, lon, dt=None):
+    """Payload shaped like /data/3.0/onecall (current, 48 hourly, 8 daily)"""
+    now = int(dt or time.time())
+    s = _sample(lat, lon, now)
+    payload = {
+        'lat': lat, 'lon': lon, 'timezone': 'Asia/Colombo',
+        'current': {
+            'dt': now, 'temp': s['temp'], 'feels_like': s['feels_like'],
+            'pressure': s['pressure'], 'humidity': s['humidity'],
+            'uvi': round(s['rng'].uniform(0, 12), 2), 'clouds': s['clouds'],
+            'visibility': s['visibility'], 'wind_speed': s['wind_speed'],
+            'wind_deg': s['wind_deg'], 'weather': s['weather'],
+        },
+        'hourly': [],
+        'daily': [],
+    }
+    hour = now // 3600 * 3600
+    for h in range(48):
+        t = hour + h * 3600
+        hs = _sample(lat, lon, t)
+        payload['hourly'].append({
+            'dt': t, 'temp': hs['temp'], 'humidity': hs['humidity'],
+            'wind_speed': hs['wind_speed'], 'pop': hs['pop'], 'weather': hs['weather'],
+        })
+    day = now // 86400 * 86400 + 6 * 3600  # around local noon
+    for d in range(8):
+        t = day + d * 86400
+        ds = _sample(lat, lon, t)
+        payload['daily'].append({
+            'dt': t,
+            'temp': {'day': ds['temp'], 'min': round(ds['temp'] - ds['rng'].uniform(3, 7), 2),
+                     'max': round(ds['temp'] + ds['rng'].uniform(1, 4), 2)},
+            'humidity': ds['humidity'], 'wind_speed': ds['wind_speed'],
+            'pop': ds['pop'], 'uvi': round(ds['rng'].uniform(4, 12), 2), 'weather': ds['weather'],
+        })
+    return payload
+
+
+def geocode(name):
+    """Payload shaped like /geo/1.0/direct; names without letters match nothing"""
+    name = name.strip().title()
+    if not any(c.isalpha() for c in name):
+        return []
+    lat, lon, _ = _place(name.lower())
+    province = _rng('province', name.lower()).choice(PROVINCES)
+    return [{'name': name, 'lat': lat, 'lon': lon, 'country': 'LK', 'state': province}]
+
+
+def payload_for(endpoint, params):
+    """
+    Synthesize the response for an endpoint name ('weather', 'group', 'direct',
+    'forecast', 'onecall') and its query params. Returns None if unknown.
+    """
+    if endpoint == 'weather':
+        if 'q' in params:
+            name = str(params['q']).split(',')[0].strip().title()
+            lat, lon, owm_id = _place(name.lower())
+            return current(lat, lon, owm_id, name)
+        lat, lon = float(params['lat']), float(params['lon'])
+        return current(lat, lon, _place(f'{lat:.2f},{lon:.2f}')[2])
+    if endpoint == 'group':
+        items = []
+        for owm_id in str(params['id']).split(','):
+            lat, lon, _ = _place(f'id:{owm_id}')
+            items.append(current(lat, lon, int(owm_id)))
+        return {'cnt': len(items), 'list': items}
+    if endpoint == 'direct':
+        return geocode(str(params['q']).split(',')[0])
+    if endpoint == 'forecast':
+        return forecast(float(params['lat']), float(params['lon']))
+    if endpoint == 'onecall':
+        return onecall(float(params['lat']), float(params['lon']))
+    return None
@@ -0,0 +1,53 @@
+"""
+Cached geocoding of city names that aren't in the DB yet.
+Places found are kept for GEOCODE_TTL and names the geocoder doesn't know for
+GEOCODE_NEGATIVE_TTL, so repeated typos and junk names cost no upstream calls.
+Failed lookups (upstream down, quota used up) are not cached.
+"""
+import hashlib
+import logging
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import services
+from .city_registry import normalize
+
+logger = logging.getLogger(__name__)
+
+# Cached in place of a place for names the geocoder had no match for
+NOT_FOUND = 'not-found'
+
+
+def _key(name):
+    # Spacing and punctuation don't matter: 'Nuwara-Eliya' is 'NuwaraEliya'
+    compact = normalize(name).replace(' ', '')
+    return f'weather:geocode:{hashlib.sha1(compact.encode()).hexdigest()}'
+
+
+def cached(name):
+    """The cached place for a name, NOT_FOUND for a known miss, or None if not looked up yet"""
+    return cache.get(_key(name))
+
+
+def geocode(name):
+    """
+    {'name', 'lat', 'lon', 'province'} for a Sri Lankan place name, or None if
+    there is no such place or the lookup failed.
+    """
+    place = cached(name)
+    if place is not None:
+        return None if place == NOT_FOUND else place
+
+    try:
+        place = services.fetch_geocode(name)
+    except (requests.RequestException, KeyError, TypeError) as e:
+        logger.error(f"Error geocoding {name!r}: {e}")
+        return None
+
+    if place:
+        cache.set(_key(name), place, settings.GEOCODE_TTL)
+    else:
+        cache.set(_key(name), NOT_FOUND, settings.GEOCODE_NEGATIVE_TTL)
+    return place
@@ -0,0 +1,332 @@
+"""
+Streaming import of daily observation archives into HistoricalRecord.
+Files (CSV or NDJSON, optionally gzipped) flow through a chain of generators:
+read -> parse and normalize units -> resolve the city -> batch, and each batch
+is upserted on (city, date) in one transaction: COPY into a temporary table
+on PostgreSQL, executemany on SQLite. Memory stays constant however large the
+archive; only the set of touched city-years grows, and the rollups and the
+history store are refreshed from it at the end.
+"""
+import csv
+import functools
+import gzip
+import io
+import json
+import time
+from datetime import date
+
+from django.db import connection, transaction
+
+from . import city_registry, history_store, rollups
+from .models import HistoricalRecord
+
+COLUMNS = ['city_id', 'date', 'avg_temp', 'max_temp', 'min_temp', 'rainfall', 'humidity', 'is_extreme_event']
+
+# Alternative names accepted for input fields
+FIELD_ALIASES = {
+    'city_name': 'city', 'station': 'city', 'day': 'date',
+    'temp': 'avg_temp', 'temperature': 'avg_temp', 'tmax': 'max_temp', 'tmin': 'min_temp',
+    'rain': 'rainfall', 'precipitation': 'rainfall', 'precip': 'rainfall',
+    'extreme': 'is_extreme_event',
+}
+
+TEMP_UNITS = {
+    'C': lambda t: t,
+    'F': lambda t: (t - 32) * 5 / 9,
+    'K': lambda t: t - 273.15,
+}
+RAIN_UNITS = {'mm': 1, 'cm': 10, 'in': 25.4}
+
+# Plausible ranges after conversion to °C, mm and %
+TEMP_RANGE = (-60, 60)
+MAX_DAILY_RAINFALL = 2000
+
+TRUE = {'1', 'true', 't', 'yes', 'y'}
+FALSE = {'0', 'false', 'f', 'no', 'n', ''}
+
+# Import errors kept for the report; the rest are only counted
+MAX_ERROR_SAMPLES = 20
+
+# Touched city-years refreshed one by one; above this, touched cities are rebuilt
+REFRESH_LIMIT = 200
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+class ArchiveError(Exception):
+    """A file that can't be read any further"""
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.invalid = 0
+        self.unknown_city = 0
+        self.errors = []
+        self.touched = set()  # (city id, year)
+        self.started = time.monotonic()
+
+    def error(self, source, line, message):
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append(f'{source}:{line}: {message}')
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Rows read per second"""
+        return self.read / self.elapsed if self.elapsed else 0
+
+
+def open_archive(path):
+    """A text stream of the file, decompressed if it is gzipped"""
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == b'\x1f\x8b'
+    raw = gzip.open(path) if gzipped else open(path, 'rb')
+    return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+
+def archive_format(path):
+    name = str(path).lower().removesuffix('.gz')
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_records(path, fmt=None):
+    """
+    (line number, dict) for every record of a CSV or NDJSON file. Raises
+    ArchiveError if the file can't be read to the end.
+    """
+    fmt = fmt or archive_format(path)
+    line = 0
+    try:
+        with open_archive(path) as stream:
+            if fmt == 'csv':
+                reader = csv.DictReader(stream)
+                for record in reader:
+                    line = reader.line_num
+                    yield line, record
+            else:
+                for line, text in enumerate(stream, 1):
+                    if not text.strip():
+                        continue
+                    try:
+                        record = json.loads(text)
+                    except ValueError:
+                        yield line, None
+                        continue
+                    yield line, record if isinstance(record, dict) else None
+    except (OSError, EOFError, UnicodeDecodeError, csv.Error) as e:
+        # Truncated or corrupt gzip, undecodable text, malformed CSV, unreadable file
+        raise ArchiveError(f'{path}: after line {line}: {e}' if line else f'{path}: {e}') from e
+
+
+def _number(record, field):
+    value = record.get(field)
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f'{field} is not a number: {value!r}')
+    if number != number:
+        raise InvalidRow(f'{field} is NaN')
+    return number
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value if value is not None else '').strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    raise InvalidRow(f'is_extreme_event is not a boolean: {value!r}')
+
+
+@functools.lru_cache(maxsize=64)
+def _field_names(keys):
+    """Canonical names of a record's keys; computed once per header"""
+    names = (str(key).strip().lower() for key in keys)
+    return tuple(FIELD_ALIASES.get(name, name) for name in names)
+
+
+def normalize(record, temp_unit='C', rain_unit='mm'):
+    """
+    A validated record in the model's units: °C, mm and %. Rows may carry
+    their own temp_unit / rainfall_unit. Raises InvalidRow.
+    """
+    record = dict(zip(_field_names(tuple(record)), record.values()))
+
+    city = str(record.get('city') or '').strip()
+    if not city:
+        raise InvalidRow('city is missing')
+    try:
+        day = date.fromisoformat(str(record.get('date') or '').strip()[:10])
+    except ValueError:
+        raise InvalidRow(f'date is not YYYY-MM-DD: {record.get("date")!r}')
+
+    temp_unit = str(record.get('temp_unit') or temp_unit).strip().upper().removeprefix('°')
+    rain_unit = str(record.get('rainfall_unit') or rain_unit).strip().lower()
+    if temp_unit not in TEMP_UNITS:
+        raise InvalidRow(f'unknown temperature unit {temp_unit!r}')
+    if rain_unit not in RAIN_UNITS:
+        raise InvalidRow(f'unknown rainfall unit {rain_unit!r}')
+
+    to_celsius = TEMP_UNITS[temp_unit]
+    temps = {}
+    for field in ('avg_temp', 'max_temp', 'min_temp'):
+        value = _number(record, field)
+        if value is not None:
+            value = round(to_celsius(value), 2)
+            if not TEMP_RANGE[0] <= value <= TEMP_RANGE[1]:
+                raise InvalidRow(f'{field} out of range: {value}°C')
+        temps[field] = value
+    if temps['avg_temp'] is None:
+        if temps['max_temp'] is None or temps['min_temp'] is None:
+            raise InvalidRow('avg_temp is missing')
+        temps['avg_temp'] = round((temps['max_temp'] + temps['min_temp']) / 2, 2)
+    if temps['max_temp'] is not None and temps['min_temp'] is not None and temps['min_temp'] > temps['max_temp']:
+        raise InvalidRow('min_temp is above max_temp')
+
+    rainfall = _number(record, 'rainfall') or 0
+    rainfall = round(rainfall * RAIN_UNITS[rain_unit], 2)
+    if not 0 <= rainfall <= MAX_DAILY_RAINFALL:
+        raise InvalidRow(f'rainfall out of range: {rainfall}mm')
+    humidity = _number(record, 'humidity')
+    if humidity is not None and not 0 <= humidity <= 100:
+        raise InvalidRow(f'humidity out of range: {humidity}%')
+
+    return {
+        'city': city, 'date': day, **temps, 'rainfall': rainfall, 'humidity': humidity,
+        'is_extreme_event': _flag(record.get('is_extreme_event')),
+    }
+
+
+def parse(records, report, source, temp_unit='C', rain_unit='mm'):
+    for line, record in records:
+        report.read += 1
+        if record is None:
+            report.invalid += 1
+            report.error(source, line, 'not a JSON object')
+            continue
+        try:
+            yield line, normalize(record, temp_unit, rain_unit)
+        except InvalidRow as e:
+            report.invalid += 1
+            report.error(source, line, e)
+
+
+def resolve_cities(rows, report, source):
+    """Rows as COLUMNS tuples, cities resolved through the in-memory registry"""
+    city_ids = {}  # Also remembers names that matched nothing
+    for line, row in rows:
+        name = row['city']
+        if name not in city_ids:
+            city_ids[name] = city_registry.registry.resolve(name)
+        city_id = city_ids[name]
+        if city_id is None:
+            report.unknown_city += 1
+            report.error(source, line, f'unknown city {name!r}')
+            continue
+        yield (city_id, *(row[c] for c in COLUMNS[1:]))
+
+
+def batched(rows, size):
+    """
+    Lists of up to `size` rows, one per (city, date): a later row replaces an
+    earlier one, as it would across batches
+    """
+    batch = {}
+    for row in rows:
+        batch[row[0], row[1]] = row
+        if len(batch) >= size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+def _upsert_sql(source):
+    table = connection.ops.quote_name(HistoricalRecord._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(c) for c in COLUMNS)
+    updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in map(connection.ops.quote_name, COLUMNS[2:]))
+    return f'INSERT INTO {table} ({columns}) {source} ON CONFLICT (city_id, date) DO UPDATE SET {updates}'
+
+
+def _copy_rows(cursor, batch):
+    """Upsert through COPY into a temporary table (PostgreSQL)"""
+    cursor.execute(
+        'CREATE TEMPORARY TABLE IF NOT EXISTS history_import ('
+        'city_id integer, date date, avg_temp double precision, max_temp double precision, '
+        'min_temp double precision, rainfall double precision, humidity double precision, '
+        'is_extreme_event boolean) ON COMMIT DELETE ROWS'
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow('' if v is None else v for v in row)
+    copy = f'COPY history_import ({", ".join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)'
+    if hasattr(cursor.cursor, 'copy_expert'):  # psycopg2
+        buffer.seek(0)
+        cursor.cursor.copy_expert(copy, buffer)
+    else:  # psycopg 3
+        with cursor.cursor.copy(copy) as stream:
+            stream.write(buffer.getvalue())
+    cursor.execute(_upsert_sql(f'SELECT {", ".join(COLUMNS)} FROM history_import'))
+
+
+def write_batch(batch):
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                _copy_rows(cursor, batch)
+        elif connection.vendor == 'sqlite':
+            placeholders = ', '.join(['%s'] * len(COLUMNS))
+            with connection.cursor() as cursor:
+                cursor.executemany(_upsert_sql(f'VALUES ({placeholders})'), batch)
+        else:
+            HistoricalRecord.objects.bulk_create(
+                [HistoricalRecord(**dict(zip(COLUMNS, row))) for row in batch],
+                update_conflicts=True, unique_fields=['city', 'date'], update_fields=COLUMNS[2:],
+            )
+
+
+def refresh_derived(touched):
+    """Bring the rollups and history store up to date with the imported city-years"""
+    if len(touched) <= REFRESH_LIMIT:
+        rollups.refresh([(city_id, date(year, 1, 1)) for city_id, year in touched])
+        return
+    city_ids = sorted({city_id for city_id, _ in touched})
+    rollups.rebuild(city_ids)
+    history_store.rebuild(city_ids)
+
+
+def import_files(paths, batch_size=5000, temp_unit='C', rain_unit='mm', fmt=None, progress=None):
+    """
+    Import every record of `paths` and return an ImportReport. `progress`,
+    if given, is called with the report after each batch.
+    """
+    report = ImportReport()
+    city_registry.registry.index(force=True)
+    try:
+        for path in paths:
+            source = str(path)
+            rows = parse(read_records(path, fmt), report, source, temp_unit, rain_unit)
+            for batch in batched(resolve_cities(rows, report, source), batch_size):
+                write_batch(batch)
+                report.imported += len(batch)
+                report.touched.update((row[0], row[1].year) for row in batch)
+                if progress:
+                    progress(report)
+    finally:
+        # Batches already committed stay, so their rollups must follow even if a later file fails
+        refresh_derived(report.touched)
+    return report
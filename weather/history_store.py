@@ -0,0 +1,285 @@
+"""
+Optional columnar copy of HistoricalRecord for long daily time series.
+Each city has one memory-mapped file per metric holding a dense day-by-day
+array, so the date index is arithmetic (day - first day) and a date range is a
+zero-copy slice. Only the pages a query touches are read into memory.
+
+Enabled by setting HISTORY_STORE_DIR. rollups.refresh() keeps it in step with
+the table once writes commit; rebuild_history_store recreates it.
+
+Layout of HISTORY_STORE_DIR/city_<id>/:
+    meta.json                 {"start": ordinal of day 0, "days": n, "generation": g}
+    <metric>.<g>.<dtype>      n values; NaN (or 0 for is_extreme_event) on days without a record
+A resize writes a new generation and then swaps meta.json, so readers never
+see a half-written layout.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Min
+
+from .models import HistoricalRecord
+from .rollups import daily_records, year_range
+
+logger = logging.getLogger(__name__)
+
+METRICS = ['avg_temp', 'max_temp', 'min_temp', 'rainfall', 'humidity']
+COLUMNS = {**{metric: np.float32 for metric in METRICS}, 'is_extreme_event': np.uint8}
+
+# Records fetched per query while rebuilding
+CHUNK_SIZE = 50000
+
+
+def _empty(dtype, days):
+    return np.full(days, np.nan if np.issubdtype(dtype, np.floating) else 0, dtype=dtype)
+
+
+def _filename(name, generation):
+    return f'{name}.{generation}.{np.dtype(COLUMNS[name]).str[1:]}'
+
+
+def _map(path, meta, mode):
+    return {
+        name: np.memmap(path / _filename(name, meta['generation']), dtype=dtype, mode=mode, shape=(meta['days'],))
+        for name, dtype in COLUMNS.items()
+    }
+
+
+class CityColumns:
+    """Read-only mappings of one city's columns"""
+
+    def __init__(self, path, meta):
+        self.start = meta['start']
+        self.days = meta['days']
+        self.columns = _map(path, meta, 'r')
+
+    def slice(self, start, end, columns=None):
+        """
+        (first day, {column: array}) for start <= day < end, clipped to the
+        stored days. The arrays are views onto the mapped files.
+        """
+        first = max(start.toordinal() - self.start, 0)
+        last = min(end.toordinal() - self.start, self.days)
+        last = max(first, last)
+        names = columns or COLUMNS
+        return date.fromordinal(self.start + first), {name: self.columns[name][first:last] for name in names}
+
+
+class HistoryStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._open = {}  # city id -> (meta mtime, CityColumns)
+        self._lock = threading.Lock()
+
+    def _path(self, city_id):
+        return self.root / f'city_{city_id}'
+
+    def _meta(self, path):
+        try:
+            with open(path / 'meta.json') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def columns(self, city_id):
+        """The city's CityColumns, reopened when another writer resized them; None if not stored"""
+        path = self._path(city_id)
+        try:
+            mtime = os.stat(path / 'meta.json').st_mtime_ns
+        except FileNotFoundError:
+            self._open.pop(city_id, None)
+            return None
+        opened = self._open.get(city_id)
+        if opened is None or opened[0] != mtime:
+            meta = self._meta(path)
+            if meta is None:
+                return None
+            opened = (mtime, CityColumns(path, meta))
+            self._open[city_id] = opened
+        return opened[1]
+
+    def slice(self, city_id, start, end, columns=None):
+        """CityColumns.slice() of a city, or None if it is not stored"""
+        city = self.columns(city_id)
+        return city.slice(start, end, columns) if city else None
+
+    # Writing
+
+    def _writable(self, city_id, start, end):
+        """Writable mappings covering [start, end) ordinals, growing the files to whole years if needed"""
+        path = self._path(city_id)
+        meta = self._meta(path)
+        if meta and meta['start'] <= start and end <= meta['start'] + meta['days']:
+            return meta['start'], _map(path, meta, 'r+')
+
+        # Grow to whole years around the old and new days
+        if meta:
+            start, end = min(start, meta['start']), max(end, meta['start'] + meta['days'])
+        first = date(date.fromordinal(start).year, 1, 1).toordinal()
+        last = date(date.fromordinal(end - 1).year + 1, 1, 1).toordinal()
+        grown = {'start': first, 'days': last - first, 'generation': meta['generation'] + 1 if meta else 1}
+
+        path.mkdir(parents=True, exist_ok=True)
+        columns = _map(path, grown, 'w+')
+        for name, dtype in COLUMNS.items():
+            columns[name][:] = _empty(dtype, grown['days'])
+        if meta:
+            offset = meta['start'] - first
+            for name, old in _map(path, meta, 'r').items():
+                columns[name][offset:offset + meta['days']] = old
+        for column in columns.values():
+            column.flush()
+
+        tmp = path / 'meta.json.tmp'
+        tmp.write_text(json.dumps(grown))
+        os.replace(tmp, path / 'meta.json')
+        if meta:
+            # Open mappings of the old generation stay valid until their readers reopen
+            for name in COLUMNS:
+                (path / _filename(name, meta['generation'])).unlink(missing_ok=True)
+        return first, columns
+
+    def write(self, city_id, start, end, rows):
+        """
+        Replace the city's days in [start, end) with `rows`, tuples of
+        (date, *METRICS, is_extreme_event) with dates in that range.
+        """
+        with self._lock:
+            first, columns = self._writable(city_id, start.toordinal(), end.toordinal())
+            lo, hi = start.toordinal() - first, end.toordinal() - first
+            for name, dtype in COLUMNS.items():
+                columns[name][lo:hi] = _empty(dtype, hi - lo)
+            self._fill(columns, first, rows)
+            for column in columns.values():
+                column.flush()
+
+    def _fill(self, columns, first, rows):
+        if not rows:
+            return
+        days, *values = zip(*rows)
+        offsets = np.fromiter((day.toordinal() for day in days), dtype=np.int64, count=len(days)) - first
+        for name, column in zip(COLUMNS, values):
+            # None (a missing reading) becomes NaN
+            columns[name][offsets] = np.array(column, dtype=np.float64)
+
+    def drop(self, city_id=None):
+        """Delete a city's columns, or every city's"""
+        with self._lock:
+            if city_id is None:
+                self._open.clear()
+                shutil.rmtree(self.root, ignore_errors=True)
+            else:
+                self._open.pop(city_id, None)
+                shutil.rmtree(self._path(city_id), ignore_errors=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The configured HistoryStore, or None when HISTORY_STORE_DIR is unset"""
+    global _store
+    root = settings.HISTORY_STORE_DIR
+    if not root:
+        return None
+    if _store is None or _store.root != Path(root):
+        with _store_lock:
+            if _store is None or _store.root != Path(root):
+                _store = HistoryStore(root)
+    return _store
+
+
+def _records(queryset):
+    return queryset.values_list('date', *METRICS, 'is_extreme_event')
+
+
+def refresh(touched):
+    """
+    Rewrite the whole years containing (city id, date) pairs from the table.
+    Failures are logged; the store then lags until rebuild_history_store.
+    """
+    store = get_store()
+    if store is None:
+        return
+    for city_id, year in sorted({(city_id, day.year) for city_id, day in touched}):
+        start, end = year_range(year, year)
+        try:
+            store.write(city_id, start, end, list(_records(daily_records(city_id, start, end))))
+        except OSError:
+            logger.exception("Failed to update the history store for city %s, %s", city_id, year)
+
+
+def rebuild(city_ids=None):
+    """Recreate the store (or the given cities) from the table. Returns the number of records written."""
+    store = get_store()
+    if store is None:
+        return 0
+    records = HistoricalRecord.objects.order_by()
+    if city_ids is not None:
+        records = records.filter(city_id__in=city_ids)
+        for city_id in city_ids:
+            store.drop(city_id)
+    else:
+        store.drop()
+
+    spans = records.values('city_id').annotate(first=Min('date'), last=Max('date')).values_list(
+        'city_id', 'first', 'last',
+    )
+    written = 0
+    for city_id, first, last in spans:
+        # Allocate the whole span once, then fill it a chunk at a time
+        store.write(city_id, date(first.year, 1, 1), date(last.year + 1, 1, 1), [])
+        chunk = []
+        for row in _records(records.filter(city_id=city_id).order_by('date')).iterator(chunk_size=CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) == CHUNK_SIZE:
+                written += _write_chunk(store, city_id, chunk)
+                chunk = []
+        written += _write_chunk(store, city_id, chunk)
+    return written
+
+
+def _write_chunk(store, city_id, rows):
+    if rows:
+        store.write(city_id, rows[0][0], date.fromordinal(rows[-1][0].toordinal() + 1), rows)
+    return len(rows)
+
+
+def _points(values):
+    """JSON-ready values rounded to 0.1, NaN as None"""
+    return [None if v != v else v for v in np.round(values.astype(np.float64), 1).tolist()]
+
+
+def daily_series(city_id, start, end):
+    """
+    Chart series of each recorded day in [start, end): slices of the store
+    when it holds the city, otherwise the table.
+    """
+    store = get_store()
+    sliced = store.slice(city_id, start, end, ['avg_temp', 'rainfall', 'humidity']) if store else None
+    if sliced is None:
+        rows = list(daily_records(city_id, start, end).order_by('date').values_list(
+            'date', 'avg_temp', 'rainfall', 'humidity',
+        ))
+        days = np.array([row[0] for row in rows], dtype='datetime64[D]')
+        temp, rainfall, humidity = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 3).T
+    else:
+        first, columns = sliced
+        recorded = np.flatnonzero(~np.isnan(columns['avg_temp']))
+        days = np.datetime64(first, 'D') + recorded
+        temp, rainfall, humidity = (columns[name][recorded] for name in ('avg_temp', 'rainfall', 'humidity'))
+
+    return {
+        'labels': days.astype(str).tolist(),
+        'temperature': _points(temp),
+        'rainfall': _points(rainfall),
+        'humidity': _points(humidity),
+    }
@@ -1,12 +1,37 @@
 """
 Management command to fetch current weather for all seeded cities.
 Usage: python manage.py fetch_weather
+       python manage.py fetch_weather --workers 8 --rps 1
+Current weather is fetched in OWM group requests (20 cities per call)
+unless --no-group is given.
 """
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import F
 from weather.models import City
+from weather.concurrency import TokenBucket
 from weather import services
 
 
+def closes_connections(fetch):
+    """Wrap a worker job so the database connections its thread opened (for quota accounting) are closed"""
+    def job(*args):
+        try:
+            return fetch(*args)
+        finally:
+            connections.close_all()
+    return job
+
+
+def latest_fetched_at():
+    """fetched_at of each city's latest CurrentWeather"""
+    return F('latest_weather__fetched_at')
+
+
 class Command(BaseCommand):
     help = 'Fetch current weather and forecasts for all seeded cities from OpenWeatherMap'
 
@@ -16,6 +41,29 @@ class Command(BaseCommand):
             type=str,
             help='Fetch weather for a specific city only',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of concurrent upstream fetches (default: 1, serial)',
+        )
+        parser.add_argument(
+            '--rps',
+            type=float,
+            help='Upstream requests per second '
+                 '(default: derived from OPENWEATHERMAP_CALLS_PER_MINUTE)',
+        )
+        parser.add_argument(
+            '--no-group',
+            action='store_true',
+            help='Fetch current weather one city per request instead of in group requests',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Cities written per database transaction in concurrent mode',
+        )
 
     def handle(self, *args, **options):
         city_name = options.get('city')
@@ -30,6 +78,19 @@ class Command(BaseCommand):
 
         self.stdout.write(f'Fetching weather for {cities.count()} cities...\n')
 
+        if options['workers'] > 1 or options['rps']:
+            self.fetch_concurrently(cities, options)
+            return
+
+        if not options['no_group']:
+            # Refresh stale readings up front in group requests; the loop below
+            # then finds them fresh and only fetches what the groups missed.
+            stale = [
+                city for city in cities.annotate(current_fetched_at=latest_fetched_at())
+                if services.is_stale(city.current_fetched_at, services.CURRENT_WEATHER_TTL)
+            ]
+            services.update_current_weather_batch(stale)
+
         success_count = 0
         error_count = 0
 
@@ -37,7 +98,7 @@ class Command(BaseCommand):
             self.stdout.write(f'  Fetching: {city.name}...')
 
             # Fetch current weather
-            current = services.get_or_update_current_weather(city)
+            current = services.get_or_update_current_weather(city, background=False)
             if current:
                 self.stdout.write(
                     f'    Current: {current.temperature}°C, {current.condition}'
@@ -49,7 +110,7 @@ class Command(BaseCommand):
                 continue
 
             # Fetch forecasts
-            hourly, daily = services.get_or_update_forecasts(city)
+            hourly, daily = services.get_or_update_forecasts(city, background=False)
             if hourly:
                 self.stdout.write(f'    Hourly: {len(hourly)} entries')
             if daily:
@@ -59,3 +120,140 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(
             f'Done! Success: {success_count}, Errors: {error_count}'
         ))
+
+    def fetch_concurrently(self, cities, options):
+        """
+        Fan upstream fetches out over a thread pool, throttled by a token bucket,
+        then write the results to the database in batched transactions.
+        Worker threads make the HTTP calls and charge them to the quota table;
+        every other database access stays on this thread.
+        """
+        workers = max(1, options['workers'])
+        rps = options['rps'] or settings.OPENWEATHERMAP_CALLS_PER_MINUTE / 60
+        limiter = TokenBucket(rps, capacity=workers)
+        timings = {}
+
+        # Phase 1: work out which cities need which fetches
+        started = time.perf_counter()
+        cities = cities.annotate(current_fetched_at=latest_fetched_at())
+        current_stale = []
+        forecast_stale = []
+        for city in cities:
+            if services.is_stale(city.current_fetched_at, services.CURRENT_WEATHER_TTL):
+                current_stale.append(city)
+            if services.is_stale(city.forecast_fetched_at, services.FORECAST_TTL):
+                forecast_stale.append(city)
+
+        # One Call returns current weather along with the forecast, so cities
+        # whose forecast is stale need no separate current-weather request
+        use_onecall = services.onecall_available()
+        forecast_pks = {c.pk for c in forecast_stale}
+        current_pks = {c.pk for c in current_stale}
+        current_only = [
+            c for c in current_stale if not (use_onecall and c.pk in forecast_pks)
+        ]
+
+        # Each job is one upstream call's worth of cities
+        if options['no_group']:
+            current_jobs = [[city] for city in current_only]
+        else:
+            grouped = [c for c in current_only if c.owm_id]
+            current_jobs = [
+                grouped[i:i + services.OWM_GROUP_LIMIT]
+                for i in range(0, len(grouped), services.OWM_GROUP_LIMIT)
+            ] + [[c] for c in current_only if not c.owm_id]
+        timings['plan'] = time.perf_counter() - started
+        self.stdout.write(
+            f'  {len(current_stale)} current / {len(forecast_stale)} forecast stale, '
+            f'fetching with {workers} workers at {rps:g} req/s'
+        )
+
+        @closes_connections
+        def fetch_current(chunk):
+            limiter.acquire()
+            if options['no_group'] or (len(chunk) == 1 and not chunk[0].owm_id):
+                data = services.fetch_current_weather(chunk[0].name)
+                return [(chunk[0], data)] if data else []
+            by_id = services.fetch_current_weather_group([c.owm_id for c in chunk])
+            results = [(c, by_id[c.owm_id]) for c in chunk if c.owm_id in by_id]
+            # Cities missing from a group response get one individual retry
+            for city in chunk:
+                if city.owm_id not in by_id:
+                    limiter.acquire()
+                    data = services.fetch_current_weather(city.name)
+                    if data:
+                        results.append((city, data))
+            return results
+
+        @closes_connections
+        def fetch_forecast(city, coords=None):
+            current = None
+            lat, lon = coords or (city.lat, city.lon)
+            if not lat or not lon:
+                # Learn the coordinates from a current reading, which is then saved too
+                limiter.acquire()
+                current = services.fetch_current_weather(city.name)
+                if not current:
+                    return city, None, [], []
+                lat, lon = current['lat'], current['lon']
+            if use_onecall:
+                limiter.acquire()
+                onecall_current, hourly, daily = services.fetch_onecall(lat, lon)
+                if onecall_current:
+                    return city, onecall_current, hourly, daily
+                # Fall back to the 2.5 endpoints for this city
+                if current is None and city.pk in current_pks:
+                    limiter.acquire()
+                    current = services.fetch_current_weather(city.name)
+            limiter.acquire()
+            hourly, daily = services.fetch_forecast(lat, lon)
+            return city, current, hourly, daily
+
+        # Phase 2: upstream fetches. Cities without coordinates wait for their
+        # current reading, which carries them, before their forecast is fetched.
+        started = time.perf_counter()
+        located = [city for city in forecast_stale if city.lat and city.lon]
+        unlocated = [city for city in forecast_stale if not (city.lat and city.lon)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            current_futures = [executor.submit(fetch_current, job) for job in current_jobs]
+            forecast_futures = [executor.submit(fetch_forecast, city) for city in located]
+            current_results = [pair for f in current_futures for pair in f.result()]
+            coords = {city.pk: (data['lat'], data['lon']) for city, data in current_results}
+            forecast_futures += [
+                executor.submit(fetch_forecast, city, coords.get(city.pk)) for city in unlocated
+            ]
+            forecast_results = [f.result() for f in forecast_futures]
+        timings['fetch'] = time.perf_counter() - started
+        current_results += [
+            (city, current) for city, current, _, _ in forecast_results if current
+        ]
+
+        # Phase 3: batched database writes
+        started = time.perf_counter()
+        batch_size = max(1, options['batch_size'])
+        for i in range(0, len(current_results), batch_size):
+            services.save_current_weather_batch(current_results[i:i + batch_size])
+        for i in range(0, len(forecast_results), batch_size):
+            with transaction.atomic():
+                for city, _, hourly, daily in forecast_results[i:i + batch_size]:
+                    if hourly:
+                        services.save_forecasts(city, hourly, daily)
+        timings['write'] = time.perf_counter() - started
+
+        fetched = {city.pk for city, _ in current_results}
+        for city in current_stale:
+            if city.pk not in fetched:
+                self.stdout.write(self.style.WARNING(
+                    f'    {city.name}: failed to fetch current weather'
+                ))
+        # One Call also returns current weather for cities only due a forecast; don't count those
+        success_count = len(fetched & current_pks)
+        error_count = len(current_stale) - success_count
+
+        self.stdout.write('')
+        for phase, seconds in timings.items():
+            self.stdout.write(f'  {phase:<6} {seconds:8.3f}s')
+        self.stdout.write(f'  {"total":<6} {sum(timings.values()):8.3f}s')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done! Success: {success_count}, Errors: {error_count}'
+        ))
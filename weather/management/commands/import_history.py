@@ -0,0 +1,70 @@
+"""
+Import daily observations into HistoricalRecord from CSV or NDJSON archives.
+Usage: python manage.py import_history archive.csv.gz
+       python manage.py import_history obs-*.ndjson --temp-unit F --rain-unit in
+Columns: city, date (YYYY-MM-DD), avg_temp, max_temp, min_temp, rainfall,
+humidity, is_extreme_event; rows may give temp_unit / rainfall_unit. Existing
+records for the same city and date are replaced.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from weather import history_import
+
+
+class Command(BaseCommand):
+    help = 'Stream CSV/NDJSON (optionally gzipped) observation archives into the historical records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Archive files')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ndjson'],
+            help='Input format (default: from the file extension)',
+        )
+        parser.add_argument(
+            '--temp-unit',
+            choices=sorted(history_import.TEMP_UNITS),
+            default='C',
+            help='Unit of temperatures without a temp_unit column (default: C)',
+        )
+        parser.add_argument(
+            '--rain-unit',
+            choices=sorted(history_import.RAIN_UNITS),
+            default='mm',
+            help='Unit of rainfall without a rainfall_unit column (default: mm)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows written per transaction (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def progress(report):
+            self.stdout.write(
+                f'  {report.read:,} rows read, {report.imported:,} imported '
+                f'({report.rate:,.0f} rows/s)'
+            )
+
+        try:
+            report = history_import.import_files(
+                options['paths'],
+                batch_size=options['batch_size'],
+                temp_unit=options['temp_unit'],
+                rain_unit=options['rain_unit'],
+                fmt=options['format'],
+                progress=progress if options['verbosity'] > 0 else None,
+            )
+        except history_import.ArchiveError as e:
+            raise CommandError(f'{e} (rows imported before this were kept)')
+
+        for error in report.errors:
+            self.stdout.write(self.style.WARNING(f'  {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report.imported:,} of {report.read:,} rows in {report.elapsed:.1f}s '
+            f'({report.rate:,.0f} rows/s); skipped {report.invalid:,} invalid and '
+            f'{report.unknown_city:,} with unknown cities'
+        ))
@@ -0,0 +1,80 @@
+"""
+Local stand-in for api.openweathermap.org, for load tests and offline runs.
+Usage: python manage.py owm_fake_server --port 8089
+Point the app at it with OPENWEATHERMAP_HOST=http://127.0.0.1:8089
+"""
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from weather.client import FakeClient
+
+
+class Command(BaseCommand):
+    help = 'Serve recorded or synthetic OpenWeatherMap responses over HTTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--bind', default='127.0.0.1')
+        parser.add_argument(
+            '--replay',
+            action='store_true',
+            help='Only serve recorded fixtures; 404 for anything else',
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=settings.OPENWEATHERMAP_FAKE_LATENCY,
+            help='Mean added latency per request in seconds',
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=settings.OPENWEATHERMAP_FAKE_ERROR_RATE,
+            help='Share of requests that fail with a 503',
+        )
+
+    def handle(self, *args, **options):
+        provider = FakeClient(
+            fixtures_dir=settings.OPENWEATHERMAP_FIXTURES_DIR,
+            synthetic=not options['replay'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+        )
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                params = dict(parse_qsl(parts.query))
+                try:
+                    status, body = 200, provider.fetch(parts.path, params)
+                except requests.HTTPError as e:
+                    status = e.response.status_code
+                    body = {'cod': str(status), 'message': str(e)}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['bind'], options['port']), Handler)
+        server.daemon_threads = True
+        self.stdout.write(
+            f'Fake OpenWeatherMap on http://{options["bind"]}:{options["port"]} '
+            f'({"replay" if options["replay"] else "fake"}, '
+            f'latency {options["latency"]}s, error rate {options["error_rate"]:.0%})'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(self.style.SUCCESS('Fake server stopped'))
@@ -0,0 +1,34 @@
+"""
+Recreate the memory-mapped history store from the daily records.
+Usage: python manage.py rebuild_history_store
+       python manage.py rebuild_history_store --city Colombo
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from weather import history_store
+from weather.models import City
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the columnar history store (HISTORY_STORE_DIR) from HistoricalRecord'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city', help='Only rebuild this city (default: all)')
+
+    def handle(self, *args, **options):
+        if not settings.HISTORY_STORE_DIR:
+            raise CommandError('HISTORY_STORE_DIR is not set')
+
+        city_ids = None
+        if options['city']:
+            city_ids = list(City.objects.filter(name__iexact=options['city']).values_list('pk', flat=True))
+            if not city_ids:
+                raise CommandError(f'City "{options["city"]}" not found')
+
+        started = time.monotonic()
+        written = history_store.rebuild(city_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {written} daily records in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,25 @@
+"""
+Recompute the monthly/yearly history rollups from the daily records.
+Usage: python manage.py rebuild_rollups
+       python manage.py rebuild_rollups --city Colombo
+"""
+from django.core.management.base import BaseCommand, CommandError
+from weather import rollups
+from weather.models import City
+
+
+class Command(BaseCommand):
+    help = 'Rebuild HistoryRollup rows after backfills or direct database edits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city', help='Only rebuild this city (default: all)')
+
+    def handle(self, *args, **options):
+        city_ids = None
+        if options['city']:
+            city_ids = list(City.objects.filter(name__iexact=options['city']).values_list('pk', flat=True))
+            if not city_ids:
+                raise CommandError(f'City "{options["city"]}" not found')
+
+        written = rollups.rebuild(city_ids)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup rows'))
@@ -12,18 +12,18 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write('Seeding cities...')
         cities_data = [
-            {'name': 'Colombo', 'province': 'Western Province', 'lat': 6.9271, 'lon': 79.8612},
-            {'name': 'Kandy', 'province': 'Central Province', 'lat': 7.2906, 'lon': 80.6337},
+            {'name': 'Colombo', 'province': 'Western Province', 'lat': 6.9271, 'lon': 79.8612, 'aliases': ['Kolamba']},
+            {'name': 'Kandy', 'province': 'Central Province', 'lat': 7.2906, 'lon': 80.6337, 'aliases': ['Mahanuwara', 'Senkadagala']},
             {'name': 'Galle', 'province': 'Southern Province', 'lat': 6.0535, 'lon': 80.2210},
-            {'name': 'Jaffna', 'province': 'Northern Province', 'lat': 9.6615, 'lon': 80.0255},
-            {'name': 'Trincomalee', 'province': 'Eastern Province', 'lat': 8.5874, 'lon': 81.2152},
+            {'name': 'Jaffna', 'province': 'Northern Province', 'lat': 9.6615, 'lon': 80.0255, 'aliases': ['Yalpanam']},
+            {'name': 'Trincomalee', 'province': 'Eastern Province', 'lat': 8.5874, 'lon': 81.2152, 'aliases': ['Trinco']},
             {'name': 'Ratnapura', 'province': 'Sabaragamuwa Province', 'lat': 6.6828, 'lon': 80.3992},
             {'name': 'Nuwara Eliya', 'province': 'Central Province', 'lat': 6.9497, 'lon': 80.7891},
             {'name': 'Badulla', 'province': 'Uva Province', 'lat': 6.9934, 'lon': 81.0550},
             {'name': 'Anuradhapura', 'province': 'North Central Province', 'lat': 8.3114, 'lon': 80.4037},
             {'name': 'Matara', 'province': 'Southern Province', 'lat': 5.9549, 'lon': 80.5550},
             {'name': 'Negombo', 'province': 'Western Province', 'lat': 7.2008, 'lon': 79.8737},
-            {'name': 'Batticaloa', 'province': 'Eastern Province', 'lat': 7.7310, 'lon': 81.6747},
+            {'name': 'Batticaloa', 'province': 'Eastern Province', 'lat': 7.7310, 'lon': 81.6747, 'aliases': ['Madakalapuwa']},
             {'name': 'Hikkaduwa', 'province': 'Southern Province', 'lat': 6.1395, 'lon': 80.1063},
             {'name': 'Ella', 'province': 'Uva Province', 'lat': 6.8667, 'lon': 81.0466},
             {'name': 'Sigiriya', 'province': 'Central Province', 'lat': 7.9570, 'lon': 80.7603},
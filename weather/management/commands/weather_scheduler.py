@@ -0,0 +1,71 @@
+"""
+Long-running refresh scheduler.
+Usage: python manage.py weather_scheduler
+       python manage.py weather_scheduler --calls-per-minute 40
+"""
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from weather.scheduler import RefreshScheduler
+
+
+class Command(BaseCommand):
+    help = 'Keep city weather refreshed ahead of the cache TTLs, prioritised by popularity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--calls-per-minute',
+            type=int,
+            default=settings.WEATHER_SCHEDULER_CALLS_PER_MINUTE,
+            help='Upstream call budget per minute',
+        )
+        parser.add_argument(
+            '--reload-every',
+            type=int,
+            default=300,
+            help='Seconds between reloading the city list',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Refresh whatever is due now and exit',
+        )
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        scheduler = RefreshScheduler(options['calls_per_minute'])
+        scheduler.load()
+        loaded_at = time.time()
+        self.stdout.write(
+            f'Scheduling {len(scheduler.cities)} cities '
+            f'within {options["calls_per_minute"]} calls/min'
+        )
+
+        while self.running:
+            started = time.perf_counter()
+            refreshed = scheduler.run_due()
+            if refreshed:
+                self.stdout.write(
+                    f'  Refreshed {refreshed} in {time.perf_counter() - started:.2f}s'
+                )
+            if options['once']:
+                break
+
+            if time.time() - loaded_at >= options['reload_every']:
+                close_old_connections()
+                scheduler.load()
+                loaded_at = time.time()
+
+            # Sleep at least a second so an unavailable upstream doesn't spin the loop
+            time.sleep(min(max(1, scheduler.next_wakeup() - time.time()), 5))
+
+        self.stdout.write(self.style.SUCCESS('Scheduler stopped'))
+
+    def stop(self, signum, frame):
+        self.running = False
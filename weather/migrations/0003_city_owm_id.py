@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0002_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='owm_id',
+            field=models.IntegerField(blank=True, help_text='OpenWeatherMap city id, used for group requests', null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0.2 on 2026-10-17 07:18
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def dedupe_and_backfill(apps, schema_editor):
+    """Drop duplicate forecast slots (keeping the newest row) and record forecast freshness."""
+    City = apps.get_model('weather', 'City')
+    HourlyForecast = apps.get_model('weather', 'HourlyForecast')
+    DailyForecast = apps.get_model('weather', 'DailyForecast')
+
+    for model, key in ((HourlyForecast, 'datetime'), (DailyForecast, 'date')):
+        seen = set()
+        duplicates = []
+        for pk, city_id, slot in model.objects.order_by('-id').values_list('id', 'city_id', key):
+            if (city_id, slot) in seen:
+                duplicates.append(pk)
+            else:
+                seen.add((city_id, slot))
+        model.objects.filter(id__in=duplicates).delete()
+
+    for row in HourlyForecast.objects.values('city_id').annotate(latest=Max('fetched_at')):
+        City.objects.filter(id=row['city_id']).update(forecast_fetched_at=row['latest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0003_city_owm_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='forecast_fetched_at',
+            field=models.DateTimeField(blank=True, help_text='When forecasts were last refreshed', null=True),
+        ),
+        migrations.RunPython(dedupe_and_backfill, reverse_code=migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='dailyforecast',
+            unique_together={('city', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyforecast',
+            unique_together={('city', 'datetime')},
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.2 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0004_forecast_upsert_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpstreamQuota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('minute', 'Minute'), ('day', 'Day')], max_length=10)),
+                ('window_start', models.DateTimeField()),
+                ('calls', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('period', 'window_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-17 07:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_latest_weather(apps, schema_editor):
+    """Point every city at its newest CurrentWeather reading."""
+    City = apps.get_model('weather', 'City')
+    CurrentWeather = apps.get_model('weather', 'CurrentWeather')
+    newest = CurrentWeather.objects.filter(city=OuterRef('pk')).order_by('-fetched_at').values('pk')[:1]
+    City.objects.update(latest_weather=Subquery(newest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0005_upstream_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='latest_weather',
+            field=models.ForeignKey(blank=True, help_text='Newest CurrentWeather reading, kept up to date on ingest', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='weather.currentweather'),
+        ),
+        migrations.RunPython(backfill_latest_weather, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0006_city_latest_weather'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='aliases',
+            field=models.JSONField(blank=True, default=list, help_text='Other names the city is searched by, e.g. ["Trinco"]'),
+        ),
+    ]
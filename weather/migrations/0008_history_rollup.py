@@ -0,0 +1,71 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:20
+
+from collections import defaultdict
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_rollups(apps, schema_editor):
+    """Monthly and yearly rollups of the existing daily records (same as `manage.py rebuild_rollups`)."""
+    HistoricalRecord = apps.get_model('weather', 'HistoricalRecord')
+    HistoryRollup = apps.get_model('weather', 'HistoryRollup')
+    months = HistoricalRecord.objects.annotate(start=TruncMonth('date')).values('city_id', 'start').annotate(
+        days=Count('id'), temp_sum=Sum('avg_temp'), max_temp=Max('max_temp'), min_temp=Min('min_temp'),
+        rainfall_sum=Sum('rainfall'), humidity_sum=Sum('humidity'), humidity_days=Count('humidity'),
+        extreme_events=Count('id', filter=Q(is_extreme_event=True)),
+    ).order_by('city_id', 'start')
+
+    rollups = []
+    years = defaultdict(list)
+    for row in months:
+        row['rainfall_sum'] = row['rainfall_sum'] or 0
+        row['humidity_sum'] = row['humidity_sum'] or 0
+        rollups.append(HistoryRollup(period='M', **row))
+        years[row['city_id'], row['start'].year].append(row)
+    for (city_id, year), rows in years.items():
+        maxima = [r['max_temp'] for r in rows if r['max_temp'] is not None]
+        minima = [r['min_temp'] for r in rows if r['min_temp'] is not None]
+        rollups.append(HistoryRollup(
+            city_id=city_id, period='Y', start=date(year, 1, 1),
+            max_temp=max(maxima, default=None), min_temp=min(minima, default=None),
+            **{f: sum(r[f] for r in rows) for f in (
+                'days', 'temp_sum', 'rainfall_sum', 'humidity_sum', 'humidity_days', 'extreme_events'
+            )},
+        ))
+    HistoryRollup.objects.bulk_create(rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0007_city_aliases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('M', 'Month'), ('Y', 'Year')], max_length=1)),
+                ('start', models.DateField(help_text='First day of the month or year')),
+                ('days', models.PositiveIntegerField(help_text='Daily records in the period')),
+                ('temp_sum', models.FloatField()),
+                ('max_temp', models.FloatField(blank=True, null=True)),
+                ('min_temp', models.FloatField(blank=True, null=True)),
+                ('rainfall_sum', models.FloatField(default=0)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_days', models.PositiveIntegerField(default=0, help_text='Days with a humidity reading')),
+                ('extreme_events', models.PositiveIntegerField(default=0)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_rollups', to='weather.city')),
+            ],
+            options={
+                'ordering': ['start'],
+                'unique_together': {('city', 'period', 'start')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-17 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0008_history_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicalrecord',
+            index=models.Index(fields=['city', 'date', 'avg_temp', 'max_temp', 'min_temp', 'rainfall', 'humidity', 'is_extreme_event'], name='history_city_date_cover'),
+        ),
+    ]
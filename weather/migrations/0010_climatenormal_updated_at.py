@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0009_history_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='climatenormal',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
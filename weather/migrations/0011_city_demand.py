@@ -0,0 +1,22 @@
+# Generated by Django 6.0.2 on 2026-10-17 08:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0010_climatenormal_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityDemand',
+            fields=[
+                ('city', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='weather.city')),
+                ('requests', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
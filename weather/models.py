@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 
@@ -10,8 +10,17 @@ class City(models.Model):
     name = models.CharField(max_length=100, unique=True)
     country = models.CharField(max_length=10, default='LK')
     province = models.CharField(max_length=100, blank=True)
+    aliases = models.JSONField(
+        default=list, blank=True, help_text='Other names the city is searched by, e.g. ["Trinco"]'
+    )
     lat = models.FloatField()
     lon = models.FloatField()
+    owm_id = models.IntegerField(null=True, blank=True, help_text='OpenWeatherMap city id, used for group requests')
+    forecast_fetched_at = models.DateTimeField(null=True, blank=True, help_text='When forecasts were last refreshed')
+    latest_weather = models.ForeignKey(
+        'CurrentWeather', null=True, blank=True, on_delete=models.SET_NULL, related_name='+',
+        help_text='Newest CurrentWeather reading, kept up to date on ingest'
+    )
 
     class Meta:
         verbose_name_plural = 'Cities'
@@ -62,6 +71,7 @@ class HourlyForecast(models.Model):
 
     class Meta:
         ordering = ['datetime']
+        unique_together = ['city', 'datetime']
 
     def __str__(self):
         return f"{self.city.name} @ {self.datetime}: {self.temperature}°C"
@@ -83,6 +93,7 @@ class DailyForecast(models.Model):
 
     class Meta:
         ordering = ['date']
+        unique_together = ['city', 'date']
 
     def __str__(self):
         return f"{self.city.name} {self.date}: {self.temp_high}°/{self.temp_low}°"
@@ -144,11 +155,59 @@ class HistoricalRecord(models.Model):
     class Meta:
         ordering = ['-date']
         unique_together = ['city', 'date']
+        indexes = [
+            # Covers the per-city date-range aggregation that maintains the
+            # rollups, so it reads index entries only, in (city, date) order
+            models.Index(
+                fields=['city', 'date', 'avg_temp', 'max_temp', 'min_temp', 'rainfall', 'humidity', 'is_extreme_event'],
+                name='history_city_date_cover',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.city.name} {self.date}: {self.avg_temp}°C"
 
 
+class HistoryRollup(models.Model):
+    """
+    Monthly and yearly totals of a city's HistoricalRecord rows, kept in step
+    by weather.rollups. Averages are stored as sums and day counts so periods
+    combine exactly.
+    """
+    MONTH = 'M'
+    YEAR = 'Y'
+    PERIOD_CHOICES = [
+        (MONTH, 'Month'),
+        (YEAR, 'Year'),
+    ]
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='history_rollups')
+    period = models.CharField(max_length=1, choices=PERIOD_CHOICES)
+    start = models.DateField(help_text='First day of the month or year')
+    days = models.PositiveIntegerField(help_text='Daily records in the period')
+    temp_sum = models.FloatField()
+    max_temp = models.FloatField(null=True, blank=True)
+    min_temp = models.FloatField(null=True, blank=True)
+    rainfall_sum = models.FloatField(default=0)
+    humidity_sum = models.FloatField(default=0)
+    humidity_days = models.PositiveIntegerField(default=0, help_text='Days with a humidity reading')
+    extreme_events = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['start']
+        unique_together = ['city', 'period', 'start']
+
+    def __str__(self):
+        return f"{self.city.name} {self.get_period_display()} {self.start}"
+
+    @property
+    def avg_temp(self):
+        return self.temp_sum / self.days if self.days else None
+
+    @property
+    def avg_humidity(self):
+        return self.humidity_sum / self.humidity_days if self.humidity_days else None
+
+
 class ClimateNormal(models.Model):
     """Climate normal data for weather stations"""
     station_name = models.CharField(max_length=100)
@@ -157,6 +216,7 @@ class ClimateNormal(models.Model):
     annual_rainfall = models.FloatField(help_text='mm')
     rainy_days = models.IntegerField()
     sunshine_hours = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['station_name']
@@ -187,6 +247,33 @@ class ActivityOutlook(models.Model):
         return f"{self.activity_name} @ {self.location}: {self.suitability}"
 
 
+class UpstreamQuota(models.Model):
+    """OpenWeatherMap calls made per minute / per day window (UTC)"""
+    PERIOD_CHOICES = [
+        ('minute', 'Minute'),
+        ('day', 'Day'),
+    ]
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    window_start = models.DateTimeField()
+    calls = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['period', 'window_start']
+
+    def __str__(self):
+        return f"{self.period} from {self.window_start}: {self.calls} calls"
+
+
+class CityDemand(models.Model):
+    """Requests for a city's weather not yet read by the refresh scheduler"""
+    city = models.OneToOneField(City, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    requests = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.city_id}: {self.requests} requests"
+
+
 class Profile(models.Model):
     """Per-user profile and preferences (MVP - mock premium flag)."""
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='profile')
@@ -206,3 +293,65 @@ class Profile(models.Model):
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=CurrentWeather)
+def point_city_to_latest_weather(sender, instance, created, **kwargs):
+    """Keep City.latest_weather on the newest reading (bulk_create callers update it themselves)"""
+    if created:
+        City.objects.filter(pk=instance.city_id).filter(
+            models.Q(latest_weather__isnull=True) | models.Q(latest_weather__fetched_at__lte=instance.fetched_at)
+        ).update(latest_weather=instance)
+        instance.city.latest_weather = instance
+
+
+@receiver([post_save, post_delete], sender=City)
+def refresh_city_registry(sender, update_fields=None, **kwargs):
+    """Reload the city index now, and again once the change is visible to other connections"""
+    from .city_registry import INDEXED_FIELDS, registry
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    registry.changed()
+    transaction.on_commit(registry.changed)
+
+
+@receiver(post_save, sender=HistoricalRecord)
+def refresh_history_rollups(sender, instance, **kwargs):
+    """Single-row writes; bulk writers call rollups.refresh() themselves"""
+    from .rollups import refresh
+    refresh([(instance.city_id, instance.date)])
+
+
+@receiver(post_delete, sender=HistoricalRecord)
+def refresh_history_rollups_after_delete(sender, instance, origin=None, **kwargs):
+    """
+    Queryset and cascade deletes send this for every row, so their years are
+    gathered and recomputed once on commit. Rows deleted with their city take
+    its rollups along and need nothing.
+    """
+    from .rollups import refresh, refresh_on_commit
+    if isinstance(origin, City) or (isinstance(origin, models.QuerySet) and origin.model is City):
+        return
+    if origin is instance:
+        refresh([(instance.city_id, instance.date)])
+    else:
+        refresh_on_commit([(instance.city_id, instance.date)])
+
+
+@receiver([post_save, post_delete], sender=ActivityOutlook)
+@receiver([post_save, post_delete], sender=ClimateNormal)
+def invalidate_cached_responses(sender, **kwargs):
+    from .response_cache import bump
+    bump(sender._meta.model_name)
+
+
+@receiver(post_save, sender=WeatherAlert)
+def publish_alert_change(sender, instance, **kwargs):
+    from .broadcast import alert_event, publish
+    publish(alert_event(instance))
+
+
+@receiver(post_delete, sender=WeatherAlert)
+def publish_alert_removal(sender, instance, **kwargs):
+    from .broadcast import alert_event, publish
+    publish(alert_event(instance, deleted=True))
@@ -0,0 +1,85 @@
+"""
+Persistent OpenWeatherMap quota accounting.
+Calls are counted per UTC minute and per UTC day in the UpstreamQuota table,
+so every process (web workers, scheduler, commands) shares one budget.
+"""
+import logging
+import threading
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Threads of one process take turns, so they don't contend for the SQLite write lock
+_lock = threading.Lock()
+
+
+def _windows(now=None):
+    """(period, window start, limit) for each quota window containing `now`"""
+    now = (now or timezone.now()).astimezone(dt_timezone.utc)
+    return [
+        ('minute', now.replace(second=0, microsecond=0), settings.OPENWEATHERMAP_CALLS_PER_MINUTE),
+        ('day', now.replace(hour=0, minute=0, second=0, microsecond=0), settings.OPENWEATHERMAP_CALLS_PER_DAY),
+    ]
+
+
+def _increment(period, window_start, limit, calls):
+    """Add `calls` to a window unless that would exceed `limit`. Returns True on success."""
+    from .models import UpstreamQuota
+
+    rows = UpstreamQuota.objects.filter(period=period, window_start=window_start)
+    if rows.filter(calls__lte=limit - calls).update(calls=F('calls') + calls):
+        return True
+    if calls > limit:
+        return False
+
+    _, created = UpstreamQuota.objects.get_or_create(
+        period=period, window_start=window_start, defaults={'calls': calls}
+    )
+    if created:
+        # First call in a new window: drop windows that can no longer matter
+        UpstreamQuota.objects.filter(
+            period=period, window_start__lt=window_start - timedelta(days=2)
+        ).delete()
+        return True
+    # Someone else created the row first; try once more against it
+    return bool(rows.filter(calls__lte=limit - calls).update(calls=F('calls') + calls))
+
+
+def try_acquire(calls=1):
+    """
+    Reserve `calls` upstream calls in both the minute and day windows.
+    Returns False (reserving nothing) if either window is full.
+    Fails open if the counter table cannot be written.
+    """
+    try:
+        with _lock, transaction.atomic():
+            for period, window_start, limit in _windows():
+                if not _increment(period, window_start, limit, calls):
+                    transaction.set_rollback(True)
+                    return False
+        return True
+    except DatabaseError as e:
+        logger.warning(f"Quota counter unavailable, allowing upstream call: {e}")
+        return True
+
+
+def remaining():
+    """Calls left in the current window for each period, e.g. {'minute': 12, 'day': 900}"""
+    from .models import UpstreamQuota
+
+    left = {}
+    for period, window_start, limit in _windows():
+        used = UpstreamQuota.objects.filter(
+            period=period, window_start=window_start
+        ).values_list('calls', flat=True).first() or 0
+        left[period] = max(0, limit - used)
+    return left
+
+
+def has_quota(calls=1):
+    return all(left >= calls for left in remaining().values())
@@ -0,0 +1,128 @@
+"""
+Cache of serialized API responses.
+Entries are keyed by view, request parameters and the version of every data
+scope they were built from (e.g. 'city:12:current', 'activities'). Ingestion bumps a
+scope's version, so stale entries are simply never read again and age out of
+the LRU. Versions live in the default cache, so bumps only reach other
+processes when that cache is shared (Redis, Memcached, database cache). With
+the default per-process LocMemCache, ingest run elsewhere (fetch_weather,
+weather_scheduler, import_history) can't invalidate a web worker's entries;
+they are served until their TTL runs out, at most RESPONSE_CACHE_MAX_TTL.
+"""
+import hashlib
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(view, outcome):
+    with _stats_lock:
+        _stats[(view, outcome)] += 1
+
+
+def stats():
+    """Hit/miss counters per view since process start, e.g. {'current': {'hits': 3, 'misses': 1}}"""
+    with _stats_lock:
+        result = {}
+        for (view, outcome), n in _stats.items():
+            result.setdefault(view, {'hits': 0, 'misses': 0})[outcome] = n
+        return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _version_key(scope):
+    return f'weather:version:{scope}'
+
+
+def city_scope(city, kind):
+    """Scope for one kind of city data: 'current' or 'forecast'"""
+    return f'city:{city.pk}:{kind}'
+
+
+def bump(*scopes):
+    """Invalidate every cached response built from these scopes"""
+    for scope in scopes:
+        key = _version_key(scope)
+        if not cache.add(key, 2, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, 2, None)  # Evicted between add() and incr()
+
+
+def version(scope):
+    """Current version of a scope, for building validators"""
+    return cache.get(_version_key(scope), 1)
+
+
+async def aversion(scope):
+    return await cache.aget(_version_key(scope), 1)
+
+
+def _versions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    return [found.get(key, 1) for key in keys]
+
+
+def _key(view, scopes, params, versions=None):
+    if versions is None:
+        versions = _versions(scopes)
+    parts = [view, *(f'{s}@{v}' for s, v in zip(scopes, versions))]
+    parts += [f'{k}={params[k]}' for k in sorted(params)]
+    digest = hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+    return f'weather:response:{view}:{digest}'
+
+
+def get_or_build(view, scopes, params, build):
+    """
+    Return (data, hit). On a miss `build()` runs and returns (data, ttl):
+    data is cached for ttl seconds, capped at RESPONSE_CACHE_MAX_TTL and not
+    at all when ttl is below RESPONSE_CACHE_MIN_TTL or data is None.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return build()[0], False
+
+    responses = caches['responses']
+    key = _key(view, scopes, params)
+    data = responses.get(key)
+    if data is not None:
+        _count(view, 'hits')
+        return data, True
+
+    _count(view, 'misses')
+    data, ttl = build()
+    if data is not None and ttl >= settings.RESPONSE_CACHE_MIN_TTL:
+        responses.set(key, data, min(ttl, settings.RESPONSE_CACHE_MAX_TTL))
+    return data, False
+
+
+async def aget_or_build(view, scopes, params, build):
+    """get_or_build() for async views; `build` is a coroutine function"""
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return (await build())[0], False
+
+    keys = [_version_key(scope) for scope in scopes]
+    found = await cache.aget_many(keys)
+    versions = [found.get(key, 1) for key in keys]
+    responses = caches['responses']
+    key = _key(view, scopes, params, versions)
+    data = await responses.aget(key)
+    if data is not None:
+        _count(view, 'hits')
+        return data, True
+
+    _count(view, 'misses')
+    data, ttl = await build()
+    if data is not None and ttl >= settings.RESPONSE_CACHE_MIN_TTL:
+        await responses.aset(key, data, min(ttl, settings.RESPONSE_CACHE_MAX_TTL))
+    return data, False
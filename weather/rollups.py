@@ -0,0 +1,165 @@
+"""
+Monthly and yearly HistoryRollup rows, maintained from HistoricalRecord.
+Writers call refresh() with the (city id, date) pairs they touched and only
+the years containing them are recomputed; rebuild() recomputes everything,
+for backfills. History views read the rollups instead of the daily rows.
+"""
+import threading
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from . import response_cache
+from .models import HistoricalRecord, HistoryRollup
+
+TOTAL_FIELDS = [
+    'days', 'temp_sum', 'max_temp', 'min_temp', 'rainfall_sum', 'humidity_sum', 'humidity_days', 'extreme_events',
+]
+
+
+def history_scope(city_id):
+    """Response-cache scope of a city's history; bumped whenever its rollups change"""
+    return f'city:{city_id}:history'
+
+
+def year_range(start_year, end_year):
+    """
+    Half-open [start, end) date bounds of whole years. Filtering the date
+    column against constants keeps the lookup an index range scan, unlike
+    date__year, which extracts the year from every row.
+    """
+    return date(start_year, 1, 1), date(end_year + 1, 1, 1)
+
+
+def daily_records(city_id, start, end):
+    """A city's HistoricalRecords with start <= date < end"""
+    return HistoricalRecord.objects.filter(city_id=city_id, date__gte=start, date__lt=end)
+
+
+def periods(city_id, period, start, end):
+    """A city's `period` rollups starting in [start, end)"""
+    return HistoryRollup.objects.filter(city_id=city_id, period=period, start__gte=start, start__lt=end)
+
+
+def _daily_totals():
+    return {
+        'days': Count('id'),
+        'temp_sum': Sum('avg_temp'),
+        'max_temp': Max('max_temp'),
+        'min_temp': Min('min_temp'),
+        'rainfall_sum': Sum('rainfall'),
+        'humidity_sum': Sum('humidity'),
+        'humidity_days': Count('humidity'),
+        'extreme_events': Count('id', filter=Q(is_extreme_event=True)),
+    }
+
+
+def _monthly(records, *group):
+    rows = records.annotate(start=TruncMonth('date')).values(*group, 'start').annotate(**_daily_totals())
+    for row in rows.order_by(*group, 'start'):
+        # Sums over no non-null values come back as None
+        row['rainfall_sum'] = row['rainfall_sum'] or 0
+        row['humidity_sum'] = row['humidity_sum'] or 0
+        yield row
+
+
+def combine(rows):
+    """Totals of several periods' rows (dicts or HistoryRollups) as one"""
+    rows = [r if isinstance(r, dict) else {f: getattr(r, f) for f in TOTAL_FIELDS} for r in rows]
+    maxima = [r['max_temp'] for r in rows if r['max_temp'] is not None]
+    minima = [r['min_temp'] for r in rows if r['min_temp'] is not None]
+    totals = {f: sum(r[f] for r in rows) for f in TOTAL_FIELDS if f not in ('max_temp', 'min_temp')}
+    totals['max_temp'] = max(maxima, default=None)
+    totals['min_temp'] = min(minima, default=None)
+    return totals
+
+
+def _replace(city_id, period, start, end, rows):
+    """Make the city's `period` rollups between start and end exactly `rows`"""
+    rollups = [HistoryRollup(city_id=city_id, period=period, **row) for row in rows]
+    if rollups:
+        HistoryRollup.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['city', 'period', 'start'],
+            update_fields=TOTAL_FIELDS,
+        )
+    periods(city_id, period, start, end).exclude(start__in=[r.start for r in rollups]).delete()
+
+
+def _refresh_year(city_id, year):
+    start, end = year_range(year, year)
+    months = list(_monthly(daily_records(city_id, start, end)))
+    _replace(city_id, HistoryRollup.MONTH, start, end, months)
+    _replace(city_id, HistoryRollup.YEAR, start, end, [{'start': start, **combine(months)}] if months else [])
+
+
+def refresh(touched):
+    """
+    Recompute the rollups covering (city id, date) pairs that were written or
+    deleted, and the columnar history store once the writes commit
+    """
+    from . import history_store
+
+    touched = list(touched)
+    years = sorted({(city_id, day.year) for city_id, day in touched})
+    with transaction.atomic():
+        for city_id, year in years:
+            _refresh_year(city_id, year)
+    response_cache.bump(*{history_scope(city_id) for city_id, _ in years})
+    transaction.on_commit(lambda: history_store.refresh(touched))
+
+
+_pending = threading.local()
+
+
+def refresh_on_commit(touched):
+    """
+    refresh() the years of (city id, date) pairs once the transaction
+    commits. Pairs queued by many calls in one transaction are gathered, so
+    each year is recomputed once.
+    """
+    pending = getattr(_pending, 'years', None)
+    if pending is None:
+        pending = _pending.years = set()
+    pending.update((city_id, date(day.year, 1, 1)) for city_id, day in touched)
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    years, _pending.years = getattr(_pending, 'years', None), set()
+    if years:
+        refresh(years)
+
+
+def rebuild(city_ids=None):
+    """
+    Recompute all rollups (or those of `city_ids`) from the daily records in two
+    grouped queries. Returns the number of rollup rows written.
+    """
+    records = HistoricalRecord.objects.all()
+    rollups = HistoryRollup.objects.all()
+    if city_ids is not None:
+        records = records.filter(city_id__in=city_ids)
+        rollups = rollups.filter(city_id__in=city_ids)
+
+    monthly = []
+    by_year = defaultdict(list)
+    for row in _monthly(records, 'city_id'):
+        monthly.append(HistoryRollup(period=HistoryRollup.MONTH, **row))
+        by_year[row['city_id'], row['start'].year].append(row)
+    yearly = [
+        HistoryRollup(city_id=city_id, period=HistoryRollup.YEAR, start=date(year, 1, 1), **combine(rows))
+        for (city_id, year), rows in by_year.items()
+    ]
+
+    with transaction.atomic():
+        rollups.delete()
+        HistoryRollup.objects.bulk_create(monthly + yearly, batch_size=1000)
+
+    cities = city_ids if city_ids is not None else {city_id for city_id, _ in by_year}
+    response_cache.bump(*(history_scope(city_id) for city_id in cities))
+    return len(monthly) + len(yearly)
@@ -0,0 +1,192 @@
+"""
+Priority-driven refresh scheduler.
+Keeps each city's current weather and forecast refreshed ahead of the
+service TTLs so request handlers rarely have to call OpenWeatherMap.
+Popular cities and cities under an active alert refresh more often,
+cold cities back off, and upstream calls stay within a per-minute budget.
+"""
+import heapq
+import itertools
+import logging
+import math
+import time
+
+from django.db.models import Count, F
+
+from .concurrency import TokenBucket
+from .models import City, Profile, WeatherAlert
+from . import services
+
+logger = logging.getLogger(__name__)
+
+CURRENT = 'current'
+FORECAST = 'forecast'
+
+TTLS = {
+    CURRENT: services.CURRENT_WEATHER_TTL.total_seconds(),
+    FORECAST: services.FORECAST_TTL.total_seconds(),
+}
+
+# Refresh this far into the TTL, so requests keep finding fresh data
+REFRESH_AHEAD = 0.8
+MIN_INTERVAL = 5 * 60
+MAX_INTERVAL = 4 * 60 * 60
+
+# Popularity weights
+PROFILE_WEIGHT = 1
+REQUEST_WEIGHT = 1
+ALERT_WEIGHT = 20
+
+
+def refresh_interval(kind, score, cold_streak=0):
+    """
+    Seconds until the next refresh of `kind` for a city with popularity `score`.
+    Popular cities refresh faster than the TTL; cold ones back off exponentially
+    with each consecutive cold refresh, up to MAX_INTERVAL.
+    """
+    base = TTLS[kind] * REFRESH_AHEAD
+    if score > 0:
+        return max(MIN_INTERVAL, base / (1 + math.log2(1 + score)))
+    return min(MAX_INTERVAL, base * 2 ** cold_streak)
+
+
+def city_popularity(cities):
+    """
+    Popularity score per city id from Profile.default_city counts,
+    requests since the last call, and active alerts for the city's district.
+    """
+    scores = {city.pk: 0 for city in cities}
+
+    profile_counts = Profile.objects.filter(
+        default_city__isnull=False
+    ).values_list('default_city').annotate(n=Count('id'))
+    for city_id, count in profile_counts:
+        if city_id in scores:
+            scores[city_id] += PROFILE_WEIGHT * count
+
+    for city_id, count in services.pop_demand_counts(scores).items():
+        scores[city_id] += REQUEST_WEIGHT * count
+
+    districts = [
+        d.lower() for d in
+        WeatherAlert.objects.filter(is_active=True).values_list('district', flat=True)
+    ]
+    for city in cities:
+        name, province = city.name.lower(), city.province.lower()
+        if any(d == name or d in province for d in districts):
+            scores[city.pk] += ALERT_WEIGHT
+
+    return scores
+
+
+class RefreshScheduler:
+    """
+    Min-heap of (due time, -score, seq, city id, kind).
+    Entries are never removed from the heap; rescheduling pushes a new entry and
+    stale ones are skipped when popped (checked against `self.due`).
+    """
+
+    def __init__(self, calls_per_minute, rescore_every=60, clock=time.time):
+        self.budget = TokenBucket(calls_per_minute / 60, capacity=max(1, calls_per_minute // 10))
+        self.rescore_every = rescore_every
+        self.clock = clock
+        self.heap = []
+        self.due = {}
+        self.cities = {}
+        self.scores = {}
+        self.cold_streak = {}
+        self.counter = itertools.count()
+        self.last_scored = None
+
+    def load(self):
+        """(Re)load cities and schedule any new ones from their current freshness"""
+        cities = list(City.objects.annotate(current_fetched_at=F('latest_weather__fetched_at')))
+        self.cities = {city.pk: city for city in cities}
+        self.rescore()
+
+        for city in cities:
+            fetched = {CURRENT: city.current_fetched_at, FORECAST: city.forecast_fetched_at}
+            for kind, fetched_at in fetched.items():
+                if (city.pk, kind) in self.due:
+                    continue
+                if fetched_at is None:
+                    self.schedule(city.pk, kind, self.clock())
+                else:
+                    interval = refresh_interval(kind, self.scores.get(city.pk, 0))
+                    self.schedule(city.pk, kind, fetched_at.timestamp() + interval)
+
+        # Forget cities that were deleted
+        for key in [k for k in self.due if k[0] not in self.cities]:
+            del self.due[key]
+
+    def rescore(self):
+        self.scores = city_popularity(list(self.cities.values()))
+        self.last_scored = self.clock()
+
+    def schedule(self, city_id, kind, at):
+        self.due[(city_id, kind)] = at
+        score = self.scores.get(city_id, 0)
+        heapq.heappush(self.heap, (at, -score, next(self.counter), city_id, kind))
+
+    def reschedule(self, city_id, kind):
+        score = self.scores.get(city_id, 0)
+        streak = 0 if score else self.cold_streak.get((city_id, kind), 0) + 1
+        self.cold_streak[(city_id, kind)] = streak
+        self.schedule(city_id, kind, self.clock() + refresh_interval(kind, score, streak))
+
+    def pop_due(self):
+        """Pop every entry that is due now. Returns {kind: [city, ...]}."""
+        now = self.clock()
+        due = {CURRENT: [], FORECAST: []}
+        while self.heap and self.heap[0][0] <= now:
+            at, _, _, city_id, kind = heapq.heappop(self.heap)
+            if self.due.get((city_id, kind)) != at:
+                continue  # Superseded by a later reschedule
+            del self.due[(city_id, kind)]
+            due[kind].append(self.cities[city_id])
+        return due
+
+    def next_wakeup(self):
+        return self.heap[0][0] if self.heap else self.clock() + self.rescore_every
+
+    def run_due(self):
+        """Refresh everything that is due, within the call budget. Returns the number of refreshes."""
+        if self.clock() - self.last_scored >= self.rescore_every:
+            self.rescore()
+
+        # Leave due entries queued while OWM is down or the shared quota is spent
+        if not services.upstream_available():
+            return 0
+
+        due = self.pop_due()
+        refreshed = 0
+
+        for city in due[FORECAST]:
+            self.budget.acquire()
+            onecall = services.onecall_available()
+            if onecall and services.refresh_city_onecall(city):
+                refreshed += 1
+                # One Call brought current weather along with the forecast
+                if city in due[CURRENT]:
+                    due[CURRENT].remove(city)
+                    self.reschedule(city.pk, CURRENT)
+            else:
+                if onecall:
+                    self.budget.acquire()  # The failed One Call attempt used the first token
+                hourly_data, daily_data = services.fetch_forecast(city.lat, city.lon)
+                if hourly_data:
+                    services.save_forecasts(city, hourly_data, daily_data)
+                    refreshed += 1
+            self.reschedule(city.pk, FORECAST)
+
+        if due[CURRENT]:
+            # Group requests: one budget token per upstream call
+            known = sum(1 for c in due[CURRENT] if c.owm_id)
+            calls = math.ceil(known / services.OWM_GROUP_LIMIT) + len(due[CURRENT]) - known
+            for _ in range(calls):
+                self.budget.acquire()
+            refreshed += len(services.update_current_weather_batch(due[CURRENT]))
+            for city in due[CURRENT]:
+                self.reschedule(city.pk, CURRENT)
+
+        return refreshed
@@ -147,11 +147,11 @@ class ExplorerCitySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'lat', 'lon', 'province', 'temperature', 'condition']
 
     def get_temperature(self, obj):
-        latest = obj.current_weather.first()
+        latest = obj.latest_weather
         return latest.temperature if latest else None
 
     def get_condition(self, obj):
-        latest = obj.current_weather.first()
+        latest = obj.latest_weather
         return latest.condition if latest else None
 
 
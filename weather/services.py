@@ -2,16 +2,54 @@
 OpenWeatherMap API Service
 Centralizes all weather API calls and caches results in the database.
 """
+import asyncio
+import hashlib
 import requests
 import logging
-from datetime import timedelta
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
+from .client import get_async_client, get_client
+from .concurrency import CacheLock, KeyedExecutor
+from . import broadcast, city_registry, response_cache
 
 logger = logging.getLogger(__name__)
 
-OWM_BASE_URL = 'https://api.openweathermap.org/data/2.5'
-OWM_ONECALL_URL = 'https://api.openweathermap.org/data/3.0/onecall'
+OWM_BASE_URL = f"{settings.OPENWEATHERMAP_HOST}/data/2.5"
+OWM_ONECALL_URL = f"{settings.OPENWEATHERMAP_HOST}/data/3.0/onecall"
+OWM_GEO_URL = f"{settings.OPENWEATHERMAP_HOST}/geo/1.0"
+
+CURRENT_WEATHER_TTL = timedelta(minutes=15)
+FORECAST_TTL = timedelta(minutes=30)
+
+# Upper bound on one refresh; also how long other callers wait for it
+REFRESH_LOCK_TIMEOUT = 30
+
+# Runs stale-while-revalidate refreshes off the request thread
+background_refresher = KeyedExecutor(max_workers=settings.WEATHER_REFRESH_WORKERS)
+
+# How long request counts are kept for the refresh scheduler (seconds)
+DEMAND_WINDOW = 60 * 60
+
+# Request counts are buffered per process and written to CityDemand this often (seconds)
+DEMAND_FLUSH_INTERVAL = 10
+
+_demand = Counter()
+_demand_lock = threading.Lock()
+_demand_flushed = time.monotonic()
+
+# Set when OWM rejects One Call for our key (no 3.0 subscription)
+_onecall_rejected = False
+
+# Maximum number of city ids OpenWeatherMap accepts per /group request
+OWM_GROUP_LIMIT = 20
 
 
 def get_api_key():
@@ -42,6 +80,31 @@ def _owm_icon_to_material(icon_code, condition):
     return mapping.get(icon_code, 'cloud')
 
 
+def _parse_current_weather(data):
+    """Parse a /weather (or /group list item) payload into CurrentWeather fields"""
+    wind_deg = data.get('wind', {}).get('deg', 0)
+    icon_code = data['weather'][0].get('icon', '01d')
+    condition = data['weather'][0].get('main', 'Clear')
+
+    return {
+        'temperature': round(data['main']['temp'], 1),
+        'feels_like': round(data['main'].get('feels_like', data['main']['temp']), 1),
+        'condition': condition,
+        'description': data['weather'][0].get('description', '').title(),
+        'icon': _owm_icon_to_material(icon_code, condition),
+        'humidity': data['main']['humidity'],
+        'wind_speed': round(data['wind'].get('speed', 0) * 3.6, 1),  # m/s to km/h
+        'wind_direction': _deg_to_compass(wind_deg),
+        'wind_deg': wind_deg,
+        'visibility': round(data.get('visibility', 10000) / 1000, 1),  # m to km
+        'pressure': data['main'].get('pressure'),
+        'clouds': data.get('clouds', {}).get('all', 0),
+        'lat': data['coord']['lat'],
+        'lon': data['coord']['lon'],
+        'owm_id': data.get('id'),
+    }
+
+
 def fetch_current_weather(city_name):
     """
     Fetch current weather from OpenWeatherMap API.
@@ -59,30 +122,8 @@ def fetch_current_weather(city_name):
             'appid': api_key,
             'units': 'metric'
         }
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        wind_deg = data.get('wind', {}).get('deg', 0)
-        icon_code = data['weather'][0].get('icon', '01d')
-        condition = data['weather'][0].get('main', 'Clear')
-
-        return {
-            'temperature': round(data['main']['temp'], 1),
-            'feels_like': round(data['main'].get('feels_like', data['main']['temp']), 1),
-            'condition': condition,
-            'description': data['weather'][0].get('description', '').title(),
-            'icon': _owm_icon_to_material(icon_code, condition),
-            'humidity': data['main']['humidity'],
-            'wind_speed': round(data['wind'].get('speed', 0) * 3.6, 1),  # m/s to km/h
-            'wind_direction': _deg_to_compass(wind_deg),
-            'wind_deg': wind_deg,
-            'visibility': round(data.get('visibility', 10000) / 1000, 1),  # m to km
-            'pressure': data['main'].get('pressure'),
-            'clouds': data.get('clouds', {}).get('all', 0),
-            'lat': data['coord']['lat'],
-            'lon': data['coord']['lon'],
-        }
+        data = get_client().get_json(url, params=params)
+        return _parse_current_weather(data)
     except requests.RequestException as e:
         logger.error(f"Error fetching weather for {city_name}: {e}")
         return None
@@ -91,6 +132,147 @@ def fetch_current_weather(city_name):
         return None
 
 
+def fetch_geocode(city_name):
+    """
+    Look a place name up with the OpenWeatherMap geocoder, within Sri Lanka.
+    Returns {'name', 'lat', 'lon', 'province'}, or None if nothing matched.
+    Raises requests exceptions on failure so callers can tell the two apart.
+    """
+    api_key = get_api_key()
+    if not api_key:
+        raise requests.RequestException("No OpenWeatherMap API key configured")
+
+    params = {
+        'q': f"{city_name},LK",
+        'limit': 1,
+        'appid': api_key,
+    }
+    for place in get_client().get_json(f"{OWM_GEO_URL}/direct", params=params):
+        if place.get('country') == 'LK':
+            return {
+                'name': place['name'],
+                'lat': place['lat'],
+                'lon': place['lon'],
+                'province': place.get('state', ''),
+            }
+    return None
+
+
+def fetch_current_weather_group(owm_ids):
+    """
+    Fetch current weather for up to OWM_GROUP_LIMIT cities in one call.
+    Returns a dict of OWM city id -> parsed data (empty on error).
+    """
+    api_key = get_api_key()
+    if not api_key:
+        logger.error("No OpenWeatherMap API key configured")
+        return {}
+
+    try:
+        url = f"{OWM_BASE_URL}/group"
+        params = {
+            'id': ','.join(str(i) for i in owm_ids),
+            'appid': api_key,
+            'units': 'metric'
+        }
+        data = get_client().get_json(url, params=params)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching weather group {owm_ids}: {e}")
+        return {}
+
+    results = {}
+    for item in data.get('list', []):
+        try:
+            parsed = _parse_current_weather(item)
+        except (KeyError, IndexError) as e:
+            logger.error(f"Error parsing weather data for OWM id {item.get('id')}: {e}")
+            continue
+        results[parsed['owm_id']] = parsed
+    return results
+
+
+def fetch_current_weather_for_cities(cities):
+    """
+    Fetch current weather for many cities with as few upstream calls as possible.
+    Cities with a known OWM id go through group requests; the rest (and any
+    missing from a group response) fall back to a per-city lookup.
+    Returns a list of (city, parsed data) pairs for the cities that succeeded.
+    """
+    known = [c for c in cities if c.owm_id]
+    pending = [c for c in cities if not c.owm_id]
+    results = []
+
+    for i in range(0, len(known), OWM_GROUP_LIMIT):
+        chunk = known[i:i + OWM_GROUP_LIMIT]
+        by_id = fetch_current_weather_group([c.owm_id for c in chunk])
+        for city in chunk:
+            if city.owm_id in by_id:
+                results.append((city, by_id[city.owm_id]))
+            else:
+                pending.append(city)
+
+    for city in pending:
+        weather_data = fetch_current_weather(city.name)
+        if weather_data:
+            results.append((city, weather_data))
+
+    return results
+
+
+def _parse_forecast(data):
+    """Parse a /forecast payload into (hourly, daily) rows"""
+    hourly_data = []
+    daily_data = {}
+
+    for item in data.get('list', []):
+        dt = datetime.fromtimestamp(item['dt'], tz=timezone.get_current_timezone())
+        icon_code = item['weather'][0].get('icon', '01d')
+        condition = item['weather'][0].get('main', 'Clear')
+
+        hourly_data.append({
+            'datetime': dt,
+            'temperature': round(item['main']['temp'], 1),
+            'condition': condition,
+            'description': item['weather'][0].get('description', '').title(),
+            'icon': _owm_icon_to_material(icon_code, condition),
+            'humidity': item['main'].get('humidity'),
+            'wind_speed': round(item['wind'].get('speed', 0) * 3.6, 1),
+            'pop': item.get('pop', 0),
+        })
+
+        # Aggregate daily data
+        date_str = dt.strftime('%Y-%m-%d')
+        if date_str not in daily_data:
+            daily_data[date_str] = {
+                'date': dt.date(),
+                'temps': [],
+                'condition': condition,
+                'description': item['weather'][0].get('description', '').title(),
+                'icon': _owm_icon_to_material(icon_code, condition),
+                'humidity': item['main'].get('humidity'),
+                'wind_speed': round(item['wind'].get('speed', 0) * 3.6, 1),
+                'pop': item.get('pop', 0),
+            }
+        daily_data[date_str]['temps'].append(item['main']['temp'])
+
+    # Process daily aggregates
+    daily_list = []
+    for date_str, d in daily_data.items():
+        daily_list.append({
+            'date': d['date'],
+            'temp_high': round(max(d['temps']), 1),
+            'temp_low': round(min(d['temps']), 1),
+            'condition': d['condition'],
+            'description': d['description'],
+            'icon': d['icon'],
+            'humidity': d['humidity'],
+            'wind_speed': d['wind_speed'],
+            'pop': d['pop'],
+        })
+
+    return hourly_data[:24], daily_list[:7]
+
+
 def fetch_forecast(lat, lon):
     """
     Fetch 5-day/3-hour forecast from OpenWeatherMap.
@@ -108,61 +290,8 @@ def fetch_forecast(lat, lon):
             'appid': api_key,
             'units': 'metric'
         }
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        hourly_data = []
-        daily_data = {}
-
-        for item in data.get('list', []):
-            from datetime import datetime
-            dt = datetime.fromtimestamp(item['dt'], tz=timezone.get_current_timezone())
-            icon_code = item['weather'][0].get('icon', '01d')
-            condition = item['weather'][0].get('main', 'Clear')
-
-            hourly_data.append({
-                'datetime': dt,
-                'temperature': round(item['main']['temp'], 1),
-                'condition': condition,
-                'description': item['weather'][0].get('description', '').title(),
-                'icon': _owm_icon_to_material(icon_code, condition),
-                'humidity': item['main'].get('humidity'),
-                'wind_speed': round(item['wind'].get('speed', 0) * 3.6, 1),
-                'pop': item.get('pop', 0),
-            })
-
-            # Aggregate daily data
-            date_str = dt.strftime('%Y-%m-%d')
-            if date_str not in daily_data:
-                daily_data[date_str] = {
-                    'date': dt.date(),
-                    'temps': [],
-                    'condition': condition,
-                    'description': item['weather'][0].get('description', '').title(),
-                    'icon': _owm_icon_to_material(icon_code, condition),
-                    'humidity': item['main'].get('humidity'),
-                    'wind_speed': round(item['wind'].get('speed', 0) * 3.6, 1),
-                    'pop': item.get('pop', 0),
-                }
-            daily_data[date_str]['temps'].append(item['main']['temp'])
-
-        # Process daily aggregates
-        daily_list = []
-        for date_str, d in daily_data.items():
-            daily_list.append({
-                'date': d['date'],
-                'temp_high': round(max(d['temps']), 1),
-                'temp_low': round(min(d['temps']), 1),
-                'condition': d['condition'],
-                'description': d['description'],
-                'icon': d['icon'],
-                'humidity': d['humidity'],
-                'wind_speed': d['wind_speed'],
-                'pop': d['pop'],
-            })
-
-        return hourly_data[:24], daily_list[:7]
+        data = get_client().get_json(url, params=params)
+        return _parse_forecast(data)
 
     except requests.RequestException as e:
         logger.error(f"Error fetching forecast for ({lat}, {lon}): {e}")
@@ -172,76 +301,758 @@ def fetch_forecast(lat, lon):
         return None, None
 
 
-def get_or_update_current_weather(city):
+def onecall_available():
+    """One Call is used unless disabled in settings or rejected by OWM this process"""
+    return settings.OPENWEATHERMAP_ONECALL and not _onecall_rejected
+
+
+def _parse_onecall(data):
     """
-    Get current weather from DB cache, or fetch from API if stale (>15 min).
+    Parse a One Call 3.0 payload in a single pass.
+    Returns (current, hourly, daily) in the same shape as the 2.5 parsers.
     """
-    from .models import CurrentWeather
+    tz = timezone.get_current_timezone()
 
-    cache_ttl = timedelta(minutes=15)
-    latest = city.current_weather.first()
+    def conditions(item):
+        weather = item['weather'][0]
+        condition = weather.get('main', 'Clear')
+        return {
+            'condition': condition,
+            'description': weather.get('description', '').title(),
+            'icon': _owm_icon_to_material(weather.get('icon', '01d'), condition),
+        }
 
-    if latest and (timezone.now() - latest.fetched_at) < cache_ttl:
-        return latest
+    now = data['current']
+    wind_deg = now.get('wind_deg', 0)
+    current = {
+        'temperature': round(now['temp'], 1),
+        'feels_like': round(now.get('feels_like', now['temp']), 1),
+        **conditions(now),
+        'humidity': now['humidity'],
+        'wind_speed': round(now.get('wind_speed', 0) * 3.6, 1),  # m/s to km/h
+        'wind_direction': _deg_to_compass(wind_deg),
+        'wind_deg': wind_deg,
+        'visibility': round(now.get('visibility', 10000) / 1000, 1),  # m to km
+        'uv_index': now.get('uvi'),
+        'pressure': now.get('pressure'),
+        'clouds': now.get('clouds', 0),
+        'lat': data['lat'],
+        'lon': data['lon'],
+    }
 
-    weather_data = fetch_current_weather(city.name)
-    if not weather_data:
-        return latest  # Return stale data if API fails
+    hourly = []
+    for item in data.get('hourly', [])[:24]:
+        hourly.append({
+            'datetime': datetime.fromtimestamp(item['dt'], tz=tz),
+            'temperature': round(item['temp'], 1),
+            **conditions(item),
+            'humidity': item.get('humidity'),
+            'wind_speed': round(item.get('wind_speed', 0) * 3.6, 1),
+            'pop': item.get('pop', 0),
+        })
 
-    # Update city coordinates if needed
-    if not city.lat or not city.lon:
-        city.lat = weather_data.pop('lat', city.lat)
-        city.lon = weather_data.pop('lon', city.lon)
-        city.save()
+    daily = []
+    for item in data.get('daily', [])[:7]:
+        daily.append({
+            'date': datetime.fromtimestamp(item['dt'], tz=tz).date(),
+            'temp_high': round(item['temp']['max'], 1),
+            'temp_low': round(item['temp']['min'], 1),
+            **conditions(item),
+            'humidity': item.get('humidity'),
+            'wind_speed': round(item.get('wind_speed', 0) * 3.6, 1),
+            'pop': item.get('pop', 0),
+        })
+
+    return current, hourly, daily
+
+
+def fetch_onecall(lat, lon):
+    """
+    Fetch current conditions, hourly and daily forecasts (with UV index)
+    in one One Call 3.0 request.
+    Returns (current, hourly, daily), or (None, None, None) on error.
+    """
+    api_key = get_api_key()
+    if not api_key or not onecall_available():
+        return None, None, None
+
+    try:
+        params = _onecall_params(lat, lon, api_key)
+        data = get_client().get_json(OWM_ONECALL_URL, params=params)
+        return _parse_onecall(data)
+    except (requests.RequestException, KeyError, IndexError, TypeError) as e:
+        return _onecall_failed(e, lat, lon)
+
+
+def _onecall_params(lat, lon, api_key):
+    return {
+        'lat': lat,
+        'lon': lon,
+        'exclude': 'minutely,alerts',
+        'appid': api_key,
+        'units': 'metric'
+    }
+
+
+def _onecall_failed(e, lat, lon):
+    """Log a failed One Call fetch and return the empty result"""
+    global _onecall_rejected
+
+    if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code in (401, 403):
+        # The key has no One Call subscription; stop trying until restart
+        logger.warning("One Call 3.0 rejected by OpenWeatherMap, using 2.5 endpoints")
+        _onecall_rejected = True
+    elif isinstance(e, requests.RequestException):
+        logger.error(f"Error fetching One Call data for ({lat}, {lon}): {e}")
     else:
-        weather_data.pop('lat', None)
-        weather_data.pop('lon', None)
+        logger.error(f"Error parsing One Call data: {e}")
+    return None, None, None
 
-    current = CurrentWeather.objects.create(city=city, **weather_data)
+
+def upstream_available():
+    """False while the circuit breaker is open or the call quota is used up"""
+    return get_client().available()
+
+
+def is_stale(fetched_at, ttl):
+    """True if a cached row fetched at `fetched_at` is missing or older than `ttl`"""
+    return fetched_at is None or (timezone.now() - fetched_at) >= ttl
+
+
+def _apply_city_metadata(city, weather_data):
+    """
+    Move the lat/lon/owm_id keys out of a parsed reading onto the city.
+    Coordinates are only filled in when missing. Returns True if the city changed.
+    """
+    lat = weather_data.pop('lat', None)
+    lon = weather_data.pop('lon', None)
+    owm_id = weather_data.pop('owm_id', None)
+    changed = False
+
+    # Update city coordinates if needed
+    if (not city.lat or not city.lon) and lat is not None and lon is not None:
+        city.lat, city.lon = lat, lon
+        changed = True
+    if owm_id and city.owm_id != owm_id:
+        city.owm_id = owm_id
+        changed = True
+    return changed
+
+
+def save_current_weather(city, weather_data):
+    """
+    Store a parsed current weather reading for a city; it becomes the city's
+    latest_weather through the post_save handler. Keeps only the last 10 readings per city.
+    """
+    from .models import CurrentWeather
+
+    with transaction.atomic():
+        if _apply_city_metadata(city, weather_data):
+            city.save(update_fields=['lat', 'lon', 'owm_id'])
+
+        current = CurrentWeather.objects.create(city=city, **weather_data)
 
     # Clean up old records (keep last 10)
     old_records = city.current_weather.all()[10:]
     if old_records.exists():
         CurrentWeather.objects.filter(id__in=old_records.values_list('id', flat=True)).delete()
 
+    response_cache.bump(response_cache.city_scope(city, 'current'))
+    broadcast.publish(broadcast.weather_event(current))
     return current
 
 
-def get_or_update_forecasts(city):
+def _upsert_forecast_slots(model, city, key, rows):
     """
-    Get forecasts from DB cache, or fetch from API if stale (>30 min).
+    Bring a city's forecast rows for `model` in line with `rows`, keyed on
+    (city, key). Only slots that are new or whose values changed are written;
+    slots that dropped out of the forecast window are deleted.
+    Returns the resulting rows ordered by key.
     """
-    from .models import HourlyForecast, DailyForecast
+    existing = {getattr(obj, key): obj for obj in model.objects.filter(city=city)}
+    fields = [f for f in rows[0] if f != key] if rows else []
+
+    result = []
+    changed = []
+    for data in rows:
+        obj = existing.pop(data[key], None)
+        if obj is None or any(getattr(obj, f) != data[f] for f in fields):
+            obj = model(city=city, **data)
+            changed.append(obj)
+        result.append(obj)
+
+    if changed:
+        model.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=['city', key],
+            update_fields=fields + ['fetched_at'],
+        )
+    if existing:
+        model.objects.filter(id__in=[obj.id for obj in existing.values()]).delete()
 
-    cache_ttl = timedelta(minutes=30)
-    latest_hourly = city.hourly_forecasts.first()
+    return sorted(result, key=lambda obj: getattr(obj, key))
+
+
+def save_forecasts(city, hourly_data, daily_data):
+    """
+    Upsert freshly parsed forecasts for a city in one transaction,
+    so readers never see a partially replaced forecast.
+    """
+    from .models import City, HourlyForecast, DailyForecast
+
+    with transaction.atomic():
+        hourly_objects = _upsert_forecast_slots(HourlyForecast, city, 'datetime', hourly_data)
+        daily_objects = _upsert_forecast_slots(DailyForecast, city, 'date', daily_data)
+        city.forecast_fetched_at = timezone.now()
+        City.objects.filter(pk=city.pk).update(forecast_fetched_at=city.forecast_fetched_at)
+
+    response_cache.bump(response_cache.city_scope(city, 'forecast'))
+    broadcast.publish(broadcast.forecast_event(city))
+    return hourly_objects, daily_objects
+
+
+def refresh_city_onecall(city):
+    """
+    Refresh current weather and forecasts for a city from one One Call request.
+    Returns (current, hourly, daily) model objects, or None if One Call failed.
+    """
+    current_data, hourly_data, daily_data = fetch_onecall(city.lat, city.lon)
+    if not current_data:
+        return None
+    return _save_onecall(city, current_data, hourly_data, daily_data)
+
+
+def _save_onecall(city, current_data, hourly_data, daily_data):
+    with transaction.atomic():
+        current = save_current_weather(city, current_data)
+        hourly, daily = save_forecasts(city, hourly_data, daily_data)
+    return current, hourly, daily
+
+
+def save_current_weather_batch(results):
+    """
+    Bulk-insert parsed readings for many cities in one transaction and point
+    each city's latest_weather at its new reading.
+    `results` is a list of (city, parsed data) pairs, as returned by
+    fetch_current_weather_for_cities. Keeps only the last 10 readings per city.
+    Returns a dict of city id -> new CurrentWeather.
+    """
+    from .models import City, CurrentWeather
+
+    if not results:
+        return {}
+
+    changed_cities = []
+    objects = []
+    for city, weather_data in results:
+        weather_data = dict(weather_data)
+        if _apply_city_metadata(city, weather_data):
+            changed_cities.append(city)
+        objects.append(CurrentWeather(city=city, **weather_data))
+
+    with transaction.atomic():
+        if changed_cities:
+            City.objects.bulk_update(changed_cities, ['lat', 'lon', 'owm_id'])
+            # bulk_update sends no post_save, so reload the city index here
+            city_registry.registry.changed()
+            transaction.on_commit(city_registry.registry.changed)
+        CurrentWeather.objects.bulk_create(objects)
+        for obj in objects:
+            obj.city.latest_weather = obj
+        City.objects.bulk_update([obj.city for obj in objects], ['latest_weather'])
+
+        # Clean up old records (keep last 10 per city)
+        old_ids = list(CurrentWeather.objects.filter(
+            city__in=[city for city, _ in results]
+        ).annotate(
+            rank=Window(RowNumber(), partition_by=F('city'), order_by=F('fetched_at').desc())
+        ).filter(rank__gt=10).values_list('id', flat=True))
+        if old_ids:
+            CurrentWeather.objects.filter(id__in=old_ids).delete()
+
+    response_cache.bump(*(response_cache.city_scope(city, 'current') for city, _ in results))
+    for obj in objects:
+        broadcast.publish(broadcast.weather_event(obj))
+    return {obj.city_id: obj for obj in objects}
+
+
+def update_current_weather_batch(cities):
+    """
+    Refresh current weather for many cities using group requests.
+    Returns a dict of city id -> new CurrentWeather for the cities that succeeded.
+    """
+    return save_current_weather_batch(fetch_current_weather_for_cities(list(cities)))
+
+
+def _single_flight(key, cached, read, refresh):
+    """
+    Coalesce concurrent refreshes of one cache key.
+    `cached` is the caller's (stale) value, `read()` re-reads from the DB and
+    returns (value, is_fresh), and `refresh()` fetches and stores a new value,
+    returning None on failure. Only the caller holding the lock refreshes;
+    the others get the previous value, or wait for the refresher if there is none.
+    """
+    lock = CacheLock(f'weather:refresh:{key}', timeout=REFRESH_LOCK_TIMEOUT)
+    if lock.acquire():
+        try:
+            # Another caller may have finished a refresh since we last looked
+            value, fresh = read()
+            if fresh:
+                return value
+            return refresh() or value
+        finally:
+            lock.release()
+
+    if cached:
+        return cached
+    lock.wait(REFRESH_LOCK_TIMEOUT)
+    return read()[0]
+
+
+def refresh_current_weather(city):
+    """
+    Fetch and store current weather for a city regardless of freshness.
+    Returns the new CurrentWeather, or None if the API failed.
+    """
+    if onecall_available():
+        result = refresh_city_onecall(city)
+        if result:
+            return result[0]
+    weather_data = fetch_current_weather(city.name)
+    if not weather_data:
+        return None
+    return save_current_weather(city, weather_data)
 
-    if latest_hourly and (timezone.now() - latest_hourly.fetched_at) < cache_ttl:
-        hourly = list(city.hourly_forecasts.filter(datetime__gte=timezone.now())[:24])
-        daily = list(city.daily_forecasts.all()[:7])
-        return hourly, daily
 
+def refresh_forecasts(city):
+    """
+    Fetch and store forecasts for a city regardless of freshness.
+    Returns (hourly, daily), or None if the API failed.
+    """
+    if onecall_available():
+        result = refresh_city_onecall(city)
+        if result:
+            return result[1], result[2]
     hourly_data, daily_data = fetch_forecast(city.lat, city.lon)
     if not hourly_data:
-        hourly = list(city.hourly_forecasts.filter(datetime__gte=timezone.now())[:24])
-        daily = list(city.daily_forecasts.all()[:7])
-        return hourly, daily
+        return None
+    return save_forecasts(city, hourly_data, daily_data)
 
-    # Clear old and save new
-    city.hourly_forecasts.all().delete()
-    city.daily_forecasts.all().delete()
 
-    hourly_objects = []
-    for h in hourly_data:
-        hourly_objects.append(HourlyForecast(city=city, **h))
-    HourlyForecast.objects.bulk_create(hourly_objects)
+def _buffer_demand(city):
+    """Count a request in this process; returns the buffered counts once they are due to be written"""
+    global _demand_flushed
+    with _demand_lock:
+        _demand[city.pk] += 1
+        if time.monotonic() - _demand_flushed < DEMAND_FLUSH_INTERVAL:
+            return None
+        return _take_demand()
 
-    daily_objects = []
-    for d in daily_data:
-        daily_objects.append(DailyForecast(city=city, **d))
-    DailyForecast.objects.bulk_create(daily_objects)
 
-    return hourly_objects, daily_objects
+def _take_demand():
+    global _demand_flushed
+    counts = dict(_demand)
+    _demand.clear()
+    _demand_flushed = time.monotonic()
+    return counts
+
+
+def flush_demand(counts=None):
+    """
+    Add request counts (by default everything buffered in this process) to
+    the CityDemand table, where the refresh scheduler process reads them.
+    Counts that can't be written are dropped.
+    """
+    from .models import City, CityDemand
+
+    if counts is None:
+        with _demand_lock:
+            counts = _take_demand()
+    if not counts:
+        return
+    try:
+        with transaction.atomic():
+            for city_id in City.objects.filter(pk__in=counts).values_list('pk', flat=True):
+                n = counts[city_id]
+                rows = CityDemand.objects.filter(city_id=city_id)
+                if rows.update(requests=F('requests') + n, updated_at=timezone.now()):
+                    continue
+                try:
+                    with transaction.atomic():
+                        CityDemand.objects.create(city_id=city_id, requests=n)
+                except IntegrityError:
+                    # Another process created it meanwhile
+                    rows.update(requests=F('requests') + n, updated_at=timezone.now())
+    except DatabaseError as e:
+        logger.warning(f"Could not record city demand: {e}")
+
+
+def record_demand(city):
+    """Count a request for a city's weather; the refresh scheduler reads these"""
+    counts = _buffer_demand(city)
+    if counts:
+        flush_demand(counts)
+
+
+def pop_demand_counts(city_ids):
+    """Return and reset request counts per city id since the last call"""
+    from .models import CityDemand
+
+    flush_demand()
+    with transaction.atomic():
+        CityDemand.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=DEMAND_WINDOW)).delete()
+        rows = CityDemand.objects.select_for_update().filter(city_id__in=list(city_ids))
+        counts = dict(rows.values_list('city_id', 'requests'))
+        CityDemand.objects.filter(city_id__in=list(counts)).delete()
+    return counts
+
+
+def _refresh_key(kind, city):
+    # One Call refreshes current weather and forecasts together, so they share a lock
+    return f'city:{city.pk}' if onecall_available() else f'{kind}:{city.pk}'
+
+
+def _serve_stale(key, cached, fetched_at, read, refresh, background):
+    """
+    Decide how to handle a stale value. Within the hard-stale limit (and with
+    stale-while-revalidate on) the refresh is queued on a background thread and
+    the stale value is returned at once. Past the limit the caller blocks on a
+    coalesced refresh.
+    """
+    if cached and not upstream_available():
+        return cached  # Don't wait on an upstream that is down or out of quota
+
+    if cached and background and settings.WEATHER_STALE_WHILE_REVALIDATE:
+        hard_stale = timedelta(minutes=settings.WEATHER_HARD_STALE_MINUTES)
+        if not is_stale(fetched_at, hard_stale):
+            background_refresher.submit(key, _single_flight, key, cached, read, refresh)
+            return cached
+        cached = None  # Too old to serve while someone else refreshes
+
+    return _single_flight(key, cached, read, refresh)
+
+
+def get_or_update_current_weather(city, background=True):
+    """
+    Get current weather from DB cache, or fetch from API if stale (>15 min).
+    Concurrent refreshes of the same city are coalesced into one upstream call.
+    With background=False a stale reading is always refreshed inline.
+    """
+    latest = city.latest_weather
+    if latest:
+        latest.city = city
+
+    if latest and not is_stale(latest.fetched_at, CURRENT_WEATHER_TTL):
+        return latest
+
+    def read():
+        current = city.current_weather.first()
+        return current, bool(current) and not is_stale(current.fetched_at, CURRENT_WEATHER_TTL)
+
+    def refresh():
+        return refresh_current_weather(city)  # None makes callers fall back to stale data
+
+    fetched_at = latest.fetched_at if latest else None
+    return _serve_stale(_refresh_key('current', city), latest, fetched_at, read, refresh, background)
+
+
+def latest_current_weather(cities):
+    """Latest CurrentWeather per city from the DB, {city id: reading}, in one query"""
+    from .models import City
+
+    latest = {}
+    for city in City.objects.filter(
+        pk__in=[city.pk for city in cities], latest_weather__isnull=False
+    ).select_related('latest_weather'):
+        latest[city.pk] = city.latest_weather
+    for city in cities:
+        if city.pk in latest:
+            latest[city.pk].city = city
+    return latest
+
+
+def _refresh_batch(key, cities):
+    """
+    Coalesced group refresh of whichever of `cities` are still stale.
+    Callers that find the batch already being refreshed wait for it instead.
+    Returns {city id: latest reading}.
+    """
+    lock = CacheLock(f'weather:refresh:{key}', timeout=REFRESH_LOCK_TIMEOUT)
+    if not lock.acquire():
+        lock.wait(REFRESH_LOCK_TIMEOUT)
+        return latest_current_weather(cities)
+    try:
+        latest = latest_current_weather(cities)
+        stale = [c for c in cities if c.pk not in latest or is_stale(latest[c.pk].fetched_at, CURRENT_WEATHER_TTL)]
+        if stale:
+            for city_id, reading in update_current_weather_batch(stale).items():
+                reading.city = next(c for c in stale if c.pk == city_id)
+                latest[city_id] = reading
+        return latest
+    finally:
+        lock.release()
+
+
+def get_or_update_current_weather_bulk(cities, background=True):
+    """
+    Latest current weather for many cities, {city id: reading}, from their
+    latest_weather pointers (load `cities` with select_related).
+    Stale cities share one coalesced group refresh: queued in the background
+    while every stale city still has a reading within the hard-stale limit,
+    otherwise run inline.
+    """
+    latest = {}
+    for city in cities:
+        if city.latest_weather_id:
+            latest[city.pk] = city.latest_weather
+            latest[city.pk].city = city
+    stale = [c for c in cities if c.pk not in latest or is_stale(latest[c.pk].fetched_at, CURRENT_WEATHER_TTL)]
+    if not stale or not upstream_available():
+        return latest
+
+    ids = ','.join(str(pk) for pk in sorted(c.pk for c in stale))
+    key = f"batch:{hashlib.sha1(ids.encode()).hexdigest()[:16]}"
+    hard_stale = timedelta(minutes=settings.WEATHER_HARD_STALE_MINUTES)
+    servable = all(c.pk in latest and not is_stale(latest[c.pk].fetched_at, hard_stale) for c in stale)
+    if servable and background and settings.WEATHER_STALE_WHILE_REVALIDATE:
+        background_refresher.submit(key, _refresh_batch, key, stale)
+        return latest
+
+    latest.update(_refresh_batch(key, stale))
+    return latest
+
+
+def _cached_forecasts(city):
+    hourly = list(city.hourly_forecasts.filter(datetime__gte=timezone.now())[:24])
+    daily = list(city.daily_forecasts.all()[:7])
+    return hourly, daily
+
+
+def get_or_update_forecasts(city, background=True):
+    """
+    Get forecasts from DB cache, or fetch from API if stale (>30 min).
+    Concurrent refreshes of the same city are coalesced into one upstream call.
+    With background=False stale forecasts are always refreshed inline.
+    """
+    if not is_stale(city.forecast_fetched_at, FORECAST_TTL):
+        return _cached_forecasts(city)
+
+    def read():
+        from .models import City
+        fetched_at = City.objects.filter(pk=city.pk).values_list('forecast_fetched_at', flat=True).first()
+        return _cached_forecasts(city), not is_stale(fetched_at, FORECAST_TTL)
+
+    def refresh():
+        return refresh_forecasts(city)
+
+    cached = _cached_forecasts(city) if city.forecast_fetched_at else None
+    return _serve_stale(_refresh_key('forecast', city), cached, city.forecast_fetched_at, read, refresh, background)
+
+
+# Async variants for the async API views. Upstream calls go through the
+# httpx client on the running loop; DB writes reuse the sync save functions.
+
+async def afetch_current_weather(city_name):
+    """Async fetch_current_weather"""
+    api_key = get_api_key()
+    if not api_key:
+        logger.error("No OpenWeatherMap API key configured")
+        return None
+
+    try:
+        url = f"{OWM_BASE_URL}/weather"
+        params = {
+            'q': f"{city_name},LK",
+            'appid': api_key,
+            'units': 'metric'
+        }
+        data = await get_async_client().get_json(url, params=params)
+        return _parse_current_weather(data)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching weather for {city_name}: {e}")
+        return None
+    except (KeyError, IndexError) as e:
+        logger.error(f"Error parsing weather data for {city_name}: {e}")
+        return None
+
+
+async def afetch_forecast(lat, lon):
+    """Async fetch_forecast"""
+    api_key = get_api_key()
+    if not api_key:
+        return None, None
+
+    try:
+        url = f"{OWM_BASE_URL}/forecast"
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'appid': api_key,
+            'units': 'metric'
+        }
+        data = await get_async_client().get_json(url, params=params)
+        return _parse_forecast(data)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching forecast for ({lat}, {lon}): {e}")
+        return None, None
+    except (KeyError, IndexError) as e:
+        logger.error(f"Error parsing forecast data: {e}")
+        return None, None
+
+
+async def afetch_onecall(lat, lon):
+    """Async fetch_onecall"""
+    api_key = get_api_key()
+    if not api_key or not onecall_available():
+        return None, None, None
+
+    try:
+        params = _onecall_params(lat, lon, api_key)
+        data = await get_async_client().get_json(OWM_ONECALL_URL, params=params)
+        return _parse_onecall(data)
+    except (requests.RequestException, KeyError, IndexError, TypeError) as e:
+        return _onecall_failed(e, lat, lon)
+
+
+async def aupstream_available():
+    return await sync_to_async(upstream_available)()
+
+
+async def arefresh_city_onecall(city):
+    current_data, hourly_data, daily_data = await afetch_onecall(city.lat, city.lon)
+    if not current_data:
+        return None
+    return await sync_to_async(_save_onecall)(city, current_data, hourly_data, daily_data)
+
+
+async def arefresh_current_weather(city):
+    """Async refresh_current_weather"""
+    if onecall_available():
+        result = await arefresh_city_onecall(city)
+        if result:
+            return result[0]
+    weather_data = await afetch_current_weather(city.name)
+    if not weather_data:
+        return None
+    return await sync_to_async(save_current_weather)(city, weather_data)
+
+
+async def arefresh_forecasts(city):
+    """Async refresh_forecasts"""
+    if onecall_available():
+        result = await arefresh_city_onecall(city)
+        if result:
+            return result[1], result[2]
+    hourly_data, daily_data = await afetch_forecast(city.lat, city.lon)
+    if not hourly_data:
+        return None
+    return await sync_to_async(save_forecasts)(city, hourly_data, daily_data)
+
+
+async def arecord_demand(city):
+    """Async record_demand; only a flush leaves the event loop"""
+    counts = _buffer_demand(city)
+    if counts:
+        await sync_to_async(flush_demand)(counts)
+
+
+async def _asingle_flight(key, cached, read, refresh):
+    """_single_flight with coroutine read() and refresh()"""
+    lock = CacheLock(f'weather:refresh:{key}', timeout=REFRESH_LOCK_TIMEOUT)
+    if await lock.aacquire():
+        try:
+            value, fresh = await read()
+            if fresh:
+                return value
+            return await refresh() or value
+        finally:
+            await lock.arelease()
+
+    if cached:
+        return cached
+    await lock.await_release(REFRESH_LOCK_TIMEOUT)
+    return (await read())[0]
+
+
+# Background refreshes started by async views, by key. Holding the task
+# keeps it from being garbage collected and dedupes repeat submissions.
+_async_refreshes = {}
+
+
+def _refresh_in_background(key, *args):
+    task = _async_refreshes.get(key)
+    if task is not None and not task.done():
+        return task
+    task = asyncio.get_running_loop().create_task(_asingle_flight(key, *args))
+    _async_refreshes[key] = task
+
+    def forget(done):
+        if _async_refreshes.get(key) is done:
+            del _async_refreshes[key]
+    task.add_done_callback(forget)
+    return task
+
+
+async def _aserve_stale(key, cached, fetched_at, read, refresh, background):
+    """Async _serve_stale; background refreshes run as tasks on the running loop"""
+    if cached and not await aupstream_available():
+        return cached
+
+    if cached and background and settings.WEATHER_STALE_WHILE_REVALIDATE:
+        hard_stale = timedelta(minutes=settings.WEATHER_HARD_STALE_MINUTES)
+        if not is_stale(fetched_at, hard_stale):
+            _refresh_in_background(key, cached, read, refresh)
+            return cached
+        cached = None
+
+    return await _asingle_flight(key, cached, read, refresh)
+
+
+async def aget_or_update_current_weather(city, background=True):
+    """
+    Async get_or_update_current_weather. Load `city` with
+    select_related('latest_weather'); a missing pointer costs one query.
+    """
+    latest = city.latest_weather if city.latest_weather_id else None
+    if latest:
+        latest.city = city
+
+    if latest and not is_stale(latest.fetched_at, CURRENT_WEATHER_TTL):
+        return latest
+
+    async def read():
+        current = await city.current_weather.select_related('city').afirst()
+        return current, bool(current) and not is_stale(current.fetched_at, CURRENT_WEATHER_TTL)
+
+    async def refresh():
+        return await arefresh_current_weather(city)
+
+    fetched_at = latest.fetched_at if latest else None
+    return await _aserve_stale(_refresh_key('current', city), latest, fetched_at, read, refresh, background)
+
+
+async def _acached_forecasts(city):
+    hourly = [h async for h in city.hourly_forecasts.filter(datetime__gte=timezone.now())[:24]]
+    daily = [d async for d in city.daily_forecasts.all()[:7]]
+    return hourly, daily
+
+
+async def aget_or_update_forecasts(city, background=True):
+    """Async get_or_update_forecasts"""
+    if not is_stale(city.forecast_fetched_at, FORECAST_TTL):
+        return await _acached_forecasts(city)
+
+    async def read():
+        from .models import City
+        fetched_at = await City.objects.filter(pk=city.pk).values_list('forecast_fetched_at', flat=True).afirst()
+        return await _acached_forecasts(city), not is_stale(fetched_at, FORECAST_TTL)
+
+    async def refresh():
+        return await arefresh_forecasts(city)
+
+    cached = await _acached_forecasts(city) if city.forecast_fetched_at else None
+    return await _aserve_stale(_refresh_key('forecast', city), cached, city.forecast_fetched_at, read, refresh, background)
 
 
 def get_uv_index_label(uv):
@@ -0,0 +1,93 @@
+"""
+In-memory KD-tree over coordinates for nearest-neighbour and bounding-box
+queries. The city registry builds one with the rest of its index, so it is
+rebuilt whenever cities change.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class KDTree:
+    """
+    2-d tree on (lat, lon) of (lat, lon, item) points, items being comparable
+    ids. Nodes are (point, axis, left, right) tuples; axis 0 splits on
+    latitude, 1 on longitude.
+    """
+
+    def __init__(self, points):
+        points = list(points)
+        # Smallest cos(latitude) among the points, for the longitude pruning bound
+        self.min_cos = min((math.cos(math.radians(p[0])) for p in points), default=1.0)
+        self.root = self._build(points, 0)
+        self.size = len(points)
+
+    def _build(self, points, axis):
+        if not points:
+            return None
+        points.sort(key=lambda p: p[axis])
+        mid = len(points) // 2
+        return (points[mid], axis, self._build(points[:mid], 1 - axis), self._build(points[mid + 1:], 1 - axis))
+
+    def within(self, south, west, north, east):
+        """Items whose point lies in the box (edges included)"""
+        low, high = (south, west), (north, east)
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            point, axis, left, right = node
+            if south <= point[0] <= north and west <= point[1] <= east:
+                found.append(point[2])
+            if low[axis] <= point[axis]:
+                stack.append(left)
+            if point[axis] <= high[axis]:
+                stack.append(right)
+        return found
+
+    def nearest(self, lat, lon, k=1):
+        """The k nearest items as [(distance_km, item)], closest first"""
+        if k <= 0:
+            return []
+        best = []  # Max-heap of (-distance, item), at most k long
+        cos_lat = math.cos(math.radians(lat))
+
+        def lower_bound(axis, delta):
+            # No point across a split can be closer than this
+            if axis == 0:
+                return EARTH_RADIUS_KM * math.radians(abs(delta))
+            # The far side may be nearer the other way round, across the antimeridian
+            dlon = min(abs(delta), 180 - abs(lon))
+            a = cos_lat * self.min_cos * math.sin(math.radians(dlon) / 2) ** 2
+            return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+        def visit(node):
+            if node is None:
+                return
+            point, axis, left, right = node
+            distance = haversine_km(lat, lon, point[0], point[1])
+            entry = (-distance, point[2])
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, entry)
+
+            delta = (lat, lon)[axis] - point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if len(best) < k or lower_bound(axis, delta) < -best[0][0]:
+                visit(far)
+
+        visit(self.root)
+        return [(-d, item) for d, item in sorted(best, reverse=True)]
@@ -1,9 +1,45 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import math
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import httpx
+import numpy as np
+import requests
+from urllib3 import HTTPResponse
+from urllib3.exceptions import MaxRetryError
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Profile, City
+from .models import (
+    Profile, City, CurrentWeather, HourlyForecast, DailyForecast, WeatherAlert, ActivityOutlook,
+    HistoricalRecord, HistoryRollup, ClimateNormal, CityDemand,
+)
+from .concurrency import TokenBucket, CacheLock
+from .client import (
+    OWMClient, AsyncOWMClient, CircuitBreaker, CircuitOpenError, QuotaExceededError, QuotaRetry,
+    RecordingClient, FakeClient, get_client, reset_client,
+)
+from . import api_views, broadcast, city_registry, history_import, history_store, quota, response_cache, rollups, trends
+from .spatial import KDTree, haversine_km
+from .throttles import NewCityRateThrottle
+from . import scheduler, services
 
 User = get_user_model()
 
@@ -49,3 +85,1443 @@ class ProfileModelAPITests(TestCase):
         res2 = self.client.post(url, {'action': 'disable'}, format='json')
         self.user.profile.refresh_from_db()
         self.assertFalse(self.user.profile.is_premium)
+
+
+SAMPLE_CURRENT = {
+    'temperature': 30.1, 'feels_like': 33.0, 'condition': 'Clouds',
+    'description': 'Broken Clouds', 'icon': 'cloudy_filled', 'humidity': 74,
+    'wind_speed': 12.6, 'wind_direction': 'SW', 'wind_deg': 225,
+    'visibility': 10.0, 'pressure': 1009, 'clouds': 75,
+    'lat': 6.93, 'lon': 79.86,
+}
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_then_empty(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False)
+class FetchWeatherCommandTests(TestCase):
+    def setUp(self):
+        City.objects.create(name='Colombo', province='Western Province', lat=6.93, lon=79.86)
+        City.objects.create(name='Kandy', province='Central Province', lat=7.29, lon=80.63)
+
+    @mock.patch('weather.services.fetch_forecast', return_value=([], []))
+    @mock.patch('weather.services.fetch_current_weather')
+    def test_concurrent_mode_fetches_stale_cities(self, fetch_current, fetch_forecast):
+        fetch_current.side_effect = lambda name: dict(SAMPLE_CURRENT)
+        out = StringIO()
+        call_command('fetch_weather', workers=4, rps=1000, stdout=out)
+        self.assertEqual(fetch_current.call_count, 2)
+        self.assertEqual(CurrentWeather.objects.count(), 2)
+        self.assertIn('fetch', out.getvalue())
+
+        # Fresh readings are not fetched again
+        fetch_current.reset_mock()
+        call_command('fetch_weather', workers=4, rps=1000, stdout=StringIO())
+        self.assertEqual(fetch_current.call_count, 0)
+
+    @mock.patch('weather.services.fetch_forecast', return_value=([], []))
+    @mock.patch('weather.services.fetch_current_weather_group', return_value={})
+    @mock.patch('weather.services.fetch_current_weather')
+    def test_concurrent_mode_locates_cities_before_forecasts(self, fetch_current, fetch_group, fetch_forecast):
+        City.objects.create(name='Galle', province='Southern Province', lat=0, lon=0)
+        fetch_current.side_effect = lambda name: dict(SAMPLE_CURRENT, lat=6.05, lon=80.22) if name == 'Galle' \
+            else dict(SAMPLE_CURRENT)
+        with mock.patch('weather.services.onecall_available', return_value=False):
+            call_command('fetch_weather', workers=4, rps=1000, stdout=StringIO())
+        self.assertIn(mock.call(6.05, 80.22), fetch_forecast.call_args_list)
+        self.assertNotIn(mock.call(0, 0), fetch_forecast.call_args_list)
+        self.assertEqual(City.objects.get(name='Galle').lat, 6.05)
+
+    @mock.patch('weather.services.fetch_onecall', return_value=(dict(SAMPLE_CURRENT), [], []))
+    def test_onecall_readings_for_fresh_cities_are_not_counted(self, fetch_onecall):
+        services.save_current_weather(City.objects.get(name='Colombo'), dict(SAMPLE_CURRENT))
+        out = StringIO()
+        with mock.patch('weather.services.onecall_available', return_value=True):
+            call_command('fetch_weather', workers=2, rps=1000, stdout=out)
+        self.assertEqual(fetch_onecall.call_count, 2)
+        self.assertIn('Success: 1, Errors: 0', out.getvalue())
+
+
+class OWMClientTests(TestCase):
+    def test_pool_retry_and_timeouts(self):
+        client = OWMClient(pool_size=7, max_retries=2, connect_timeout=1, read_timeout=5)
+        adapter = client.session.get_adapter('https://api.openweathermap.org')
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIsInstance(adapter.max_retries, QuotaRetry)
+        self.assertIn(429, adapter.max_retries.status_forcelist)
+        self.assertEqual(client.timeout, (1, 5))
+
+    def test_shared_client(self):
+        self.assertIs(get_client(), get_client())
+
+    def test_fetch_current_weather_uses_shared_session(self):
+        payload = {
+            'main': {'temp': 30.14, 'feels_like': 33, 'humidity': 74, 'pressure': 1009},
+            'weather': [{'main': 'Clouds', 'description': 'broken clouds', 'icon': '04d'}],
+            'wind': {'speed': 3.5, 'deg': 225}, 'clouds': {'all': 75},
+            'visibility': 10000, 'coord': {'lat': 6.93, 'lon': 79.86},
+        }
+        response = mock.Mock(status_code=200)
+        response.json.return_value = payload
+        with mock.patch.object(get_client().session, 'get', return_value=response) as get:
+            data = services.fetch_current_weather('Colombo')
+        self.assertEqual(get.call_args.kwargs['timeout'], get_client().timeout)
+        self.assertEqual(data['temperature'], 30.1)
+        self.assertEqual(data['wind_direction'], 'SW')
+
+
+def owm_weather_item(owm_id, temp=30.0, lat=6.93, lon=79.86):
+    """Minimal /weather payload as returned by OpenWeatherMap"""
+    return {
+        'id': owm_id,
+        'main': {'temp': temp, 'feels_like': temp + 2, 'humidity': 74, 'pressure': 1009},
+        'weather': [{'main': 'Clouds', 'description': 'broken clouds', 'icon': '04d'}],
+        'wind': {'speed': 3.5, 'deg': 225}, 'clouds': {'all': 75},
+        'visibility': 10000, 'coord': {'lat': lat, 'lon': lon},
+    }
+
+
+class GroupFetchTests(TestCase):
+    def setUp(self):
+        self.colombo = City.objects.create(name='Colombo', lat=6.93, lon=79.86, owm_id=1248991)
+        self.kandy = City.objects.create(name='Kandy', lat=7.29, lon=80.63, owm_id=1241622)
+        self.galle = City.objects.create(name='Galle', lat=6.05, lon=80.22)
+
+    def test_group_request_and_bulk_insert(self):
+        def get_json(url, params=None):
+            if url.endswith('/group'):
+                return {'cnt': 2, 'list': [owm_weather_item(1248991, 31), owm_weather_item(1241622, 24)]}
+            return owm_weather_item(1246294, 28, lat=6.05, lon=80.22)
+
+        with mock.patch.object(get_client(), 'get_json', side_effect=get_json) as get:
+            saved = services.update_current_weather_batch([self.colombo, self.kandy, self.galle])
+
+        urls = [c.args[0] for c in get.call_args_list]
+        self.assertEqual(sum(u.endswith('/group') for u in urls), 1)
+        self.assertEqual(sum(u.endswith('/weather') for u in urls), 1)
+        self.assertEqual(saved[self.kandy.pk].temperature, 24)
+        self.assertEqual(CurrentWeather.objects.count(), 3)
+        self.galle.refresh_from_db()
+        self.assertEqual(self.galle.owm_id, 1246294)
+
+    def test_batch_keeps_last_ten_readings(self):
+        data = services._parse_current_weather(owm_weather_item(1248991))
+        for _ in range(12):
+            services.save_current_weather_batch([(self.colombo, data)])
+        self.assertEqual(self.colombo.current_weather.count(), 10)
+
+
+@override_settings(WEATHER_STALE_WHILE_REVALIDATE=False, OPENWEATHERMAP_ONECALL=False)
+class SingleFlightRefreshTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86)
+        self.stale = CurrentWeather.objects.create(
+            city=self.city, temperature=29, condition='Rain', humidity=80, wind_speed=10
+        )
+        CurrentWeather.objects.filter(pk=self.stale.pk).update(
+            fetched_at=timezone.now() - timedelta(hours=1)
+        )
+        self.city.refresh_from_db()
+
+    @mock.patch('weather.services.fetch_current_weather')
+    def test_waiters_get_previous_value_while_refresh_in_flight(self, fetch_current):
+        lock = CacheLock(f'weather:refresh:current:{self.city.pk}')
+        self.assertTrue(lock.acquire())
+        try:
+            current = services.get_or_update_current_weather(self.city)
+        finally:
+            lock.release()
+        fetch_current.assert_not_called()
+        self.assertEqual(current.pk, self.stale.pk)
+
+    @mock.patch('weather.services.fetch_current_weather')
+    def test_lock_holder_refreshes_once(self, fetch_current):
+        fetch_current.side_effect = lambda name: dict(SAMPLE_CURRENT)
+        first = services.get_or_update_current_weather(self.city)
+        second = services.get_or_update_current_weather(self.city)
+        self.assertEqual(fetch_current.call_count, 1)
+        self.assertEqual(first.pk, second.pk)
+        self.assertIsNone(cache.get(f'lock:weather:refresh:current:{self.city.pk}'))
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False)
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86)
+        self.stale = CurrentWeather.objects.create(
+            city=self.city, temperature=29, condition='Rain', humidity=80, wind_speed=10
+        )
+
+    def age_reading(self, minutes):
+        CurrentWeather.objects.filter(pk=self.stale.pk).update(
+            fetched_at=timezone.now() - timedelta(minutes=minutes)
+        )
+        self.city.refresh_from_db()
+
+    @mock.patch('weather.services.fetch_current_weather')
+    @mock.patch.object(services.background_refresher, 'submit')
+    def test_stale_served_immediately_and_refreshed_in_background(self, submit, fetch_current):
+        self.age_reading(30)
+        current = services.get_or_update_current_weather(self.city)
+        self.assertEqual(current.pk, self.stale.pk)
+        fetch_current.assert_not_called()
+        self.assertEqual(submit.call_args.args[0], f'current:{self.city.pk}')
+
+    @override_settings(WEATHER_HARD_STALE_MINUTES=60)
+    @mock.patch('weather.services.fetch_current_weather')
+    @mock.patch.object(services.background_refresher, 'submit')
+    def test_hard_stale_blocks_on_refresh(self, submit, fetch_current):
+        fetch_current.side_effect = lambda name: dict(SAMPLE_CURRENT)
+        self.age_reading(90)
+        current = services.get_or_update_current_weather(self.city)
+        submit.assert_not_called()
+        self.assertNotEqual(current.pk, self.stale.pk)
+        self.assertEqual(current.temperature, SAMPLE_CURRENT['temperature'])
+
+
+def onecall_payload(hours=30, days=8):
+    """Minimal One Call 3.0 payload starting from now"""
+    start = int(timezone.now().timestamp())
+    weather = [{'main': 'Rain', 'description': 'light rain', 'icon': '10d'}]
+    return {
+        'lat': 6.93, 'lon': 79.86,
+        'current': {
+            'dt': start, 'temp': 29.44, 'feels_like': 34.2, 'pressure': 1008,
+            'humidity': 79, 'uvi': 8.3, 'clouds': 40, 'visibility': 9000,
+            'wind_speed': 4, 'wind_deg': 250, 'weather': weather,
+        },
+        'hourly': [
+            {'dt': start + h * 3600, 'temp': 29 - h * 0.1, 'humidity': 80,
+             'wind_speed': 4, 'pop': 0.4, 'weather': weather}
+            for h in range(hours)
+        ],
+        'daily': [
+            {'dt': start + d * 86400, 'temp': {'min': 24.1, 'max': 31.6, 'day': 29},
+             'humidity': 78, 'wind_speed': 5, 'pop': 0.7, 'weather': weather}
+            for d in range(days)
+        ],
+    }
+
+
+@override_settings(WEATHER_STALE_WHILE_REVALIDATE=False)
+class OneCallTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services._onecall_rejected = False
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86)
+
+    def tearDown(self):
+        services._onecall_rejected = False
+
+    def test_parse_single_pass(self):
+        current, hourly, daily = services._parse_onecall(onecall_payload())
+        self.assertEqual(current['uv_index'], 8.3)
+        self.assertEqual(current['wind_speed'], 14.4)
+        self.assertEqual(len(hourly), 24)
+        self.assertEqual(len(daily), 7)
+        self.assertEqual((daily[0]['temp_high'], daily[0]['temp_low']), (31.6, 24.1))
+
+    def test_one_request_refreshes_current_and_forecasts(self):
+        with mock.patch.object(get_client(), 'get_json', return_value=onecall_payload()) as get:
+            current = services.get_or_update_current_weather(self.city)
+            _, daily = services.get_or_update_forecasts(self.city)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(get.call_args.args[0], services.OWM_ONECALL_URL)
+        self.assertEqual(current.uv_index, 8.3)
+        self.assertEqual(HourlyForecast.objects.filter(city=self.city).count(), 24)
+        self.assertEqual(len(daily), 7)
+
+    def test_falls_back_to_two_call_path_when_rejected(self):
+        import requests
+        rejected = requests.HTTPError(response=mock.Mock(status_code=401))
+        with mock.patch.object(get_client(), 'get_json', side_effect=rejected), \
+                mock.patch('weather.services.fetch_current_weather', return_value=dict(SAMPLE_CURRENT)):
+            current = services.get_or_update_current_weather(self.city)
+        self.assertFalse(services.onecall_available())
+        self.assertEqual(current.temperature, SAMPLE_CURRENT['temperature'])
+
+
+class ForecastUpsertTests(TestCase):
+    def setUp(self):
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86)
+        _, self.hourly, self.daily = services._parse_onecall(onecall_payload())
+
+    def test_unchanged_slots_are_not_rewritten(self):
+        services.save_forecasts(self.city, self.hourly, self.daily)
+        ids = set(HourlyForecast.objects.values_list('id', flat=True))
+
+        changed = [dict(h) for h in self.hourly]
+        changed[3]['temperature'] = 35.0
+        with CaptureQueriesContext(connection) as ctx:
+            hourly, _ = services.save_forecasts(self.city, changed, self.daily)
+
+        self.assertEqual(set(HourlyForecast.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(HourlyForecast.objects.get(datetime=changed[3]['datetime']).temperature, 35.0)
+        self.assertFalse(any(q['sql'].startswith('DELETE') for q in ctx.captured_queries))
+        self.assertEqual(len(hourly), 24)
+        self.assertTrue(all(h.id for h in hourly))
+
+    def test_slots_leaving_the_window_are_removed(self):
+        services.save_forecasts(self.city, self.hourly, self.daily)
+        services.save_forecasts(self.city, self.hourly[2:], self.daily[1:])
+        self.assertEqual(HourlyForecast.objects.filter(city=self.city).count(), 22)
+        self.assertEqual(DailyForecast.objects.filter(city=self.city).count(), 6)
+        self.city.refresh_from_db()
+        self.assertIsNotNone(self.city.forecast_fetched_at)
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False)
+class RefreshSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.colombo = City.objects.create(name='Colombo', province='Western Province', lat=6.93, lon=79.86)
+        self.ratnapura = City.objects.create(name='Ratnapura', province='Sabaragamuwa Province', lat=6.68, lon=80.40)
+        self.jaffna = City.objects.create(name='Jaffna', province='Northern Province', lat=9.66, lon=80.03)
+        # Drop requests buffered by earlier tests
+        services.pop_demand_counts(City.objects.values_list('pk', flat=True))
+
+    def test_popularity_from_profiles_requests_and_alerts(self):
+        user = User.objects.create_user(username='reader', password='pass123')
+        user.profile.default_city = self.colombo
+        user.profile.save()
+        services.record_demand(self.colombo)
+        services.record_demand(self.colombo)
+        WeatherAlert.objects.create(severity='RED', title='Flood', district='Ratnapura', description='...')
+
+        scores = scheduler.city_popularity([self.colombo, self.ratnapura, self.jaffna])
+        self.assertEqual(scores[self.colombo.pk], 3)
+        self.assertEqual(scores[self.ratnapura.pk], scheduler.ALERT_WEIGHT)
+        self.assertEqual(scores[self.jaffna.pk], 0)
+
+    def test_demand_reaches_the_scheduler_through_the_database(self):
+        services.record_demand(self.jaffna)
+        services.flush_demand()  # As the web process does every DEMAND_FLUSH_INTERVAL
+        self.assertEqual(CityDemand.objects.get(city=self.jaffna).requests, 1)
+        with mock.patch('weather.services.time.monotonic', return_value=time.monotonic() + 60):
+            services.record_demand(self.jaffna)  # Due, so written at once
+        self.assertEqual(CityDemand.objects.get(city=self.jaffna).requests, 2)
+
+        self.assertEqual(services.pop_demand_counts([self.jaffna.pk]), {self.jaffna.pk: 2})
+        self.assertFalse(CityDemand.objects.exists())
+
+    def test_hot_cities_refresh_sooner_and_cold_ones_back_off(self):
+        hot = scheduler.refresh_interval(scheduler.CURRENT, score=20)
+        base = scheduler.refresh_interval(scheduler.CURRENT, score=0)
+        cold = scheduler.refresh_interval(scheduler.CURRENT, score=0, cold_streak=3)
+        self.assertLess(hot, base)
+        self.assertLess(base, services.CURRENT_WEATHER_TTL.total_seconds())
+        self.assertEqual(cold, base * 8)
+
+    @mock.patch('weather.services.fetch_forecast', return_value=(None, None))
+    @mock.patch('weather.services.update_current_weather_batch', return_value={})
+    def test_run_due_refreshes_never_fetched_cities_and_reschedules(self, batch, fetch_forecast):
+        refresh = scheduler.RefreshScheduler(calls_per_minute=6000)
+        refresh.load()
+        refresh.run_due()
+        self.assertEqual(len(batch.call_args.args[0]), 3)
+        self.assertEqual(fetch_forecast.call_count, 3)
+        self.assertTrue(all(at > time.time() for at in refresh.due.values()))
+
+        batch.reset_mock()
+        refresh.run_due()
+        batch.assert_not_called()
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: self.now)
+
+    def test_opens_after_threshold_then_half_open_probe(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.now = 31
+        self.breaker.before_call()  # The single half-open probe
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 31
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allows_request())
+
+    @override_settings(WEATHER_STALE_WHILE_REVALIDATE=False, OPENWEATHERMAP_ONECALL=False)
+    @mock.patch('weather.services.fetch_current_weather')
+    def test_open_circuit_serves_cached_data_without_fetching(self, fetch_current):
+        cache.clear()
+        city = City.objects.create(name='Colombo', lat=6.93, lon=79.86)
+        stale = CurrentWeather.objects.create(
+            city=city, temperature=29, condition='Rain', humidity=80, wind_speed=10
+        )
+        CurrentWeather.objects.filter(pk=stale.pk).update(fetched_at=timezone.now() - timedelta(hours=1))
+        with mock.patch.object(get_client().breaker, 'allows_request', return_value=False):
+            current = services.get_or_update_current_weather(city)
+        fetch_current.assert_not_called()
+        self.assertEqual(current.pk, stale.pk)
+
+
+@override_settings(OPENWEATHERMAP_CALLS_PER_MINUTE=3, OPENWEATHERMAP_CALLS_PER_DAY=4)
+class QuotaTests(TestCase):
+    def test_minute_and_day_windows(self):
+        self.assertTrue(quota.try_acquire(2))
+        self.assertTrue(quota.try_acquire())
+        self.assertFalse(quota.try_acquire())
+        self.assertEqual(quota.remaining(), {'minute': 0, 'day': 1})
+
+    def test_refused_call_reserves_nothing(self):
+        self.assertTrue(quota.try_acquire(3))
+        self.assertFalse(quota.try_acquire(2))
+        self.assertEqual(quota.remaining()['day'], 1)
+
+    def test_client_refuses_when_quota_spent(self):
+        client = OWMClient()
+        quota.try_acquire(3)
+        with mock.patch.object(client.session, 'get') as get:
+            with self.assertRaises(QuotaExceededError):
+                client.get_json('https://api.openweathermap.org/data/2.5/weather')
+        get.assert_not_called()
+
+    def test_each_retry_is_charged(self):
+        quota.try_acquire(2)
+        retry = QuotaRetry(total=5, status_forcelist=[503], raise_on_status=False)
+        retry = retry.increment('GET', '/data/2.5/weather', response=HTTPResponse(status=503))
+        self.assertEqual(quota.remaining()['minute'], 0)
+        with self.assertRaises(MaxRetryError):
+            retry.increment('GET', '/data/2.5/weather', response=HTTPResponse(status=503))
+
+    async def test_async_retries_stop_when_quota_spent(self):
+        sent = []
+        client = AsyncOWMClient(
+            OWMClient(), max_retries=5, backoff_factor=0,
+            transport=httpx.MockTransport(lambda request: sent.append(request) or httpx.Response(503)),
+        )
+        with self.assertRaises(requests.HTTPError):
+            await client.get_json('http://owm.test/data')
+        self.assertEqual(len(sent), 3)
+
+
+class ProviderTests(TestCase):
+    def setUp(self):
+        self.fixtures = tempfile.TemporaryDirectory()
+        self.addCleanup(self.fixtures.cleanup)
+        self.addCleanup(reset_client)
+        reset_client()
+
+    def test_fake_provider_works_offline(self):
+        with override_settings(OPENWEATHERMAP_PROVIDER='fake', OPENWEATHERMAP_FIXTURES_DIR=self.fixtures.name):
+            reset_client()
+            self.assertIsInstance(get_client(), FakeClient)
+            with mock.patch('requests.Session.get') as get:
+                data = services.fetch_current_weather('Kandy')
+                hourly, daily = services.fetch_forecast(7.29, 80.63)
+            get.assert_not_called()
+        self.assertIsNotNone(data['temperature'])
+        self.assertTrue(hourly)
+        self.assertTrue(daily)
+        # Synthetic data is deterministic per place
+        self.assertEqual(data['owm_id'], services.fetch_current_weather('Kandy')['owm_id'])
+
+    def test_record_then_replay(self):
+        recorder = RecordingClient(fixtures_dir=self.fixtures.name)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = owm_weather_item(1248991, temp=27.5)
+        params = {'q': 'Kandy,LK', 'appid': 'secret', 'units': 'metric'}
+        with mock.patch.object(recorder.session, 'get', return_value=response):
+            recorder.get_json(f'{services.OWM_BASE_URL}/weather', params)
+
+        recorded = list((Path(self.fixtures.name) / 'weather').glob('*.json'))
+        self.assertEqual(len(recorded), 1)
+        self.assertNotIn('secret', recorded[0].read_text())
+
+        replay = FakeClient(fixtures_dir=self.fixtures.name, synthetic=False)
+        data = replay.get_json(f'{services.OWM_BASE_URL}/weather', {**params, 'appid': 'other'})
+        self.assertEqual(data['main']['temp'], 27.5)
+        with self.assertRaises(requests.HTTPError) as ctx:
+            replay.get_json(f'{services.OWM_BASE_URL}/weather', {'q': 'Galle,LK', 'units': 'metric'})
+        self.assertEqual(ctx.exception.response.status_code, 404)
+
+    def test_fake_error_rate(self):
+        fake = FakeClient(fixtures_dir=self.fixtures.name, error_rate=1.0)
+        with self.assertRaises(requests.HTTPError) as ctx:
+            fake.get_json(f'{services.OWM_BASE_URL}/forecast', {'lat': 7.0, 'lon': 80.0})
+        self.assertEqual(ctx.exception.response.status_code, 503)
+        self.assertEqual(fake.breaker.failures, 1)
+
+    def test_fake_rejects_bad_params(self):
+        fake = FakeClient(fixtures_dir=self.fixtures.name)
+        for params in ({'lat': 7.0}, {'lat': 'north', 'lon': 80.0}):
+            with self.assertRaises(requests.HTTPError) as ctx:
+                fake.get_json(f'{services.OWM_BASE_URL}/forecast', params)
+            self.assertEqual(ctx.exception.response.status_code, 400)
+        self.assertEqual(fake.breaker.failures, 0)
+
+
+class DashboardAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.city = City.objects.create(
+            name='Colombo', lat=6.93, lon=79.86, province='Western', forecast_fetched_at=timezone.now()
+        )
+        CurrentWeather.objects.create(
+            city=self.city, temperature=30, condition='Clouds', humidity=74, wind_speed=12
+        )
+        HourlyForecast.objects.create(
+            city=self.city, datetime=timezone.now() + timedelta(hours=1), temperature=29,
+            condition='Rain', humidity=80, wind_speed=10
+        )
+        WeatherAlert.objects.create(severity='RED', title='Flood', district='Colombo', description='Floods')
+        city_registry.registry.index()  # Loaded once per process, not per request
+
+    def test_all_panels_in_one_response(self):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('api-dashboard'), {'city': 'colombo'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['current']['temperature'], 30)
+        self.assertEqual(len(res.data['hourly']), 1)
+        self.assertEqual(res.data['daily'], [])
+        self.assertEqual(res.data['alerts'][0]['title'], 'Flood')
+        self.assertEqual(len(res.data['activities']), 3)  # Defaults
+        self.assertLessEqual(len(queries), 7)  # City, two table states, four panels
+
+    def test_days_is_validated(self):
+        url = reverse('api-dashboard')
+        self.assertEqual(self.client.get(url, {'days': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get(reverse('api-daily-forecast'), {'days': 'abc'}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        DailyForecast.objects.bulk_create([
+            DailyForecast(
+                city=self.city, date=date.today() + timedelta(days=i), temp_high=31, temp_low=24,
+                condition='Rain', humidity=80, wind_speed=10,
+            )
+            for i in range(3)
+        ])
+        res = self.client.get(url, {'days': -1, 'fields': 'daily'})
+        self.assertEqual(len(res.data['daily']), 1)
+
+    def test_field_selection(self):
+        with mock.patch.object(services, 'get_or_update_forecasts') as forecasts:
+            res = self.client.get(reverse('api-dashboard'), {'city': 'Colombo', 'fields': 'current,alerts'})
+        forecasts.assert_not_called()
+        self.assertEqual(set(res.data), {'city', 'current', 'alerts'})
+
+        res = self.client.get(reverse('api-dashboard'), {'fields': 'current,radar'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_etag_revalidation(self):
+        res = self.client.get(reverse('api-dashboard'))
+        etag = res['ETag']
+        res = self.client.get(reverse('api-dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        CurrentWeather.objects.create(
+            city=self.city, temperature=31, condition='Clear', humidity=70, wind_speed=8
+        )
+        res = self.client.get(reverse('api-dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_unknown_city(self):
+        res = self.client.get(reverse('api-dashboard'), {'city': 'Atlantis'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False, WEATHER_STALE_WHILE_REVALIDATE=False)
+class BulkCurrentWeatherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.cities = [
+            City.objects.create(name=f'City{i}', lat=7, lon=80, province='Central', owm_id=1000 + i)
+            for i in range(5)
+        ]
+        for city in self.cities:
+            CurrentWeather.objects.create(city=city, temperature=25, condition='Clear', humidity=70, wind_speed=5)
+            CurrentWeather.objects.create(city=city, temperature=26, condition='Clear', humidity=70, wind_speed=5)
+
+    def test_fresh_cities_in_few_queries(self):
+        city_registry.registry.index()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(
+                reverse('api-current-weather-bulk'), {'cities': 'city0,City3,Nowhere,City1'}
+            )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['city'] for r in res.data['results']], ['City0', 'City3', 'City1'])
+        self.assertTrue(all(r['fresh'] for r in res.data['results']))
+        self.assertEqual(res.data['results'][0]['weather']['city_name'], 'City0')
+        self.assertEqual(res.data['not_found'], ['Nowhere'])
+        self.assertLessEqual(len(queries), 2, [q['sql'] for q in queries])
+
+    def test_stale_cities_share_one_group_refresh(self):
+        CurrentWeather.objects.filter(city__in=self.cities[:3]).update(
+            fetched_at=timezone.now() - timedelta(hours=1)
+        )
+        def group(ids):
+            return {owm_id: dict(SAMPLE_CURRENT, temperature=31) for owm_id in ids}
+        with mock.patch.object(services, 'fetch_current_weather_group', side_effect=group) as fetch:
+            res = self.client.post(
+                reverse('api-current-weather-bulk'), {'cities': [c.name for c in self.cities]}, format='json'
+            )
+        fetch.assert_called_once()
+        self.assertEqual(sorted(fetch.call_args.args[0]), [1000, 1001, 1002])
+        temps = {r['city']: r['weather']['temperature'] for r in res.data['results']}
+        self.assertEqual(temps, {'City0': 31, 'City1': 31, 'City2': 31, 'City3': 26, 'City4': 26})
+        self.assertTrue(all(r['fresh'] for r in res.data['results']))
+
+    def test_requires_cities(self):
+        res = self.client.get(reverse('api-current-weather-bulk'))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rejects_malformed_bodies(self):
+        url = reverse('api-current-weather-bulk')
+        for body in (['City0'], {'cities': ['City0', 5]}, {'cities': {'name': 'City0'}}):
+            res = self.client.post(url, body, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_names_differing_in_case_count_once(self):
+        res = self.client.get(reverse('api-current-weather-bulk'), {'cities': 'City0,city0,CITY0, City0 '})
+        self.assertEqual([r['city'] for r in res.data['results']], ['City0'])
+
+
+class LatestWeatherPointerTests(TestCase):
+    def setUp(self):
+        self.cities = [
+            City.objects.create(name=f'Town{i}', lat=7, lon=80, province='Central', owm_id=2000 + i)
+            for i in range(4)
+        ]
+
+    def test_pointer_follows_newest_reading(self):
+        city = self.cities[0]
+        first = CurrentWeather.objects.create(city=city, temperature=25, condition='Clear', humidity=70, wind_speed=5)
+        second = CurrentWeather.objects.create(city=city, temperature=27, condition='Rain', humidity=80, wind_speed=5)
+        city.refresh_from_db()
+        self.assertEqual(city.latest_weather_id, second.pk)
+
+        # An older reading arriving late doesn't move the pointer back
+        CurrentWeather.objects.filter(pk=second.pk).update(fetched_at=timezone.now() + timedelta(minutes=5))
+        CurrentWeather.objects.create(city=city, temperature=20, condition='Clear', humidity=70, wind_speed=5)
+        city.refresh_from_db()
+        self.assertEqual(city.latest_weather_id, second.pk)
+        self.assertNotEqual(city.latest_weather_id, first.pk)
+
+    def test_batch_ingest_updates_pointers(self):
+        saved = services.save_current_weather_batch([(c, dict(SAMPLE_CURRENT)) for c in self.cities])
+        for city in City.objects.all():
+            self.assertEqual(city.latest_weather_id, saved[city.pk].pk)
+
+    def test_explorer_is_constant_queries(self):
+        services.save_current_weather_batch([(c, dict(SAMPLE_CURRENT)) for c in self.cities])
+        with CaptureQueriesContext(connection) as queries:
+            res = APIClient().get(reverse('api-explorer-cities'))
+        self.assertEqual(len(queries), 2)  # Validators, then the markers
+        self.assertEqual(len(res.data), 4)
+        self.assertEqual(res.data[0]['temperature'], SAMPLE_CURRENT['temperature'])
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['responses'].clear()
+        response_cache.reset_stats()
+        self.client = APIClient()
+        self.city = City.objects.create(name='Galle', lat=6.03, lon=80.22, province='Southern')
+        CurrentWeather.objects.create(city=self.city, temperature=28, condition='Clear', humidity=75, wind_speed=9)
+
+    def test_hit_after_miss_skips_serialization(self):
+        url = reverse('api-current-weather')
+        self.assertEqual(self.client.get(url, {'city': 'Galle'})['X-Cache'], 'MISS')
+        with mock.patch('weather.api_views.CurrentWeatherSerializer') as serializer:
+            res = self.client.get(url, {'city': 'galle'})
+        serializer.assert_not_called()
+        self.assertEqual(res['X-Cache'], 'HIT')
+        self.assertEqual(res.data['temperature'], 28)
+        self.assertEqual(response_cache.stats()['current'], {'hits': 1, 'misses': 1})
+
+    def test_ingest_invalidates_city(self):
+        url = reverse('api-current-weather')
+        self.client.get(url, {'city': 'Galle'})
+        services.save_current_weather(self.city, dict(SAMPLE_CURRENT))
+        res = self.client.get(url, {'city': 'Galle'})
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['temperature'], SAMPLE_CURRENT['temperature'])
+
+    def test_stale_data_is_not_cached(self):
+        CurrentWeather.objects.update(fetched_at=timezone.now() - timedelta(hours=1))
+        with mock.patch.object(services, 'upstream_available', return_value=False):
+            self.client.get(reverse('api-current-weather'), {'city': 'Galle'})
+            res = self.client.get(reverse('api-current-weather'), {'city': 'Galle'})
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_admin_edits_invalidate_activities(self):
+        url = reverse('api-activities')
+        self.assertEqual(len(self.client.get(url).data), 3)  # Defaults
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        ActivityOutlook.objects.create(activity_name='Whale Watching', location='Mirissa', suitability='GREAT')
+        res = self.client.get(url)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual([a['activity_name'] for a in res.data], ['Whale Watching'])
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['responses'].clear()
+        self.client = APIClient()
+        self.city = City.objects.create(
+            name='Jaffna', lat=9.66, lon=80.02, province='Northern', forecast_fetched_at=timezone.now()
+        )
+        CurrentWeather.objects.create(city=self.city, temperature=31, condition='Clear', humidity=65, wind_speed=14)
+
+    def test_current_weather_304_before_serializing(self):
+        url = reverse('api-current-weather')
+        res = self.client.get(url, {'city': 'Jaffna'})
+        self.assertIn('max-age=', res['Cache-Control'])
+        self.assertTrue(res.has_header('Last-Modified'))
+
+        with mock.patch('weather.api_views.CurrentWeatherSerializer') as serializer:
+            res2 = self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_NONE_MATCH=res['ETag'])
+            res3 = self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        serializer.assert_not_called()
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res2['ETag'], res['ETag'])
+        self.assertEqual(res3.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        services.save_current_weather(self.city, dict(SAMPLE_CURRENT))
+        res4 = self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res4.status_code, status.HTTP_200_OK)
+
+    def test_fresh_forecast_304_without_reading_forecasts(self):
+        url = reverse('api-hourly-forecast')
+        etag = self.client.get(url, {'city': 'Jaffna'})['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 1)  # Just the city lookup
+
+    def test_forecast_validators_follow_the_clock(self):
+        url = reverse('api-hourly-forecast')
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        with mock.patch('weather.api_views.forecast_clock', return_value=(hour, 60)):
+            res = self.client.get(url, {'city': 'Jaffna'})
+            self.assertEqual(
+                self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_NONE_MATCH=res['ETag']).status_code,
+                status.HTTP_304_NOT_MODIFIED,
+            )
+        self.assertIn('max-age=60', res['Cache-Control'])
+
+        # Once the hour turns, the hourly list and the 'Today' label may have changed
+        with mock.patch('weather.api_views.forecast_clock', return_value=(hour + timedelta(hours=1), 3600)):
+            later = self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_NONE_MATCH=res['ETag'])
+            since = self.client.get(url, {'city': 'Jaffna'}, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(later.status_code, status.HTTP_200_OK)
+        self.assertEqual(since.status_code, status.HTTP_200_OK)
+
+        etag = self.client.get(reverse('api-dashboard'), {'city': 'Jaffna'})['ETag']
+        with mock.patch('weather.api_views.forecast_clock', return_value=(hour + timedelta(hours=2), 60)):
+            res = self.client.get(reverse('api-dashboard'), {'city': 'Jaffna'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_reference_data_changed_elsewhere_changes_etag(self):
+        ActivityOutlook.objects.create(activity_name='Whale Watching', location='Mirissa', suitability='GREAT')
+        ClimateNormal.objects.create(
+            station_name='Kandy', max_temp=29.1, min_temp=19.8, annual_rainfall=2083.5, rainy_days=184,
+            sunshine_hours=2280,
+        )
+        for name, model in (('api-activities', ActivityOutlook), ('api-climate-normals', ClimateNormal)):
+            url = reverse(name)
+            etag = self.client.get(url)['ETag']
+            # Without the cache bump, as when another process deletes them
+            with mock.patch('weather.response_cache.bump'):
+                model.objects.all().delete()
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_alerts_change_etag(self):
+        url = reverse('api-alerts')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        WeatherAlert.objects.create(severity='YELLOW', title='Wind', district='Jaffna', description='Strong winds')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False, WEATHER_STALE_WHILE_REVALIDATE=False)
+class AsyncWeatherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['responses'].clear()
+        self.fixtures = tempfile.TemporaryDirectory()
+        self.addCleanup(self.fixtures.cleanup)
+        self.addCleanup(reset_client)
+        self.city = City.objects.create(name='Badulla', lat=6.99, lon=81.06, province='Uva')
+
+    def fake_provider(self):
+        reset_client()
+        return override_settings(OPENWEATHERMAP_PROVIDER='fake', OPENWEATHERMAP_FIXTURES_DIR=self.fixtures.name)
+
+    async def test_daily_days_is_validated(self):
+        res = await self.async_client.get(reverse('api-daily-forecast-async'), {'city': 'Badulla', 'days': 'abc'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_city_lookup_only_joins_requested_relations(self):
+        with mock.patch('weather.city_registry.aget_city') as aget_city:
+            await api_views.aget_city('Badulla')
+            self.assertIsNone(aget_city.call_args.args[1])
+            await api_views.aget_city('Badulla', ['latest_weather'])
+            self.assertEqual(aget_city.call_args.args[1].query.select_related, {'latest_weather': {}})
+
+    async def test_async_views_refresh_through_fake_provider(self):
+        with self.fake_provider():
+            res = await self.async_client.get(reverse('api-current-weather-async'), {'city': 'Badulla'})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.json()['city_name'], 'Badulla')
+            self.assertEqual(res['X-Cache'], 'MISS')
+
+            res = await self.async_client.get(reverse('api-daily-forecast-async'), {'city': 'Badulla', 'days': 3})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(res.json()), 3)
+
+            etag = res['ETag']
+            res = await self.async_client.get(
+                reverse('api-daily-forecast-async'), {'city': 'Badulla', 'days': 3}, headers={'if-none-match': etag}
+            )
+            self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = await self.async_client.get(reverse('api-hourly-forecast-async'), {'city': 'Atlantis'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_concurrent_refreshes_share_one_upstream_call(self):
+        calls = []
+
+        async def fetch(city_name):
+            calls.append(city_name)
+            await asyncio.sleep(0.05)
+            return dict(SAMPLE_CURRENT)
+
+        with mock.patch('weather.services.afetch_current_weather', side_effect=fetch):
+            results = await asyncio.gather(*(
+                services.aget_or_update_current_weather(self.city) for _ in range(20)
+            ))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r.temperature == SAMPLE_CURRENT['temperature'] for r in results))
+
+    def test_client_retries_then_converts_errors(self):
+        responses = iter([httpx.Response(503), httpx.Response(200, json={'ok': True})])
+        client = AsyncOWMClient(
+            OWMClient(), backoff_factor=0,
+            transport=httpx.MockTransport(lambda request: next(responses)),
+        )
+        with mock.patch('weather.quota.try_acquire', return_value=True):
+            self.assertEqual(asyncio.run(client.get_json('http://owm.test/data')), {'ok': True})
+
+        failing = AsyncOWMClient(
+            OWMClient(), max_retries=1, backoff_factor=0,
+            transport=httpx.MockTransport(lambda request: httpx.Response(500)),
+        )
+        with mock.patch('weather.quota.try_acquire', return_value=True):
+            with self.assertRaises(requests.HTTPError) as ctx:
+                asyncio.run(failing.get_json('http://owm.test/data'))
+        self.assertEqual(ctx.exception.response.status_code, 500)
+        self.assertEqual(failing.sync.breaker.failures, 1)
+
+    def test_client_respects_quota(self):
+        sent = []
+        client = AsyncOWMClient(
+            OWMClient(), transport=httpx.MockTransport(lambda request: sent.append(request) or httpx.Response(200))
+        )
+        with mock.patch('weather.quota.try_acquire', return_value=False):
+            with self.assertRaises(QuotaExceededError):
+                asyncio.run(client.get_json('http://owm.test/data'))
+        self.assertEqual(sent, [])
+        self.assertEqual(client.sync.breaker.failures, 0)
+
+
+class CityRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.nuwara = City.objects.create(name='Nuwara Eliya', lat=6.95, lon=80.79, province='Central')
+        self.trinco = City.objects.create(
+            name='Trincomalee', lat=8.59, lon=81.22, province='Eastern', aliases=['Trinco']
+        )
+        self.ella = City.objects.create(name='Ella', lat=6.87, lon=81.05, province='Uva')
+        self.registry = city_registry.registry
+
+    def test_normalize(self):
+        self.assertEqual(city_registry.normalize('  Nuwara-Éliya '), 'nuwara eliya')
+        self.assertEqual(city_registry.normalize('KANDY'), 'kandy')
+
+    def test_resolve_without_queries(self):
+        self.registry.index()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.registry.resolve('nuwara-eliya'), self.nuwara.pk)
+            self.assertEqual(self.registry.resolve('NuwaraEliya'), self.nuwara.pk)
+            self.assertEqual(self.registry.resolve('trinco'), self.trinco.pk)
+            self.assertEqual(self.registry.resolve('Ëlla'), self.ella.pk)
+        self.assertIsNone(self.registry.resolve('Atlantis'))
+
+    def test_search_ranks_names_before_aliases_and_words(self):
+        self.registry.index()
+        with self.assertNumQueries(0):
+            self.assertEqual([c['name'] for c in self.registry.search('tri')], ['Trincomalee'])
+            self.assertEqual([c['name'] for c in self.registry.search('el')], ['Ella', 'Nuwara Eliya'])
+        self.assertEqual(self.registry.search('xyz'), [])
+
+    def test_reloads_on_city_changes(self):
+        self.registry.index()
+        City.objects.create(name='Kandy', lat=7.29, lon=80.63, province='Central', aliases=['Mahanuwara'])
+        self.assertIsNotNone(self.registry.resolve('mahanuwara'))
+        self.ella.delete()
+        self.assertIsNone(self.registry.resolve('Ella'))
+
+        # Saving fields the index doesn't use keeps it
+        index = self.registry.index()
+        self.trinco.owm_id = 1226260
+        self.trinco.save(update_fields=['owm_id'])
+        self.assertIs(self.registry.index(), index)
+
+    def test_sees_cities_added_by_other_processes(self):
+        self.registry.index()
+        # bulk_create sends no signals, like a save made in another process
+        kandy, = City.objects.bulk_create([City(name='Kandy', lat=7.29, lon=80.63, province='Central')])
+        self.assertEqual(self.registry.resolve('kandy'), kandy.pk)
+
+        City.objects.bulk_create([City(name='Matale', lat=7.47, lon=80.62, province='Central')])
+        with mock.patch('weather.city_registry.time.monotonic', return_value=time.monotonic() + 60):
+            self.assertEqual([c['name'] for c in self.registry.search('mat')], ['Matale'])
+
+    def test_reloads_after_batch_fills_coordinates(self):
+        galle = City.objects.create(name='Galle', lat=0, lon=0, province='Southern')
+        self.registry.index()
+        services.save_current_weather_batch([(galle, dict(SAMPLE_CURRENT, lat=6.05, lon=80.22))])
+        self.assertEqual(self.registry.nearest(6.05, 80.22)[0][0]['id'], galle.id)
+
+    def test_search_endpoint(self):
+        url = reverse('api-city-search')
+        res = self.client.get(url, {'q': 'nuw'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]['name'], 'Nuwara Eliya')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag']).status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.client.get(url, {'q': 'nuw'}, HTTP_IF_NONE_MATCH=res['ETag']).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+        self.assertEqual([c['name'] for c in self.client.get(url).data], ['Ella', 'Nuwara Eliya', 'Trincomalee'])
+        self.assertEqual(self.client.get(url, {'limit': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_weather_views_resolve_aliases(self):
+        CurrentWeather.objects.create(city=self.trinco, temperature=32, condition='Clear', humidity=70, wind_speed=9)
+        res = self.client.get(reverse('api-current-weather'), {'city': 'Trinco'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['city_name'], 'Trincomalee')
+
+
+@override_settings(OPENWEATHERMAP_ONECALL=False, WEATHER_STALE_WHILE_REVALIDATE=False)
+class UnknownCityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse('api-current-weather')
+        self.fixtures = tempfile.TemporaryDirectory()
+        self.addCleanup(self.fixtures.cleanup)
+        self.addCleanup(reset_client)
+
+    def test_unknown_names_are_negatively_cached(self):
+        with mock.patch.object(services, 'fetch_geocode', return_value=None) as geocode:
+            for _ in range(3):
+                res = self.client.get(self.url, {'city': 'Xyzzyville'})
+                self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+            res = self.client.get(self.url, {'city': 'xyzzy-ville'})  # Same name, normalized
+        self.assertEqual(geocode.call_count, 1)
+        self.assertFalse(City.objects.filter(name__iexact='Xyzzyville').exists())
+
+    def test_failed_lookups_are_not_cached(self):
+        with mock.patch.object(services, 'fetch_geocode', side_effect=requests.ConnectionError('down')) as geocode:
+            self.client.get(self.url, {'city': 'Kegalle'})
+            self.client.get(self.url, {'city': 'Kegalle'})
+        self.assertEqual(geocode.call_count, 2)
+
+    def test_new_city_created_from_geocoder(self):
+        with override_settings(OPENWEATHERMAP_PROVIDER='fake', OPENWEATHERMAP_FIXTURES_DIR=self.fixtures.name):
+            reset_client()
+            res = self.client.get(self.url, {'city': 'kegalle'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        city = City.objects.get(name='Kegalle')
+        self.assertTrue(city.province.endswith('Province'))
+        self.assertEqual(res.data['city_name'], 'Kegalle')
+
+    def test_geocoder_spelling_of_existing_city(self):
+        kandy = City.objects.create(name='Kandy', lat=7.29, lon=80.63, province='Central')
+        CurrentWeather.objects.create(city=kandy, temperature=26, condition='Rain', humidity=88, wind_speed=6)
+        place = {'name': 'Kandy', 'lat': 7.29, 'lon': 80.63, 'province': 'Central Province'}
+        with mock.patch.object(services, 'fetch_geocode', return_value=place):
+            res = self.client.get(self.url, {'city': 'Kandy City'})
+        self.assertEqual(res.data['city_name'], 'Kandy')
+        self.assertEqual(City.objects.count(), 1)
+
+    @mock.patch.object(NewCityRateThrottle, 'THROTTLE_RATES', {'new_city': '2/hour'})
+    def test_new_city_lookups_are_rate_limited_per_client(self):
+        with mock.patch.object(services, 'fetch_geocode', return_value=None) as geocode:
+            codes = [self.client.get(self.url, {'city': name}).status_code for name in ('Aaa', 'Bbb', 'Ccc')]
+            # Names already looked up don't count against the limit
+            cached = self.client.get(self.url, {'city': 'Aaa'}).status_code
+            other_client = self.client.get(self.url, {'city': 'Ddd'}, REMOTE_ADDR='10.0.0.2').status_code
+        self.assertEqual(codes, [404, 404, 429])
+        self.assertEqual(cached, 404)
+        self.assertEqual(other_client, 404)
+        self.assertEqual(geocode.call_count, 3)
+
+
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.colombo = City.objects.create(name='Colombo', lat=6.93, lon=79.86, province='Western')
+        self.negombo = City.objects.create(name='Negombo', lat=7.21, lon=79.84, province='Western')
+        self.kandy = City.objects.create(name='Kandy', lat=7.29, lon=80.63, province='Central')
+        self.jaffna = City.objects.create(name='Jaffna', lat=9.66, lon=80.03, province='Northern')
+        for city in (self.colombo, self.negombo):
+            CurrentWeather.objects.create(city=city, temperature=31, condition='Clear', humidity=70, wind_speed=9)
+
+    def test_kdtree_matches_brute_force(self):
+        rng = random.Random(7)
+        points = [(rng.uniform(-60, 60), rng.uniform(-179, 179), i) for i in range(200)]
+        tree = KDTree(points)
+        for _ in range(50):
+            lat, lon, k = rng.uniform(-60, 60), rng.uniform(-180, 180), rng.randint(1, 5)
+            expected = sorted((haversine_km(lat, lon, p[0], p[1]), p[2]) for p in points)[:k]
+            self.assertEqual([i for _, i in tree.nearest(lat, lon, k)], [i for _, i in expected])
+        inside = sorted(tree.within(-10, -20, 30, 40))
+        self.assertEqual(inside, sorted(p[2] for p in points if -10 <= p[0] <= 30 and -20 <= p[1] <= 40))
+
+    def test_nearest_endpoint(self):
+        city_registry.registry.index()
+        res = self.client.get(reverse('api-nearest-weather'), {'lat': 7.0, 'lon': 79.9, 'k': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['city'] for r in res.data], ['Colombo', 'Negombo'])
+        self.assertLess(res.data[0]['distance_km'], res.data[1]['distance_km'])
+        self.assertEqual(res.data[0]['weather']['temperature'], 31)
+
+        for params in ({'lat': 7.0}, {'lat': 'x', 'lon': 1}, {'lat': 95, 'lon': 80}, {'lat': 7, 'lon': 80, 'k': 0}):
+            res = self.client.get(reverse('api-nearest-weather'), params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_explorer_bbox(self):
+        url = reverse('api-explorer-cities')
+        res = self.client.get(url, {'bbox': '79.5,6.5,80.0,7.5'})
+        self.assertEqual(sorted(c['name'] for c in res.data), ['Colombo', 'Negombo'])
+        self.assertNotEqual(res['ETag'], self.client.get(url)['ETag'])
+        self.assertEqual(len(self.client.get(url).data), 4)
+        self.assertEqual(self.client.get(url, {'bbox': '81,6,80,7'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HistoryRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86, province='Western')
+
+    def add_days(self, start, days, **values):
+        records = [
+            HistoricalRecord(
+                city=self.city, date=start + timedelta(days=i), avg_temp=values.get('avg_temp', 27 + i % 3),
+                max_temp=31, min_temp=23, rainfall=values.get('rainfall', 5), humidity=80,
+                is_extreme_event=i == 0,
+            )
+            for i in range(days)
+        ]
+        HistoricalRecord.objects.bulk_create(records)
+        rollups.refresh([(self.city.pk, r.date) for r in records])
+        return records
+
+    def test_single_writes_update_month_and_year(self):
+        record = HistoricalRecord.objects.create(
+            city=self.city, date=date(2020, 3, 5), avg_temp=28, rainfall=12, humidity=75
+        )
+        HistoricalRecord.objects.create(city=self.city, date=date(2020, 7, 1), avg_temp=26, rainfall=30)
+        month = HistoryRollup.objects.get(city=self.city, period=HistoryRollup.MONTH, start=date(2020, 3, 1))
+        year = HistoryRollup.objects.get(city=self.city, period=HistoryRollup.YEAR, start=date(2020, 1, 1))
+        self.assertEqual((month.days, month.rainfall_sum, month.avg_humidity), (1, 12, 75))
+        self.assertEqual((year.days, year.rainfall_sum, year.avg_temp), (2, 42, 27))
+
+        record.delete()
+        self.assertFalse(HistoryRollup.objects.filter(period=HistoryRollup.MONTH, start=date(2020, 3, 1)).exists())
+        self.assertEqual(HistoryRollup.objects.get(period=HistoryRollup.YEAR).days, 1)
+
+    def test_bulk_deletes_recompute_each_year_once(self):
+        self.add_days(date(2020, 12, 1), 62)
+        with mock.patch('weather.rollups._refresh_year', wraps=rollups._refresh_year) as refresh_year:
+            with self.captureOnCommitCallbacks(execute=True):
+                HistoricalRecord.objects.filter(date__day__lte=10).delete()
+            self.assertEqual(sorted(call.args for call in refresh_year.call_args_list), [
+                (self.city.pk, 2020), (self.city.pk, 2021),
+            ])
+            self.assertEqual(HistoryRollup.objects.get(start=date(2021, 1, 1), period=HistoryRollup.MONTH).days, 21)
+
+            refresh_year.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.city.delete()
+            refresh_year.assert_not_called()
+        self.assertFalse(HistoryRollup.objects.exists())
+
+    def test_rebuild_matches_incremental(self):
+        self.add_days(date(2019, 12, 20), 40)
+        fields = ['period', 'start', *rollups.TOTAL_FIELDS]
+        incremental = list(HistoryRollup.objects.order_by('period', 'start').values_list(*fields))
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertIn('Wrote 4 rollup rows', out.getvalue())
+        self.assertEqual(list(HistoryRollup.objects.order_by('period', 'start').values_list(*fields)), incremental)
+
+    def test_views_read_rollups(self):
+        self.add_days(date(2021, 1, 1), 59, rainfall=2)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('api-history-chart'), {'city': 'Colombo', 'start': 2021, 'end': 2021})
+        self.assertEqual(res.data['labels'], ['Jan 2021', 'Feb 2021'])
+        self.assertEqual(res.data['rainfall'], [62, 56])
+        self.assertTrue(all('weather_historicalrecord' not in q['sql'] for q in queries.captured_queries))
+
+        res = self.client.get(reverse('api-history-stats'), {'city': 'Colombo', 'start': 2021, 'end': 2021})
+        self.assertEqual(res.data['total_rainfall'], 118)
+        self.assertEqual(res.data['avg_humidity'], 80)
+        self.assertEqual(res.data['extreme_events'], 1)
+
+        # Long ranges switch to one point per year
+        res = self.client.get(reverse('api-history-chart'), {'city': 'Colombo', 'start': 1990, 'end': 2021})
+        self.assertEqual(res.data['labels'], ['2021'])
+
+
+class HistoryTrendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86, province='Western')
+
+    def add_months(self, first_year, years, warming=0.0, rain_growth=0.0):
+        """Monthly rollups with a seasonal cycle plus a linear trend per year"""
+        rows = []
+        for year in range(first_year, first_year + years):
+            for month in range(1, 13):
+                t = year - first_year + (month - 0.5) / 12
+                temp = 27 + 2 * math.sin(month / 12 * 2 * math.pi) + warming * t
+                rain = (5 + 4 * math.cos(month / 12 * 2 * math.pi)) * (1 + rain_growth * t)
+                rows.append(HistoryRollup(
+                    city=self.city, period=HistoryRollup.MONTH, start=date(year, month, 1), days=30,
+                    temp_sum=temp * 30, max_temp=temp + 4, min_temp=temp - 4, rainfall_sum=rain * 30,
+                    humidity_sum=80 * 30, humidity_days=30, extreme_events=year % 2,
+                ))
+        HistoryRollup.objects.bulk_create(rows)
+
+    def test_recovers_linear_trends(self):
+        self.add_months(1994, 30, warming=0.03, rain_growth=0.01)
+        with self.assertNumQueries(1):
+            started = time.perf_counter()
+            stats = trends.summary(self.city.pk, 1994, 2023)
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 0.5)  # ~2ms here; generous for slow CI machines
+
+        self.assertAlmostEqual(stats['slopes']['temp'], 0.03, places=3)
+        self.assertEqual(stats['slopes']['humidity'], 0)
+        # The fitted warming across the range, relative to the mean temperature
+        self.assertAlmostEqual(stats['temp_trend'], 0.03 * 29.92 / stats['avg_temp'] * 100, places=0)
+        self.assertGreater(stats['rainfall_trend'], 0)
+        self.assertEqual(len(stats['yearly']), 30)
+        self.assertAlmostEqual(stats['yearly'][1]['temp_change'], 0.03, places=2)
+        self.assertEqual([y['events_change'] for y in stats['yearly'][:3]], [None, 12.2, -12.2])
+
+    def test_no_data_has_no_defaults(self):
+        stats = trends.summary(self.city.pk, 2018, 2023)
+        self.assertIsNone(stats['avg_temp'])
+        self.assertIsNone(stats['total_rainfall'])
+        self.assertIsNone(stats['temp_trend'])
+        self.assertEqual(stats['yearly'], [])
+
+        # A single year has totals but no trend
+        self.add_months(2020, 1, warming=1)
+        stats = trends.summary(self.city.pk, 2020, 2020)
+        self.assertEqual(stats['extreme_events'], 0)
+        self.assertIsNone(stats['temp_trend'])
+
+    def test_view_caches_until_history_changes(self):
+        self.add_months(2018, 6)
+        params = {'city': 'Colombo', 'start': 2018, 'end': 2023}
+        res = self.client.get(reverse('api-history-stats'), params)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['avg_humidity'], 80)
+        self.assertEqual(self.client.get(reverse('api-history-stats'), params)['X-Cache'], 'HIT')
+
+        HistoricalRecord.objects.create(city=self.city, date=date(2024, 1, 1), avg_temp=30)
+        self.assertEqual(self.client.get(reverse('api-history-stats'), params)['X-Cache'], 'MISS')
+
+
+class HistoryQueryPlanTests(TestCase):
+    """History range lookups must stay index range scans as the tables grow"""
+
+    def setUp(self):
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86, province='Western')
+        HistoricalRecord.objects.create(city=self.city, date=date(2020, 5, 1), avg_temp=28, rainfall=3)
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheaper to scan; make the planner show its index choice
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertRangeScan(self, queryset, index, column):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertRegex(plan, rf'(Index Scan|Index Only Scan) using {index}|Bitmap Index Scan on {index}')
+            self.assertRegex(plan, rf'Index Cond: .*{column} >=')
+        else:
+            self.assertRegex(plan, rf'SEARCH \w+ USING (COVERING )?INDEX {index} \(city_id=\?.* {column}>\? AND {column}<\?\)')
+
+    def test_daily_ranges_use_covering_index(self):
+        start, end = rollups.year_range(2020, 2020)
+        self.assertEqual((start, end), (date(2020, 1, 1), date(2021, 1, 1)))
+        records = rollups.daily_records(self.city.pk, start, end)
+        self.assertNotIn('django_date_extract', str(records.query))
+        self.assertRangeScan(records.values('avg_temp', 'rainfall'), 'history_city_date_cover', 'date')
+
+    def test_rollup_ranges_use_unique_index(self):
+        points = rollups.periods(self.city.pk, HistoryRollup.MONTH, *rollups.year_range(2018, 2023))
+        self.assertRangeScan(points.order_by('start'), r'weather_historyrollup_city_id_period_start_\w+', 'start')
+
+    def test_invalid_years(self):
+        client = APIClient()
+        for params in ({'start': 'x'}, {'start': 2023, 'end': 2018}, {'end': 10 ** 6}):
+            res = client.get(reverse('api-history-stats'), {'city': 'Colombo', **params})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client.get(reverse('api-history-chart'), {'start': 'x'}).status_code, 400)
+
+
+class HistoryStoreTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(HISTORY_STORE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86, province='Western')
+
+    def add(self, day, **values):
+        with self.captureOnCommitCallbacks(execute=True):
+            return HistoricalRecord.objects.create(
+                city=self.city, date=day, avg_temp=values.get('avg_temp', 27), rainfall=values.get('rainfall', 0),
+                humidity=values.get('humidity'), is_extreme_event=values.get('extreme', False),
+            )
+
+    def test_writes_keep_the_store_in_sync(self):
+        self.add(date(2020, 3, 1), avg_temp=28.5, rainfall=12, humidity=80)
+        self.add(date(2020, 3, 3), avg_temp=26, extreme=True)
+        first, columns = history_store.get_store().slice(self.city.pk, date(2020, 3, 1), date(2020, 3, 4))
+        self.assertEqual(first, date(2020, 3, 1))
+        self.assertIsInstance(columns['avg_temp'].base, np.memmap)  # A view, not a copy
+        np.testing.assert_array_equal(columns['avg_temp'], [28.5, np.nan, 26])
+        np.testing.assert_array_equal(columns['humidity'], [80, np.nan, np.nan])
+        np.testing.assert_array_equal(columns['is_extreme_event'], [0, 0, 1])
+
+        # An earlier year grows the files without losing what was there
+        self.add(date(1990, 1, 1), avg_temp=25)
+        city = history_store.get_store().columns(self.city.pk)
+        self.assertEqual(date.fromordinal(city.start), date(1990, 1, 1))
+        _, columns = city.slice(date(1990, 1, 1), date(2021, 1, 1), ['avg_temp'])
+        self.assertEqual(np.count_nonzero(~np.isnan(columns['avg_temp'])), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            HistoricalRecord.objects.filter(date=date(2020, 3, 3)).get().delete()
+        _, columns = history_store.get_store().slice(self.city.pk, date(2020, 3, 3), date(2020, 3, 4))
+        self.assertTrue(np.isnan(columns['avg_temp'][0]))
+
+    def test_rebuild_and_daily_chart(self):
+        HistoricalRecord.objects.bulk_create([
+            HistoricalRecord(city=self.city, date=date(1995, 1, 1) + timedelta(days=i), avg_temp=20 + i % 10,
+                             rainfall=i % 7, humidity=None if i % 5 else 70)
+            for i in range(0, 3000, 3)
+        ])
+        params = {'city': 'Colombo', 'start': 1995, 'end': 2003, 'resolution': 'day'}
+        with override_settings(HISTORY_STORE_DIR=''):
+            from_table = self.client.get(reverse('api-history-chart'), params).data
+
+        out = StringIO()
+        call_command('rebuild_history_store', stdout=out)
+        self.assertIn('Stored 1000 daily records', out.getvalue())
+        with self.assertNumQueries(1):  # Only the city
+            from_store = self.client.get(reverse('api-history-chart'), params).data
+        self.assertEqual(from_store, from_table)
+        self.assertEqual(from_store['labels'][:2], ['1995-01-01', '1995-01-04'])
+        self.assertEqual(from_store['humidity'][:2], [70, None])
+
+
+class HistoryImportTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.city = City.objects.create(name='Colombo', lat=6.93, lon=79.86, province='Western')
+        self.kandy = City.objects.create(name='Kandy', lat=7.29, lon=80.63, province='Central', aliases=['Senkadagala'])
+
+    def test_normalize_units(self):
+        row = history_import.normalize(
+            {'City': 'Colombo', 'date': '2020-01-02T00:00', 'tmax': '95', 'tmin': '77', 'precip': '1', 'extreme': 'yes'},
+            temp_unit='F', rain_unit='in',
+        )
+        self.assertEqual((row['date'], row['max_temp'], row['min_temp'], row['avg_temp']), (date(2020, 1, 2), 35, 25, 30))
+        self.assertEqual((row['rainfall'], row['is_extreme_event']), (25.4, True))
+        row = history_import.normalize({'city': 'Kandy', 'date': '2020-01-02', 'avg_temp': 300, 'temp_unit': 'K'})
+        self.assertEqual(row['avg_temp'], 26.85)
+
+        for bad in ({'date': '2020-01-02', 'avg_temp': 1}, {'city': 'Kandy', 'date': '02/01/2020', 'avg_temp': 1},
+                    {'city': 'Kandy', 'date': '2020-01-02', 'avg_temp': 80},
+                    {'city': 'Kandy', 'date': '2020-01-02', 'avg_temp': 20, 'humidity': 120},
+                    {'city': 'Kandy', 'date': '2020-01-02'}):
+            with self.assertRaises(history_import.InvalidRow):
+                history_import.normalize(bad)
+
+    def test_import_gzipped_csv(self):
+        HistoricalRecord.objects.create(city=self.city, date=date(2021, 1, 1), avg_temp=20, rainfall=99)
+        path = self.dir / 'obs.csv.gz'
+        with gzip.open(path, 'wt', newline='') as f:
+            f.write('city,date,avg_temp,rainfall,humidity,is_extreme_event\n')
+            f.write('colombo,2021-01-01,27.5,12,80,false\n')  # Replaces the existing record
+            f.write('Senkadagala,2021-01-01,24,3,,1\n')
+            f.write('Atlantis,2021-01-01,24,3,,\n')
+            f.write('Kandy,not-a-date,24,3,,\n')
+            f.write('Kandy,2022-06-30,25,0,70,\n')
+        out = StringIO()
+        call_command('import_history', str(path), '--batch-size', '2', stdout=out)
+        self.assertIn('Imported 3 of 5 rows', out.getvalue())
+        self.assertIn("obs.csv.gz:4: unknown city 'Atlantis'", out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+        record = HistoricalRecord.objects.get(city=self.city, date=date(2021, 1, 1))
+        self.assertEqual((record.avg_temp, record.rainfall, record.humidity), (27.5, 12, 80))
+        kandy = HistoricalRecord.objects.filter(city=self.kandy).order_by('date')
+        self.assertEqual([(r.date, r.is_extreme_event, r.humidity) for r in kandy],
+                         [(date(2021, 1, 1), True, None), (date(2022, 6, 30), False, 70)])
+        # Raw writes still refresh the rollups
+        year = HistoryRollup.objects.get(city=self.city, period=HistoryRollup.YEAR)
+        self.assertEqual(year.rainfall_sum, 12)
+        self.assertEqual(HistoryRollup.objects.filter(city=self.kandy, period=HistoryRollup.YEAR).count(), 2)
+
+    def test_import_ndjson(self):
+        path = self.dir / 'obs.ndjson'
+        path.write_text(
+            '{"city": "Kandy", "date": "2020-05-01", "temperature": 68, "temp_unit": "F", "rain": 2, "rainfall_unit": "cm"}\n'
+            '\n'
+            'not json\n'
+            '{"city": "Kandy", "date": "2020-05-01", "temperature": 21}\n'
+        )
+        report = history_import.import_files([path])
+        # Both valid rows are for the same day, so one record is written
+        self.assertEqual((report.read, report.imported, report.invalid), (3, 1, 1))
+        self.assertIn('obs.ndjson:3: not a JSON object', report.errors[0])
+        record = HistoricalRecord.objects.get(city=self.kandy)  # The later row wins
+        self.assertEqual((record.avg_temp, record.rainfall), (21, 0))
+
+        path.write_text('{"city": "Kandy", "date": "2020-05-01", "temperature": 68, "temp_unit": "F", "rain": 2, "rainfall_unit": "cm"}\n')
+        history_import.import_files([path])
+        record.refresh_from_db()
+        self.assertEqual((record.avg_temp, record.rainfall), (20, 20))
+
+    def test_failed_file_keeps_earlier_batches_consistent(self):
+        good = self.dir / 'good.csv'
+        good.write_text('city,date,avg_temp,rainfall\nKandy,2019-03-01,24,7\n')
+        truncated = self.dir / 'bad.csv.gz'
+        truncated.write_bytes(gzip.compress(b'city,date,avg_temp\n' + b'Kandy,2019-03-02,24\n' * 100)[:60])
+        latin1 = self.dir / 'latin1.csv'
+        latin1.write_bytes('city,date,avg_temp\nGalle \xe9,2019-03-02,24\n'.encode('latin-1'))
+
+        for bad in (truncated, latin1, self.dir / 'missing.csv'):
+            with self.subTest(bad.name), self.assertRaisesMessage(CommandError, 'were kept'):
+                call_command('import_history', str(good), str(bad), stdout=StringIO())
+        year = HistoryRollup.objects.get(city=self.kandy, period=HistoryRollup.YEAR)
+        self.assertEqual((year.days, year.rainfall_sum), (1, 7))
+
+
+class LiveStreamTests(TestCase):
+    def setUp(self):
+        self.city = City.objects.create(name='Matara', lat=5.95, lon=80.54, province='Southern')
+        self.broadcaster = broadcast.get_broadcaster()
+
+    def test_subscription_filters(self):
+        async def run():
+            sub = self.broadcaster.subscribe(city_ids=[self.city.pk], severities=['red'])
+            try:
+                events = [
+                    {'type': 'weather', 'city_id': self.city.pk},
+                    {'type': 'weather', 'city_id': self.city.pk + 1},
+                    {'type': 'alert', 'severity': 'RED'},
+                    {'type': 'alert', 'severity': 'YELLOW'},
+                ]
+                # Publishers run on other threads (request handlers, refresh workers)
+                publisher = threading.Thread(target=lambda: [self.broadcaster.publish(e) for e in events])
+                publisher.start()
+                publisher.join()
+                await asyncio.sleep(0)
+                return [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+            finally:
+                self.broadcaster.unsubscribe(sub)
+
+        received = asyncio.run(run())
+        self.assertEqual(received, [{'type': 'weather', 'city_id': self.city.pk}, {'type': 'alert', 'severity': 'RED'}])
+
+    def test_ingest_and_alert_writes_publish_after_commit(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sub = broadcast.Subscription(city_ids=[self.city.pk], loop=loop)
+        self.broadcaster.subscriptions.add(sub)
+        self.addCleanup(self.broadcaster.unsubscribe, sub)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.save_current_weather(self.city, dict(SAMPLE_CURRENT))
+            WeatherAlert.objects.create(severity='ORANGE', title='Rain', district='Matara', description='Heavy rain')
+        loop.run_until_complete(asyncio.sleep(0))
+
+        events = [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+        self.assertEqual([e['type'] for e in events], ['weather', 'alert'])
+        self.assertEqual(events[0]['temperature'], SAMPLE_CURRENT['temperature'])
+
+    def test_event_stream_format(self):
+        async def run():
+            stream = api_views.event_stream([self.city.pk], [], heartbeat=0.01)
+            chunks = [await anext(stream), await anext(stream)]
+            self.broadcaster.publish({'type': 'forecast', 'city_id': self.city.pk, 'city': 'Matara'})
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        retry, keep_alive, event = asyncio.run(run())
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertEqual(keep_alive, ': keep-alive\n\n')
+        self.assertTrue(event.startswith('event: forecast\ndata: {'))
+        self.assertFalse(self.broadcaster.subscriptions)
+
+    async def test_unknown_city(self):
+        res = await self.async_client.get(reverse('api-stream'), {'cities': 'Atlantis'})
+        self.assertEqual(res.status_code, 404)
+
+    def test_refused_under_wsgi(self):
+        res = self.client.get(reverse('api-stream'), {'cities': 'Matara'})
+        self.assertEqual(res.status_code, 503)
+        self.assertFalse(res.streaming)
@@ -0,0 +1,20 @@
+"""
+Request throttles for endpoints that can cost upstream calls.
+"""
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class NewCityRateThrottle(SimpleRateThrottle):
+    """
+    Geocoder lookups of unknown city names per client (user, or IP when
+    anonymous). Rate: REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['new_city'].
+    """
+    scope = 'new_city'
+
+    def get_cache_key(self, request, view):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
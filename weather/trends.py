@@ -0,0 +1,142 @@
+"""
+Climate statistics and trends of a city's history, computed with NumPy over
+its monthly rollups: one query and a few array operations whatever the length
+of the range. Each metric is turned into a daily rate per month, the seasonal
+cycle is removed by subtracting the range's mean for each calendar month, and
+the trend is the weighted least-squares slope of what is left.
+"""
+import numpy as np
+
+from .models import HistoryRollup
+from .rollups import periods, year_range
+
+DAYS_PER_YEAR = 365.25
+
+# Row order of the metric arrays
+TEMP, RAINFALL, HUMIDITY, EVENTS = range(4)
+
+
+def _monthly_arrays(city_id, start_year, end_year):
+    """(month numbers, values, weights) with values and weights shaped (4, months)"""
+    start, end = year_range(start_year, end_year)
+    rows = list(periods(city_id, HistoryRollup.MONTH, start, end).order_by('start').values_list(
+        'start', 'days', 'temp_sum', 'rainfall_sum', 'humidity_sum', 'humidity_days', 'extreme_events',
+    ))
+    months = np.array([start.year * 12 + start.month - 1 for start, *_ in rows], dtype=np.int64)
+    days, temp, rainfall, humidity, humidity_days, events = np.array(
+        [row[1:] for row in rows], dtype=np.float64,
+    ).reshape(-1, 6).T
+
+    sums = np.stack([temp, rainfall, humidity, events])
+    weights = np.stack([days, days, humidity_days, days])
+    values = np.divide(sums, weights, out=np.zeros_like(sums), where=weights > 0)
+    return months, values, weights
+
+
+def _slopes(t, values, weights):
+    """Weighted least-squares slope of each row of values against t"""
+    total = weights.sum(axis=1)
+    safe = np.where(total > 0, total, 1)
+    t_mean = (weights * t).sum(axis=1) / safe
+    y_mean = (weights * values).sum(axis=1) / safe
+    dt = t - t_mean[:, None]
+    spread = (weights * dt ** 2).sum(axis=1)
+    slopes = (weights * dt * (values - y_mean[:, None])).sum(axis=1) / np.where(spread > 0, spread, 1)
+    return np.where(spread > 0, slopes, np.nan)
+
+
+def _deseasonalize(months, values, weights):
+    """Values minus the weighted mean of their calendar month over the range"""
+    calendar = months % 12
+    means = np.stack([
+        np.bincount(calendar, w * v, minlength=12) / np.maximum(np.bincount(calendar, w, minlength=12), 1e-12)
+        for v, w in zip(values, weights)
+    ])
+    return values - means[:, calendar]
+
+
+def _round(value, digits=1):
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+
+def _percent(change, mean):
+    return change / mean * 100 if mean else np.nan
+
+
+def summary(city_id, start_year, end_year):
+    """
+    Totals, averages and trends of a city's history from start_year to
+    end_year inclusive. Trend percentages are the fitted change across the
+    range relative to the range's mean; events_trend is the fitted change in
+    events per year. Values are None where there is no data, and trends are
+    None for ranges covering fewer than two years.
+    """
+    months, values, weights = _monthly_arrays(city_id, start_year, end_year)
+    totals = weights.sum(axis=1)
+    safe = np.where(totals > 0, totals, 1)
+    means = np.where(totals > 0, (values * weights).sum(axis=1) / safe, np.nan)
+    days = totals[TEMP]
+
+    # Time in years at the middle of each month
+    t = (months + 0.5) / 12
+    slopes = _slopes(t, _deseasonalize(months, values, weights), weights)
+    multi_year = len(months) and months[-1] // 12 > months[0] // 12
+    if not multi_year:
+        slopes[:] = np.nan
+    span = t[-1] - t[0] if len(t) else 0
+    # Daily rates per year -> yearly amounts per year
+    annual = slopes * np.array([1, DAYS_PER_YEAR, 1, DAYS_PER_YEAR])
+
+    return {
+        'avg_temp': _round(means[TEMP]),
+        'total_rainfall': _round(means[RAINFALL] * days) if days else None,
+        'avg_humidity': _round(means[HUMIDITY]),
+        'extreme_events': int(round(means[EVENTS] * days)) if days else None,
+        'temp_trend': _round(_percent(slopes[TEMP] * span, means[TEMP])),
+        'rainfall_trend': _round(_percent(slopes[RAINFALL] * span, means[RAINFALL])),
+        'humidity_trend': _round(_percent(slopes[HUMIDITY] * span, means[HUMIDITY])),
+        'events_trend': _round(annual[EVENTS] * span),
+        'slopes': {
+            'temp': _round(annual[TEMP], 3),  # °C per year
+            'rainfall': _round(annual[RAINFALL], 1),  # mm/year per year
+            'humidity': _round(annual[HUMIDITY], 3),  # percentage points per year
+            'events': _round(annual[EVENTS], 3),  # events/year per year
+        },
+        'yearly': _yearly(months, values, weights),
+    }
+
+
+def _yearly(months, values, weights):
+    """
+    Each year's figures and its change from the year before. Rainfall and
+    event changes compare daily rates, so partly recorded years stay comparable.
+    """
+    if not len(months):
+        return []
+    years, index = np.unique(months // 12, return_inverse=True)
+    sums = np.stack([np.bincount(index, v * w, minlength=len(years)) for v, w in zip(values, weights)])
+    counts = np.stack([np.bincount(index, w, minlength=len(years)) for w in weights])
+    rates = np.divide(sums, counts, out=np.full_like(sums, np.nan), where=counts > 0)
+
+    changes = np.full_like(rates, np.nan)
+    changes[:, 1:] = rates[:, 1:] - rates[:, :-1]
+    previous = rates[RAINFALL, :-1]
+    changes[RAINFALL, 1:] = np.divide(
+        changes[RAINFALL, 1:] * 100, previous, out=np.full_like(previous, np.nan), where=previous > 0,
+    )
+    changes[EVENTS] *= DAYS_PER_YEAR
+
+    return [
+        {
+            'year': int(year),
+            'avg_temp': _round(rates[TEMP, i]),
+            'total_rainfall': _round(sums[RAINFALL, i]),
+            'avg_humidity': _round(rates[HUMIDITY, i]),
+            'extreme_events': int(sums[EVENTS, i]),
+            'temp_change': _round(changes[TEMP, i], 2),  # °C
+            'rainfall_change': _round(changes[RAINFALL, i]),  # % of the daily rate
+            'humidity_change': _round(changes[HUMIDITY, i], 2),  # percentage points
+            'events_change': _round(changes[EVENTS, i]),  # events per year
+        }
+        for i, year in enumerate(years)
+    ]
@@ -10,9 +10,15 @@ urlpatterns = [
     path('premium/', views.premium_view, name='premium'),
 
     # API endpoints
+    path('api/dashboard/', api_views.DashboardView.as_view(), name='api-dashboard'),
     path('api/weather/current/', api_views.CurrentWeatherView.as_view(), name='api-current-weather'),
+    path('api/weather/current/bulk/', api_views.BulkCurrentWeatherView.as_view(), name='api-current-weather-bulk'),
+    path('api/weather/nearest/', api_views.NearestWeatherView.as_view(), name='api-nearest-weather'),
     path('api/weather/hourly/', api_views.HourlyForecastView.as_view(), name='api-hourly-forecast'),
     path('api/weather/daily/', api_views.DailyForecastView.as_view(), name='api-daily-forecast'),
+    path('api/async/weather/current/', api_views.current_weather_async, name='api-current-weather-async'),
+    path('api/async/weather/hourly/', api_views.hourly_forecast_async, name='api-hourly-forecast-async'),
+    path('api/async/weather/daily/', api_views.daily_forecast_async, name='api-daily-forecast-async'),
 
     path('api/alerts/', api_views.AlertListView.as_view(), name='api-alerts'),
     path('api/alerts/stats/', api_views.AlertStatsView.as_view(), name='api-alert-stats'),
@@ -22,7 +28,9 @@ urlpatterns = [
     path('api/history/chart/', api_views.HistoryChartView.as_view(), name='api-history-chart'),
     path('api/history/climate-normals/', api_views.ClimateNormalView.as_view(), name='api-climate-normals'),
 
+    path('api/stream/', api_views.live_stream, name='api-stream'),
     path('api/activities/', api_views.ActivityView.as_view(), name='api-activities'),
+    path('api/cities/search/', api_views.CitySearchView.as_view(), name='api-city-search'),
     path('api/explorer/cities/', api_views.ExplorerCitiesView.as_view(), name='api-explorer-cities'),
     path('api/user/profile/', api_views.UserProfileView.as_view(), name='api-user-profile'),
     path('api/user/subscription/', api_views.SubscriptionToggleView.as_view(), name='api-user-subscription'),